@@ -0,0 +1,90 @@
+"""Minimal in-process ASGI client for benchmarks and scripts.
+
+Calls the app directly (no sockets, no server), so timings measure the
+application itself. Only what the benchmarks need: JSON or raw bodies,
+headers, query strings and the lifespan startup/shutdown.
+"""
+import asyncio
+import json as jsonlib
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+
+class ClientResponse:
+    def __init__(self, status: int, headers: Dict[str, str], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return jsonlib.loads(self.body)
+
+
+class ASGIClient:
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, url: str, json=None, body: bytes = b"",
+                      headers: Optional[Dict[str, str]] = None) -> ClientResponse:
+        parts = urlsplit(url)
+        raw_headers = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+        if json is not None:
+            body = jsonlib.dumps(json).encode()
+            raw_headers.append((b"content-type", b"application/json"))
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": method.upper(), "scheme": "http", "path": parts.path, "raw_path": parts.path.encode(),
+            "query_string": parts.query.encode(), "root_path": "", "headers": raw_headers,
+            "server": ("testserver", 80), "client": ("127.0.0.1", 50000),
+        }
+        sent = False
+        disconnected = asyncio.Event()
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        status, response_headers, chunks = 500, {}, []
+
+        async def send(message):
+            nonlocal status, response_headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_headers = {k.decode().lower(): v.decode() for k, v in message["headers"]}
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            disconnected.set()
+        return ClientResponse(status, response_headers, b"".join(chunks))
+
+    async def get(self, url: str, **kwargs) -> ClientResponse:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> ClientResponse:
+        return await self.request("POST", url, **kwargs)
+
+    @asynccontextmanager
+    async def lifespan(self):
+        """Run the app's startup and shutdown around the block"""
+        to_app: asyncio.Queue = asyncio.Queue()
+        from_app: asyncio.Queue = asyncio.Queue()
+        task = asyncio.create_task(self.app({"type": "lifespan", "asgi": {"version": "3.0"}},
+                                            to_app.get, from_app.put))
+        await to_app.put({"type": "lifespan.startup"})
+        message = await from_app.get()
+        if message["type"] != "lifespan.startup.complete":
+            raise RuntimeError(f"startup failed: {message.get('message', message)}")
+        try:
+            yield self
+        finally:
+            await to_app.put({"type": "lifespan.shutdown"})
+            await from_app.get()
+            await task
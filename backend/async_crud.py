@@ -0,0 +1,54 @@
+"""Awaitable versions of the crud.py functions.
+
+Each function takes either session type from database.AnySession:
+- AsyncSession (PIXELLAR_ASYNC_DB=1): the crud function runs via run_sync, so
+  every statement goes through aiosqlite without blocking the event loop;
+- Session: the crud function runs on the threadpool, as sync endpoints did.
+
+The query logic itself stays in crud.py.
+"""
+import functools
+
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import crud
+
+
+def _awaitable(fn):
+    @functools.wraps(fn)
+    async def wrapper(db, *args, **kwargs):
+        if isinstance(db, AsyncSession):
+            return await db.run_sync(fn, *args, **kwargs)
+        return await run_in_threadpool(fn, db, *args, **kwargs)
+    return wrapper
+
+
+# Users
+get_user = _awaitable(crud.get_user)
+get_user_by_username = _awaitable(crud.get_user_by_username)
+get_user_by_wallet = _awaitable(crud.get_user_by_wallet)
+get_user_by_profile = _awaitable(crud.get_user_by_profile)
+create_user = _awaitable(crud.create_user)
+list_users = _awaitable(crud.list_users)
+delete_user = _awaitable(crud.delete_user)
+
+# Artworks
+get_artwork = _awaitable(crud.get_artwork)
+get_artwork_pixels = _awaitable(crud.get_artwork_pixels)
+get_artwork_canvas = _awaitable(crud.get_artwork_canvas)
+get_artwork_version = _awaitable(crud.get_artwork_version)
+get_artwork_detail = _awaitable(crud.get_artwork_detail)
+get_artwork_cards = _awaitable(crud.get_artwork_cards)
+list_artworks = _awaitable(crud.list_artworks)
+search_artworks = _awaitable(crud.search_artworks)
+create_artwork = _awaitable(crud.create_artwork)
+update_artwork = _awaitable(crud.update_artwork)
+delete_artwork = _awaitable(crud.delete_artwork)
+find_duplicates = _awaitable(crud.find_duplicates)
+get_unlock_state = _awaitable(crud.get_unlock_state)
+record_unlock = _awaitable(crud.record_unlock)
+
+# Purchases
+record_purchase = _awaitable(crud.record_purchase)
+get_seller_sales = _awaitable(crud.get_seller_sales)
@@ -0,0 +1,451 @@
+"""Benchmark and load test for the whole API.
+
+Seeds a synthetic SQLite database (users, artworks with pixel data, search
+and dedup indexes, purchases) at the requested scale, then drives the app
+in-process through asgi_client, so no server or network is involved:
+
+1. latency: every endpoint in main.py, --requests times each, one at a time
+   (the full exports --export-requests times: each one streams every row);
+2. load: --concurrency clients issuing a read-heavy mix for --duration seconds.
+
+Reports p50/p99/mean latency, throughput and DB size, and writes them as JSON
+(with the git commit) so runs can be compared:
+
+    python bench_api.py --artworks 10000 --json before.json
+    python bench_api.py --artworks 10000 --json after.json --compare before.json
+
+--db keeps the seeded database for reuse (an existing file is not re-seeded).
+Settings such as PIXELLAR_ASYNC_DB or PIXELLAR_FAST_JSON apply as usual.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+WORDS = ("sunset", "pixel", "cat", "forest", "neon", "dragon", "ocean", "castle", "robot", "flower",
+         "night", "city", "space", "ghost", "mountain", "river", "knight", "garden", "storm", "candy")
+PALETTE = ("#1A1C2C", "#5D275D", "#B13E53", "#EF7D57", "#FFCD75", "#A7F070", "#38B764", "#257179",
+           "#29366F", "#3B5DC9", "#41A6F6", "#73EFF7", "#F4F4F4", "#94B0C2", "#566C86", None)
+TEMPLATES = 16
+GRID_SIZE = 32
+SEED_CHUNK = 5000
+PASSWORD = "000000"
+
+
+def _timestamp(dt: datetime) -> str:
+    # the format SQLAlchemy writes DateTime columns in on SQLite
+    return dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def template_grid(rng: random.Random) -> list:
+    """Blocky pixel art: a few colours in rectangles, like real artworks"""
+    colors = rng.sample(PALETTE, 5)
+    grid = [[colors[0]] * GRID_SIZE for _ in range(GRID_SIZE)]
+    for _ in range(12):
+        x, y = rng.randrange(GRID_SIZE), rng.randrange(GRID_SIZE)
+        w, h, color = rng.randint(2, 10), rng.randint(2, 10), rng.choice(colors)
+        for yy in range(y, min(GRID_SIZE, y + h)):
+            for xx in range(x, min(GRID_SIZE, x + w)):
+                grid[yy][xx] = color
+    return grid
+
+
+def seed(db_file: Path, artworks: int, users: int, rng: random.Random) -> dict:
+    """Fill an empty database created by init_db; returns counts and timing"""
+    import crud
+    import database
+    import dedup
+    import passwords
+    import pixel_codec
+    import search
+
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    templates = []
+    for _ in range(TEMPLATES):
+        blob = pixel_codec.encode(template_grid(rng))
+        templates.append((blob, *dedup.compute(blob)))
+    # every artwork shares one hash: hashing per row would dominate seeding
+    unlock_hash = passwords.hash_password(PASSWORD)
+
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+    with conn:
+        conn.executemany(
+            "INSERT INTO users (wallet_address, profile_url, username, bio, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            ((f"0x{i:040x}", f"u{i:08d}", f"{rng.choice(WORDS)}_{i}", "synthetic user", _timestamp(now), _timestamp(now))
+             for i in range(1, users + 1)),
+        )
+
+    def artwork_rows(start: int, stop: int):
+        for i in range(start, stop):
+            creator = 1 + i % users
+            blob = templates[i % TEMPLATES][0]
+            published = i % 10 != 0
+            stamp = _timestamp(now)
+            yield (f"a{i:012d}", creator, f"0x{creator:040x}", f"{rng.choice(WORDS)} {rng.choice(WORDS)} {i}",
+                   f"A {rng.choice(WORDS)} made of pixels", blob, GRID_SIZE, GRID_SIZE, "", unlock_hash,
+                   rng.randint(1, 500) / 10, 0.0, int(published), "", rng.randint(0, 5000), 0,
+                   stamp, _timestamp(datetime.fromtimestamp(now.timestamp() - i)) if published else None, stamp, 1)
+
+    for start in range(1, artworks + 1, SEED_CHUNK):
+        stop = min(artworks + 1, start + SEED_CHUNK)
+        with conn:
+            conn.executemany(
+                "INSERT INTO artworks (artwork_code, creator_id, creator_wallet, title, description, pixel_data, "
+                "width, height, unlock_password, unlock_hash, price_flow, publish_fee, is_published, thumbnail_url, "
+                "views_count, likes_count, created_at, published_at, updated_at, version) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                artwork_rows(start, stop),
+            )
+            conn.executemany(
+                "INSERT INTO artwork_hashes (artwork_id, content_hash, phash) VALUES (?, ?, ?)",
+                ((i, templates[i % TEMPLATES][1], dedup._to_signed(templates[i % TEMPLATES][2]))
+                 for i in range(start, stop)),
+            )
+    with conn:
+        conn.executemany(
+            "INSERT INTO purchases (artwork_id, buyer_id, buyer_wallet, seller_wallet, price_flow, purchased_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            ((a, b, f"0x{b:040x}", f"0x{1 + a % users:040x}", 1.0, _timestamp(now))
+             for a, b in ((rng.randint(1, artworks), rng.randint(1, users)) for _ in range(max(1, artworks // 20)))),
+        )
+    conn.close()
+
+    with database.engine.begin() as c:
+        search.rebuild(c)
+    with database.SessionLocal() as db:
+        crud.rebuild_sales_analytics(db)
+    return {"seconds": round(time.perf_counter() - started, 2)}
+
+
+def db_size(db_file: Path) -> int:
+    return sum(p.stat().st_size for p in (db_file, Path(f"{db_file}-wal")) if p.exists())
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "rps": round(len(values) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+class Case(NamedTuple):
+    name: str
+    method: str
+    url: Callable[["Context", int], str]
+    body: Optional[Callable[["Context", int], object]] = None
+    ok: tuple = (200,)
+    ndjson: bool = False
+    admin: bool = False
+
+
+class Context:
+    def __init__(self, artworks: int, users: int, rng: random.Random):
+        self.artworks = artworks
+        self.users = users
+        self.rng = rng
+        self.created_users: List[int] = []
+        self.created_artworks: List[int] = []
+        self.grid = template_grid(rng)
+        import passwords
+        self.unlock_hash = passwords.hash_password(PASSWORD)
+        self.run = f"{int(time.time()) % 100000:05d}{rng.randrange(1000):03d}"
+
+    def artwork(self) -> int:
+        return self.rng.randint(1, self.artworks)
+
+    def user(self) -> int:
+        return self.rng.randint(1, self.users)
+
+    def created(self, items: List[int], i: int) -> int:
+        return items[i % len(items)] if items else 0
+
+
+def _ndjson(lines) -> bytes:
+    return "".join(json.dumps(line) + "\n" for line in lines).encode()
+
+
+def _bulk_artwork(c: Context, i: int, n: int) -> dict:
+    # one line per batch is hashed by the importer, the rest carry a precomputed hash
+    # like a large migration would, so both paths are timed without hashing dominating
+    line = {"artwork_code": f"b{c.run[-5:]}{i:06d}{n:02d}", "creator_id": c.user(), "title": "bulk",
+            "pixel_data": c.grid}
+    if n == 0:
+        line["unlock_password"] = PASSWORD
+    else:
+        line["unlock_hash"] = c.unlock_hash
+    return line
+
+
+CASES = [
+    Case("GET /", "GET", lambda c, i: "/"),
+    Case("GET /users/", "GET", lambda c, i: "/users/?limit=50"),
+    Case("GET /users/{id}", "GET", lambda c, i: f"/users/{c.user()}"),
+    Case("GET /users/by-profile/{p}", "GET", lambda c, i: f"/users/by-profile/u{c.user():08d}"),
+    Case("GET /users/{id}/sales", "GET", lambda c, i: f"/users/{c.user()}/sales"),
+    Case("GET /artworks/", "GET", lambda c, i: "/artworks/?limit=50"),
+    Case("GET /artworks/?owner_id", "GET", lambda c, i: f"/artworks/?owner_id={c.user()}&limit=20"),
+    Case("GET /artworks/search", "GET", lambda c, i: f"/artworks/search?q={c.rng.choice(WORDS)[:3]}&limit=20"),
+    Case("GET /artworks/{id}", "GET", lambda c, i: f"/artworks/{c.artwork()}"),
+    Case("GET /artworks/{id}/detail", "GET", lambda c, i: f"/artworks/{c.artwork()}/detail?viewer_id={c.user()}"),
+    Case("GET /artworks/cards", "GET",
+         lambda c, i: f"/artworks/cards?ids={','.join(str(c.artwork()) for _ in range(20))}&viewer_id={c.user()}"),
+    Case("GET /artworks/{id}/thumbnail", "GET", lambda c, i: f"/artworks/{c.artwork()}/thumbnail"),
+    Case("GET /artworks/{id}/duplicates", "GET", lambda c, i: f"/artworks/{c.artwork()}/duplicates"),
+    Case("POST /artworks/duplicates", "POST", lambda c, i: "/artworks/duplicates",
+         lambda c, i: {"pixel_data": c.grid}),
+    Case("POST /artworks/{id}/view", "POST", lambda c, i: f"/artworks/{c.artwork()}/view", ok=(202,)),
+    Case("POST /artworks/{id}/like", "POST", lambda c, i: f"/artworks/{c.artwork()}/like",
+         lambda c, i: {"user_id": c.user()}, ok=(202,)),
+    Case("DELETE /artworks/{id}/like", "DELETE",
+         lambda c, i: f"/artworks/{c.artwork()}/like?user_id={c.user()}", ok=(202,)),
+    Case("POST /artworks/{id}/unlock (403)", "POST", lambda c, i: f"/artworks/{c.artwork()}/unlock",
+         lambda c, i: {"user_id": c.user(), "password": "999999"}, ok=(403,)),
+    Case("POST /artworks/{id}/unlock (200)", "POST", lambda c, i: f"/artworks/{c.artwork()}/unlock",
+         lambda c, i: {"user_id": c.user(), "password": PASSWORD}),
+    Case("POST /users/", "POST", lambda c, i: "/users/",
+         lambda c, i: {"wallet_address": f"0xbench{c.run}{i:08d}", "username": f"bench{i}"}),
+    Case("POST /artworks/", "POST", lambda c, i: "/artworks/",
+         lambda c, i: {"title": f"bench {c.rng.choice(WORDS)} {i}", "owner_id": c.user(), "pixel_data": c.grid,
+                       "width": GRID_SIZE, "height": GRID_SIZE, "price_cents": 150, "is_published": True}),
+    Case("PATCH /artworks/{id}", "PATCH", lambda c, i: f"/artworks/{c.created(c.created_artworks, i)}",
+         lambda c, i: {"cells": [[c.rng.randrange(GRID_SIZE), c.rng.randrange(GRID_SIZE), c.rng.choice(PALETTE)]]}),
+    Case("POST /purchases/", "POST", lambda c, i: "/purchases/",
+         lambda c, i: {"artwork_id": c.artwork(), "buyer_id": c.user()}),
+    Case("POST /users/bulk", "POST", lambda c, i: "/users/bulk",
+         lambda c, i: _ndjson({"wallet_address": f"0xbulk{c.run}{i:06d}{n:02d}"} for n in range(10)),
+         ndjson=True, admin=True),
+    Case("POST /artworks/bulk", "POST", lambda c, i: "/artworks/bulk",
+         lambda c, i: _ndjson(_bulk_artwork(c, i, n) for n in range(10)), ndjson=True, admin=True),
+    Case("GET /cache/stats", "GET", lambda c, i: "/cache/stats"),
+    Case("GET /metrics", "GET", lambda c, i: "/metrics"),
+    Case("DELETE /artworks/{id}", "DELETE", lambda c, i: f"/artworks/{c.created(c.created_artworks, i)}",
+         ok=(200, 404)),
+    Case("DELETE /users/{id}", "DELETE", lambda c, i: f"/users/{c.created(c.created_users, i)}", ok=(200, 404)),
+]
+# timed separately: one export is as slow as the table is large
+EXPORT_CASES = [
+    Case("GET /users/export", "GET", lambda c, i: "/users/export", admin=True),
+    Case("GET /artworks/export", "GET", lambda c, i: "/artworks/export", admin=True),
+]
+
+# (case name, weight) for the concurrent phase: mostly marketplace browsing
+LOAD_MIX = [
+    ("GET /artworks/", 30), ("GET /artworks/{id}", 25), ("GET /artworks/search", 10),
+    ("GET /artworks/{id}/thumbnail", 10), ("GET /users/by-profile/{p}", 10),
+    ("POST /artworks/{id}/view", 10), ("POST /artworks/{id}/like", 5),
+]
+
+
+async def issue(client, ctx: Context, case: Case, i: int):
+    kwargs, headers = {}, {}
+    if case.body is not None:
+        body = case.body(ctx, i)
+        if case.ndjson:
+            kwargs["body"] = body
+            headers["content-type"] = "application/x-ndjson"
+        else:
+            kwargs["json"] = body
+    if case.admin:
+        headers["authorization"] = f"Bearer {os.environ['PIXELLAR_ADMIN_TOKEN']}"
+    if headers:
+        kwargs["headers"] = headers
+    start = time.perf_counter()
+    response = await client.request(case.method, case.url(ctx, i), **kwargs)
+    elapsed = time.perf_counter() - start
+    if case.name == "POST /artworks/" and response.status == 200:
+        ctx.created_artworks.append(response.json()["id"])
+    elif case.name == "POST /users/" and response.status == 200:
+        ctx.created_users.append(response.json()["id"])
+    elif case.ndjson and response.status == 200:
+        # bulk endpoints answer 200 even when every line was rejected
+        return elapsed, response.json()["inserted"] == kwargs["body"].count(b"\n")
+    return elapsed, response.status in case.ok
+
+
+async def run_latency(client, ctx: Context, cases: List[Case], requests: int) -> Dict[str, dict]:
+    results = {}
+    for case in cases:
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        for i in range(requests):
+            elapsed, ok = await issue(client, ctx, case, i)
+            latencies.append(elapsed)
+            errors += not ok
+        results[case.name] = summarize(latencies, errors, time.perf_counter() - started)
+        print(f"  {case.name:<32} p50 {results[case.name]['p50_ms']:>9.3f} ms  "
+              f"p99 {results[case.name]['p99_ms']:>9.3f} ms  {results[case.name]['rps']:>8.1f} req/s"
+              + (f"  {errors} errors" if errors else ""))
+    return results
+
+
+async def run_load(client, ctx: Context, concurrency: int, duration: float) -> dict:
+    by_name = {c.name: c for c in CASES}
+    names = [n for n, _ in LOAD_MIX]
+    weights = [w for _, w in LOAD_MIX]
+    per_case: Dict[str, List[float]] = {n: [] for n in names}
+    errors: Dict[str, int] = {n: 0 for n in names}
+    deadline = time.perf_counter() + duration
+
+    async def worker(w: int):
+        i = 0
+        while time.perf_counter() < deadline:
+            name = ctx.rng.choices(names, weights)[0]
+            elapsed, ok = await issue(client, ctx, by_name[name], w * 1_000_000 + i)
+            per_case[name].append(elapsed)
+            errors[name] += not ok
+            i += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    all_latencies = [v for values in per_case.values() for v in values]
+    return {
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 2),
+        "total": summarize(all_latencies, sum(errors.values()), elapsed),
+        "endpoints": {n: summarize(per_case[n], errors[n], elapsed) for n in names if per_case[n]},
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, baseline_file: str, threshold: float = 10.0) -> None:
+    baseline = json.loads(Path(baseline_file).read_text())
+    print(f"\nCompared with {baseline_file} (commit {baseline['meta'].get('commit')}):")
+    for name, now in current["latency"].items():
+        before = baseline.get("latency", {}).get(name)
+        if not before or not before["p50_ms"]:
+            continue
+        change = (now["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100
+        flag = "  <-- slower" if change > threshold else ""
+        print(f"  {name:<32} p50 {before['p50_ms']:>9.3f} -> {now['p50_ms']:>9.3f} ms ({change:+6.1f}%){flag}")
+    if "load" in current and "load" in baseline:
+        print(f"  {'load throughput':<32} {baseline['load']['total']['rps']:>9.1f} -> "
+              f"{current['load']['total']['rps']:>9.1f} req/s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--artworks", type=int, default=1000, help="artworks to seed (1k-1M)")
+    parser.add_argument("--users", type=int, help="users to seed (default artworks / 10)")
+    parser.add_argument("--db", help="database file to seed or reuse (default: a temporary file)")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint in the latency phase")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of the load phase (0 skips it)")
+    parser.add_argument("--export-requests", type=int, default=5,
+                        help="requests per full NDJSON export (0 skips them)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="earlier results file to compare p50 latencies with")
+    args = parser.parse_args(argv)
+
+    users = args.users or max(10, args.artworks // 10)
+    workdir = Path(tempfile.mkdtemp(prefix="pixellar-bench-"))
+    db_file = Path(args.db).resolve() if args.db else workdir / "bench.db"
+    reuse = db_file.exists()
+    # configure before the app modules read their settings
+    os.environ["PIXELLAR_DATABASE_URL"] = f"sqlite:///{db_file}"
+    os.environ.setdefault("PIXELLAR_THUMB_DIR", str(workdir / "thumbnails"))
+    os.environ.setdefault("PIXELLAR_ADMIN_TOKEN", "bench")
+    # every request comes from one address, so the unlock limits would turn most
+    # of the unlock cases into cheap 429s
+    for limit in ("RATE", "BURST", "ARTWORK_RATE", "ARTWORK_BURST", "CLIENT_RATE", "CLIENT_BURST"):
+        os.environ.setdefault(f"PIXELLAR_UNLOCK_{limit}", "1000000")
+    sys.path.insert(0, str(Path(__file__).parent))
+
+    import asgi_client
+    import database
+    import main as app_module
+
+    rng = random.Random(args.seed)
+    database.init_db()
+    seeding = {"reused": True} if reuse else seed(db_file, args.artworks, users, rng)
+    with sqlite3.connect(db_file) as conn:
+        # only seeded rows have ids 1..n and predictable codes; earlier runs may have left others
+        artworks = conn.execute("SELECT COUNT(*) FROM artworks WHERE artwork_code GLOB 'a[0-9]*'").fetchone()[0]
+        users = conn.execute("SELECT COUNT(*) FROM users WHERE profile_url GLOB 'u[0-9]*'").fetchone()[0]
+    if not artworks or not users:
+        raise SystemExit(f"{db_file} was not seeded by bench_api.py")
+    size_before = db_size(db_file)
+    print(f"Database {db_file}: {artworks} artworks, {users} users, {size_before / 1e6:.1f} MB"
+          + ("" if reuse else f" (seeded in {seeding['seconds']} s)"))
+
+    ctx = Context(artworks, users, rng)
+
+    async def run():
+        client = asgi_client.ASGIClient(app_module.app)
+        async with client.lifespan():
+            print(f"Latency, {args.requests} sequential requests per endpoint:")
+            latency = await run_latency(client, ctx, CASES, args.requests)
+            if args.export_requests > 0:
+                print(f"Exports, {args.export_requests} sequential requests each:")
+                latency.update(await run_latency(client, ctx, EXPORT_CASES, args.export_requests))
+            load = None
+            if args.duration > 0:
+                print(f"Load, {args.concurrency} concurrent clients for {args.duration:g} s:")
+                load = await run_load(client, ctx, args.concurrency, args.duration)
+                total = load["total"]
+                print(f"  {total['requests']} requests, {total['rps']} req/s, "
+                      f"p50 {total['p50_ms']} ms, p99 {total['p99_ms']} ms, {total['errors']} errors")
+        return latency, load
+
+    latency, load = asyncio.run(run())
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "python": sys.version.split()[0],
+            "sqlite": sqlite3.sqlite_version,
+            "async_db": database.USE_ASYNC_DB,
+            "fast_json": os.getenv("PIXELLAR_FAST_JSON", ""),
+            "sqlite_profile": os.getenv("PIXELLAR_SQLITE_PROFILE", "wal"),
+            "requests": args.requests,
+            "export_requests": args.export_requests,
+        },
+        "database": {"artworks": artworks, "users": users, "size_bytes": size_before,
+                     "size_after_bytes": db_size(db_file), "seed": seeding},
+        "latency": latency,
+    }
+    if load:
+        results["load"] = load
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Compare the response_model and orjson (PIXELLAR_FAST_JSON) list paths.
+
+Seeds a throwaway database with artworks, then for 100-row pages of
+GET /artworks/ (summary fields and fields=*) and GET /users/ measures:
+- serialize: CPU time to turn the crud rows into response bytes;
+- request: CPU time for the whole request through the app in-process.
+Both paths must produce the same JSON, which is checked first.
+
+    python bench_json.py [--rows 100] [--repeat 50] [--json results.json]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+TMP = Path(tempfile.mkdtemp(prefix="pixellar-bench-"))
+os.environ.setdefault("PIXELLAR_DATABASE_URL", f"sqlite:///{TMP / 'bench.db'}")
+os.environ.setdefault("PIXELLAR_THUMB_DIR", str(TMP / "thumbnails"))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+import asgi_client  # noqa: E402
+import bulk  # noqa: E402
+import crud  # noqa: E402
+import database  # noqa: E402
+import fastjson  # noqa: E402
+import main  # noqa: E402
+import models  # noqa: E402
+import pixel_codec  # noqa: E402
+
+CASES = [
+    ("artworks summary", "/artworks/?limit={rows}", models.ArtworkListItem, "artworks", models.ARTWORK_SUMMARY_FIELDS),
+    ("artworks fields=*", "/artworks/?limit={rows}&fields=*", models.ArtworkListItem, "artworks", models.ARTWORK_LIST_FIELDS),
+    ("users fields=*", "/users/?limit={rows}&fields=*", models.UserListItem, "users", models.USER_LIST_FIELDS),
+]
+
+
+def seed(rows: int):
+    grid = [["#%02X%02X%02X" % ((x * 8) % 256, (y * 8) % 256, 128) if (x + y) % 3 else None
+             for x in range(32)] for y in range(32)]
+    packed = base64.b64encode(pixel_codec.encode(grid)).decode()
+    users = (json.dumps({"wallet_address": f"0x{i:040x}", "username": f"user{i}", "bio": "bench"}) for i in range(rows))
+    bulk.import_lines("users", users)
+    artworks = (json.dumps({"artwork_code": f"bench{i:08d}", "creator_id": 1 + i % rows, "title": f"Artwork {i}",
+                            "description": "seeded by bench_json.py", "pixel_data_b64": packed, "price_flow": 1,
+                            "is_published": True}) for i in range(rows))
+    bulk.import_lines("artworks", artworks)
+
+
+def load_rows(kind: str, fields, rows: int):
+    with database.ReadSessionLocal() as db:
+        if kind == "artworks":
+            return crud.list_artworks(db, limit=rows, fields=fields)[0]
+        return crud.list_users(db, limit=rows, fields=fields)[0]
+
+
+def cpu_per_call(fn, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        start = time.process_time()
+        fn()
+        samples.append(time.process_time() - start)
+    return statistics.median(samples) * 1000
+
+
+async def bench(rows: int, repeat: int) -> list:
+    client = asgi_client.ASGIClient(main.app)
+    results = []
+    for name, url, item_model, kind, fields in CASES:
+        url = url.format(rows=rows)
+        data = load_rows(kind, fields, rows)
+        field = create_response_field(name=f"bench_{kind}", type_=List[item_model])
+
+        async def pydantic_bytes(d):
+            content = await serialize_response(field=field, response_content=d, exclude_unset=True)
+            return JSONResponse(content).body
+
+        def orjson_bytes(d):
+            return fastjson.response([dict(r) for r in d], item_model).body
+
+        if json.loads(await pydantic_bytes(data)) != json.loads(orjson_bytes(data)):
+            raise SystemExit(f"{name}: the two paths disagree")
+
+        loop_samples = []
+        for _ in range(repeat):
+            start = time.process_time()
+            await pydantic_bytes(data)
+            loop_samples.append(time.process_time() - start)
+        serialize_default = statistics.median(loop_samples) * 1000
+        serialize_fast = cpu_per_call(lambda: orjson_bytes(data), repeat)
+
+        request_ms = {}
+        for mode in (False, True):
+            fastjson.ENABLED = mode
+            samples = []
+            for _ in range(repeat):
+                start = time.process_time()
+                response = await client.get(url)
+                samples.append(time.process_time() - start)
+                assert response.status == 200, response.body
+            request_ms[mode] = statistics.median(samples) * 1000
+        fastjson.ENABLED = False
+
+        results.append({
+            "case": name, "rows": len(data),
+            "serialize_ms": {"response_model": round(serialize_default, 3), "orjson": round(serialize_fast, 3)},
+            "request_cpu_ms": {"response_model": round(request_ms[False], 3), "orjson": round(request_ms[True], 3)},
+        })
+    return results
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    database.init_db()
+    seed(args.rows)
+    results = asyncio.run(bench(args.rows, args.repeat))
+
+    print(f"{'case':<20} {'rows':>5} {'serialize ms':>22} {'request CPU ms':>22}")
+    for r in results:
+        s, q = r["serialize_ms"], r["request_cpu_ms"]
+        print(f"{r['case']:<20} {r['rows']:>5} "
+              f"{s['response_model']:>9.3f} -> {s['orjson']:<9.3f} "
+              f"{q['response_model']:>9.3f} -> {q['orjson']:<9.3f}")
+    if args.json:
+        Path(args.json).write_text(json.dumps({"python": sys.version.split()[0], "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,249 @@
+"""Bulk NDJSON import/export for users and artworks.
+
+Imports insert in chunks, one transaction and one executemany per chunk, and
+skip rows that clash with an existing unique key (INSERT OR IGNORE). An artwork
+line may carry an unlock_hash from passwords.hash_password, stored as is, or an
+unlock_password, hashed at scrypt cost (passwords.py); exports leave both out.
+Exports page through the table by id and yield one JSON line at a time, so
+memory stays flat whatever the table size.
+
+Used by the /users/bulk, /artworks/bulk and */export endpoints, and as a CLI:
+
+    python bulk.py import users users.ndjson
+    python bulk.py export artworks artworks.ndjson
+"""
+import argparse
+import base64
+import json
+import sys
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional
+
+from sqlalchemy import select
+
+import database
+import dedup
+import ids
+import models
+import passwords
+import pixel_codec
+import search
+
+CHUNK_SIZE = 1000
+MAX_ERRORS = 20
+
+TABLES = {"users": models.User, "artworks": models.Artwork}
+_DATETIME_COLUMNS = {"created_at", "updated_at", "published_at"}
+# never exported: unlock codes (hashed or, on rows not backfilled yet, plaintext)
+EXPORT_EXCLUDE = {"users": set(), "artworks": {"unlock_password", "unlock_hash"}}
+
+
+class BulkError(ValueError):
+    pass
+
+
+def _columns(kind: str) -> List[str]:
+    return [c.name for c in TABLES[kind].__table__.columns]
+
+
+def _parse_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00")).replace(tzinfo=None)
+
+
+def _prepare_user(data: dict, now: datetime) -> dict:
+    if not data.get("wallet_address"):
+        raise BulkError("wallet_address is required")
+    data["wallet_address"] = data["wallet_address"].lower()
+    if not data.get("profile_url"):
+        data["profile_url"] = ids.new_profile_id(data["wallet_address"])
+    return data
+
+
+def _prepare_artwork(data: dict, now: datetime) -> dict:
+    for key in ("artwork_code", "creator_id", "title"):
+        if data.get(key) in (None, ""):
+            raise BulkError(f"{key} is required")
+    # unlock_hash (as hash_password makes it) is stored as is; unlock_password is
+    # hashed in Importer.flush; with neither the artwork can't be unlocked until
+    # its owner sets a password
+    if data.get("unlock_hash") is not None and not passwords.is_hash(data["unlock_hash"]):
+        raise BulkError("unlock_hash is not a passwords.hash_password hash")
+    password = data.get("unlock_password")
+    if password is not None and (not isinstance(password, str) or not 1 <= len(password) <= passwords.MAX_LENGTH):
+        raise BulkError(f"unlock_password must be 1-{passwords.MAX_LENGTH} characters")
+    if data.get("unlock_hash"):
+        data["unlock_password"] = None
+    width, height = data.get("width"), data.get("height")
+    if data.get("pixel_data_b64"):
+        packed = base64.b64decode(data.pop("pixel_data_b64"), validate=True)
+    else:
+        packed = pixel_codec.encode(data.get("pixel_data") or [], width, height)
+    w, h, _ = pixel_codec.read_header(packed)
+    if max(w, h) > pixel_codec.MAX_DIM:
+        raise BulkError(f"canvas {w}x{h} is larger than {pixel_codec.MAX_DIM} pixels per side")
+    # inflate the whole grid, not just the header, so a corrupt blob is an error here
+    pixel_codec.decode_indices(packed)
+    if (width or w, height or h) != (w, h):
+        raise BulkError(f"width/height {width}x{height} do not match the {w}x{h} pixel data")
+    data["pixel_data"] = packed
+    data["width"], data["height"] = w, h
+    data.setdefault("creator_wallet", "")
+    data.setdefault("views_count", 0)
+    data.setdefault("likes_count", 0)
+    data.setdefault("is_published", False)
+    data.setdefault("version", 1)
+    if data["is_published"] and not data.get("published_at"):
+        data["published_at"] = now
+    return data
+
+
+_PREPARE = {"users": _prepare_user, "artworks": _prepare_artwork}
+
+
+def _normalize(kind: str, line: str, columns: List[str], now: datetime) -> dict:
+    data = json.loads(line)
+    if not isinstance(data, dict):
+        raise BulkError("each line must be a JSON object")
+    data = _PREPARE[kind](data, now)
+    row = {c: data.get(c) for c in columns}
+    for c in _DATETIME_COLUMNS & row.keys():
+        row[c] = _parse_datetime(row[c])
+    row["created_at"] = row["created_at"] or now
+    row["updated_at"] = row["updated_at"] or now
+    return row
+
+
+class Importer:
+    """Feed NDJSON lines in with add(); rows are written every chunk_size lines."""
+
+    def __init__(self, kind: str, engine=None, chunk_size: int = CHUNK_SIZE):
+        if kind not in TABLES:
+            raise BulkError(f"unknown kind {kind!r}")
+        self.kind = kind
+        self.engine = engine or database.engine
+        self.chunk_size = chunk_size
+        self.table = TABLES[kind].__table__
+        self.columns = _columns(kind)
+        self._insert = self.table.insert().prefix_with("OR IGNORE")
+        self._rows: List[dict] = []
+        self.line_no = 0
+        self.inserted = 0
+        self.skipped = 0
+        self.errors: List[str] = []
+        self.error_count = 0
+
+    def add(self, line) -> None:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        self.line_no += 1
+        if not line.strip():
+            return
+        try:
+            self._rows.append(_normalize(self.kind, line, self.columns, datetime.utcnow()))
+        except (ValueError, TypeError) as e:
+            self.error_count += 1
+            if len(self.errors) < MAX_ERRORS:
+                self.errors.append(f"line {self.line_no}: {e}")
+        if len(self._rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, []
+        if self.kind == "artworks":
+            plain = [r for r in rows if r["unlock_password"]]
+            for row, unlock_hash in zip(plain, passwords.get_pool().map(passwords.hash_password,
+                                                                         [r["unlock_password"] for r in plain])):
+                row["unlock_hash"] = unlock_hash
+            for row in rows:
+                row["unlock_password"] = ""
+        with self.engine.begin() as conn:
+            result = conn.execute(self._insert, rows)
+            if self.kind == "artworks":
+                codes = [r["artwork_code"] for r in rows]
+                search.index_artwork_codes(conn, codes)
+                dedup.index_missing(conn, codes)
+        inserted = max(result.rowcount, 0)
+        self.inserted += inserted
+        self.skipped += len(rows) - inserted
+
+    def summary(self) -> dict:
+        return {
+            "inserted": self.inserted,
+            "skipped": self.skipped,
+            "errors": self.error_count,
+            "error_samples": self.errors,
+        }
+
+
+def import_lines(kind: str, lines: Iterable, engine=None, chunk_size: int = CHUNK_SIZE) -> dict:
+    importer = Importer(kind, engine, chunk_size)
+    for line in lines:
+        importer.add(line)
+    importer.flush()
+    return importer.summary()
+
+
+def _serialize(kind: str, row: dict, pixels: str) -> dict:
+    out = {}
+    for key, value in row.items():
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        out[key] = value
+    if kind == "artworks":
+        raw = out.pop("pixel_data")
+        if pixels == "grid":
+            out["pixel_data"] = pixel_codec.decode(raw)
+        else:
+            packed = pixel_codec.encode(raw, row.get("width"), row.get("height"))
+            out["pixel_data_b64"] = base64.b64encode(packed).decode()
+    return out
+
+
+def export_lines(kind: str, engine=None, chunk_size: int = CHUNK_SIZE, pixels: str = "packed") -> Iterator[str]:
+    """Yield every row as an NDJSON line, paging by id. pixels is "packed"
+    (base64 blob, round-trips through import) or "grid" (list of rows).
+    EXPORT_EXCLUDE columns are left out."""
+    if kind not in TABLES:
+        raise BulkError(f"unknown kind {kind!r}")
+    engine = engine or database.read_engine
+    table = TABLES[kind].__table__
+    columns = [c for c in table.columns if c.name not in EXPORT_EXCLUDE[kind]]
+    last_id: Optional[int] = 0
+    while True:
+        statement = select(*columns).where(table.c.id > last_id).order_by(table.c.id).limit(chunk_size)
+        with engine.connect() as conn:
+            rows = [dict(r) for r in conn.execute(statement).mappings()]
+        if not rows:
+            return
+        for row in rows:
+            yield json.dumps(_serialize(kind, row, pixels), separators=(",", ":")) + "\n"
+        last_id = rows[-1]["id"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("action", choices=["import", "export"])
+    parser.add_argument("kind", choices=sorted(TABLES))
+    parser.add_argument("path", help="NDJSON file, or - for stdin/stdout")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--pixels", choices=["packed", "grid"], default="packed")
+    args = parser.parse_args(argv)
+
+    database.init_db()
+    if args.action == "import":
+        src = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8")
+        with src:
+            print(json.dumps(import_lines(args.kind, src, chunk_size=args.chunk_size)))
+    else:
+        dst = sys.stdout if args.path == "-" else open(args.path, "w", encoding="utf-8")
+        with dst:
+            for line in export_lines(args.kind, chunk_size=args.chunk_size, pixels=args.pixels):
+                dst.write(line)
+
+
+if __name__ == "__main__":
+    main()
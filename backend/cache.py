@@ -0,0 +1,140 @@
+"""Read-through cache for rarely changing rows (see crud.get_artwork etc.).
+
+The default backend is an in-process LRU with a TTL. Set PIXELLAR_CACHE_URL to
+a redis:// URL to share entries between worker processes through any
+Redis-compatible server (needs the redis package). PIXELLAR_CACHE_SIZE=0
+turns caching off.
+"""
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+CACHE_URL = os.getenv("PIXELLAR_CACHE_URL", "")
+CACHE_SIZE = int(os.getenv("PIXELLAR_CACHE_SIZE", 4096))
+CACHE_TTL = float(os.getenv("PIXELLAR_CACHE_TTL", 60))
+
+_MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] < time.monotonic():
+                del self._data[key]
+                entry = _MISSING
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "backend": "memory",
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+class RedisCache:
+    """Same interface as LRUCache on top of a Redis-compatible server"""
+
+    def __init__(self, url: str, ttl: float = CACHE_TTL, prefix: str = "pixellar:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key: str, default=None):
+        raw = self.client.get(self.prefix + key)
+        with self._lock:
+            if raw is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+        return pickle.loads(raw)
+
+    def set(self, key: str, value: Any) -> None:
+        self.client.set(self.prefix + key, pickle.dumps(value), px=int(self.ttl * 1000))
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            self.client.delete(*(self.prefix + k for k in keys))
+
+    def clear(self) -> None:
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "backend": "redis",
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+store = RedisCache(CACHE_URL) if CACHE_URL else LRUCache()
+
+
+def cached(key: str, load: Callable[[], Optional[Any]], dump: Callable, restore: Callable):
+    """Return restore(cached value) or load(), caching dump(result) when it is not None."""
+    value = store.get(key, _MISSING)
+    if value is not _MISSING:
+        return restore(value)
+    obj = load()
+    if obj is not None:
+        store.set(key, dump(obj))
+    return obj
+
+
+def invalidate(*keys: Optional[str]) -> None:
+    store.delete(*(k for k in keys if k))
+
+
+def stats() -> dict:
+    return store.stats()
@@ -0,0 +1,146 @@
+"""Buffered view and like counters.
+
+Hits are accumulated in memory and written in one transaction per flush:
+pending likes/unlikes are applied to the likes table, views_count is bumped
+with a single CASE UPDATE and likes_count is recounted for the touched
+artworks (the SQLite schema has no likes trigger). A flush runs every
+FLUSH_INTERVAL seconds, or sooner once FLUSH_THRESHOLD hits are pending.
+"""
+import asyncio
+import logging
+import os
+import threading
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text
+
+import cache
+import database
+
+FLUSH_INTERVAL = float(os.getenv("PIXELLAR_COUNTER_FLUSH_INTERVAL", 5))
+FLUSH_THRESHOLD = int(os.getenv("PIXELLAR_COUNTER_FLUSH_THRESHOLD", 1000))
+
+log = logging.getLogger(__name__)
+
+
+class CounterBuffer:
+    def __init__(self, engine=None, threshold: int = FLUSH_THRESHOLD):
+        self.engine = engine
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._views: Counter = Counter()
+        # (artwork_id, user_id) -> True for like, False for unlike; last call wins
+        self._likes: Dict[Tuple[int, int], bool] = {}
+        self._pending = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self.flushes = 0
+
+    def _hit(self):
+        self._pending += 1
+        if self._pending >= self.threshold and self._wakeup is not None:
+            self._wakeup.set()
+
+    def add_view(self, artwork_id: int, n: int = 1) -> None:
+        with self._lock:
+            self._views[artwork_id] += n
+            self._hit()
+
+    def set_like(self, artwork_id: int, user_id: int, liked: bool = True) -> None:
+        with self._lock:
+            self._likes[(artwork_id, user_id)] = liked
+            self._hit()
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._pending
+
+    def _drain(self):
+        with self._lock:
+            views, likes = self._views, self._likes
+            self._views, self._likes, self._pending = Counter(), {}, 0
+        return views, likes
+
+    def _restore(self, views: Counter, likes: dict):
+        with self._lock:
+            self._views.update(views)
+            for key, liked in likes.items():
+                self._likes.setdefault(key, liked)
+            self._pending += sum(views.values()) + len(likes)
+
+    def flush(self) -> int:
+        """Write everything pending; returns the number of artworks touched."""
+        views, likes = self._drain()
+        if not views and not likes:
+            return 0
+        touched = set(views) | {a for a, _ in likes}
+        try:
+            with (self.engine or database.engine).begin() as conn:
+                _apply_likes(conn, likes)
+                _apply_views(conn, views)
+                if likes:
+                    liked_ids = sorted({a for a, _ in likes})
+                    conn.execute(
+                        text(
+                            "UPDATE artworks SET likes_count = "
+                            "(SELECT COUNT(*) FROM likes WHERE likes.artwork_id = artworks.id) "
+                            f"WHERE id IN ({', '.join(map(str, liked_ids))})"
+                        )
+                    )
+        except Exception:
+            self._restore(views, likes)
+            raise
+        self.flushes += 1
+        cache.invalidate(*(f"artwork:{a}" for a in touched))
+        return len(touched)
+
+    async def run(self, interval: float = FLUSH_INTERVAL):
+        """Background flusher; started from the app lifespan."""
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                try:
+                    await run_in_threadpool(self.flush)
+                except Exception:
+                    log.exception("counter flush failed, will retry")
+        finally:
+            self._wakeup = None
+
+
+def _apply_likes(conn, likes: Dict[Tuple[int, int], bool]):
+    added = [{"a": a, "u": u} for (a, u), liked in likes.items() if liked]
+    removed = [{"a": a, "u": u} for (a, u), liked in likes.items() if not liked]
+    if added:
+        conn.execute(
+            text(
+                "INSERT OR IGNORE INTO likes (artwork_id, user_id, created_at) "
+                "SELECT :a, :u, datetime('now') WHERE EXISTS (SELECT 1 FROM artworks WHERE id = :a) "
+                "AND EXISTS (SELECT 1 FROM users WHERE id = :u) "
+                "AND NOT EXISTS (SELECT 1 FROM likes WHERE artwork_id = :a AND user_id = :u)"
+            ),
+            added,
+        )
+    if removed:
+        conn.execute(text("DELETE FROM likes WHERE artwork_id = :a AND user_id = :u"), removed)
+
+
+def _apply_views(conn, views: Counter):
+    if not views:
+        return
+    ids = sorted(views)
+    cases = " ".join(f"WHEN {int(a)} THEN {int(views[a])}" for a in ids)
+    conn.execute(
+        text(
+            f"UPDATE artworks SET views_count = COALESCE(views_count, 0) + CASE id {cases} END "
+            f"WHERE id IN ({', '.join(str(int(a)) for a in ids)})"
+        )
+    )
+
+
+buffer = CounterBuffer()
@@ -1,6 +1,11 @@
-from typing import List, Optional, Union
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple, Union
+from sqlalchemy import DateTime, bindparam, exists, func, literal, text, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.exc import StaleDataError
 from sqlmodel import Session, select
-import models, database
+import models, database, pixel_codec, pagination, cache, ids, jobs, search, dedup
 
 
 def get_user(db: Session, user_id: int) -> Optional[models.User]:
@@ -12,140 +17,509 @@ def get_user_by_username(db: Session, username: str) -> Optional[models.User]:
     return db.exec(statement).first()
 
 
-def get_user_by_wallet(db: Session, wallet_address: str) -> Optional[models.User]:
-    statement = select(models.User).where(models.User.wallet_address == wallet_address)
-    return db.exec(statement).first()
+def _user_cache_keys(user: models.User) -> Tuple[str, str]:
+    return f"user:wallet:{user.wallet_address}", f"user:profile:{user.profile_url}"
 
 
-def _generate_profile_url(db: Session, base: str | None = None) -> str:
-    import random, string
+def _dump_row(obj) -> dict:
+    return obj.dict()
 
-    attempts = 0
-    base_chars = (base or "").replace("0x", "")
-    while attempts < 100:
-        rnd = ''.join(random.choices(string.ascii_letters + string.digits, k=9))
-        candidate = (base_chars[:3] + rnd[3:])[:9] if base_chars else rnd
-        # ensure uniqueness
-        stmt = select(models.User).where(models.User.profile_url == candidate)
-        existing = db.exec(stmt).first()
-        if not existing:
-            return candidate
-        attempts += 1
-    # fallback: timestamp-based
-    from time import time
-    return f'p{int(time()) % 100000000:08d}'[:9]
+
+def get_user_by_wallet(db: Session, wallet_address: str) -> Optional[models.User]:
+    """Cached; returns a detached copy on a hit, so don't modify the result"""
+    statement = select(models.User).where(models.User.wallet_address == wallet_address)
+    return cache.cached(
+        f"user:wallet:{wallet_address}", lambda: db.exec(statement).first(),
+        _dump_row, lambda d: models.User(**d),
+    )
+
+
+# SQLAlchemy 1.4 cannot compile RETURNING for SQLite, so this one is written out.
+# An existing user keeps everything but gains the username if it had none; that
+# counts as an update, so updated_at (and with it the by-profile ETag) moves too.
+_UPSERT_USER = text(
+    "INSERT INTO users (wallet_address, profile_url, username, bio, avatar_url, created_at, updated_at) "
+    "VALUES (:wallet_address, :profile_url, :username, :bio, :avatar_url, :created_at, :updated_at) "
+    "ON CONFLICT (wallet_address) DO UPDATE SET username = COALESCE(users.username, excluded.username), "
+    "updated_at = CASE WHEN users.username IS NULL AND excluded.username IS NOT NULL "
+    "THEN excluded.updated_at ELSE users.updated_at END "
+    "RETURNING " + ", ".join(models.USER_LIST_FIELDS)
+).bindparams(
+    bindparam("created_at", type_=DateTime), bindparam("updated_at", type_=DateTime),
+).columns(created_at=DateTime, updated_at=DateTime)
 
 
 def create_user(db: Session, user: Union[models.User, dict]) -> models.User:
-    """Create or return an existing user. If multiple users exist with the same wallet_address,
-    keep the oldest (smallest created_at) and delete the others.
-    """
-    # Normalize incoming data
-    data = {}
-    if isinstance(user, models.User):
-        data = user.dict()
-    else:
-        data = dict(user or {})
-
-    wallet = data.get('wallet_address')
-    if wallet:
-        wallet = wallet.lower()
-        data['wallet_address'] = wallet
-
-    # If wallet provided, check for existing users with this wallet
-    if wallet:
-        stmt = select(models.User).where(models.User.wallet_address == wallet).order_by(models.User.created_at)
-        rows = db.exec(stmt).all()
-        if rows:
-            # Keep the oldest, delete duplicates
-            oldest = rows[0]
-            duplicates = rows[1:]
-            for dup in duplicates:
-                try:
-                    db.delete(dup)
-                except Exception:
-                    pass
-            db.commit()
-            db.refresh(oldest)
-            return oldest
-
-    # Prepare fields for new user
-    # Ensure profile_url exists
-    if 'profile_url' not in data or not data.get('profile_url'):
-        base = data.get('username') or data.get('wallet_address')
-        # generate unique profile_url
-        data['profile_url'] = _generate_profile_url(db, base)
-
-    # Fill created_at if missing
-    if 'created_at' not in data or data.get('created_at') is None:
-        data['created_at'] = None
-
-    # Build model instance
-    allowed_keys = {k for k in models.User.__fields__.keys()}
-    model_kwargs = {k: v for k, v in data.items() if k in allowed_keys}
-    u = models.User(**model_kwargs)
-    db.add(u)
-    db.commit()
-    db.refresh(u)
+    """Create a user, or return the existing one with the same wallet_address, in a
+    single INSERT ... ON CONFLICT ... RETURNING statement. Wallets are stored
+    lowercase; merge_duplicate_users cleans up rows from before that."""
+    data = user.dict() if isinstance(user, models.User) else dict(user or {})
+    if data.get("wallet_address"):
+        data["wallet_address"] = data["wallet_address"].lower()
+    now = datetime.utcnow()
+    params = {
+        "wallet_address": data.get("wallet_address"), "username": data.get("username"),
+        "bio": data.get("bio"), "avatar_url": data.get("avatar_url"),
+        "created_at": data.get("created_at") or now, "updated_at": data.get("updated_at") or now,
+    }
+    base = data.get("username") or data.get("wallet_address")
+    profile_url = data.get("profile_url")
+
+    def upsert() -> models.User:
+        # generated profile_urls are retried on a unique conflict
+        row = db.execute(_UPSERT_USER, {**params, "profile_url": profile_url or ids.allocate_profile_id(db, base)})
+        return models.User(**row.mappings().one())
+
+    u = ids.execute_with_retry(db, upsert, "users.profile_url", attempts=1 if profile_url else ids.MAX_ATTEMPTS)
+    cache.invalidate(*_user_cache_keys(u))
     return u
 
 
-def list_users(db: Session, limit: int = 100, offset: int = 0) -> List[models.User]:
-    statement = select(models.User).offset(offset).limit(limit)
-    return db.exec(statement).all()
+def _project(model, fields: Sequence[str], keys: Sequence[str] = ()):
+    """select() only the given columns (plus the sort keys) so heavy ones are never loaded"""
+    return select(*[getattr(model, f) for f in dict.fromkeys((*fields, *keys))])
+
+
+def _fetch(db: Session, statement) -> List[dict]:
+    return [dict(row) for row in db.execute(statement).mappings()]
+
+
+def _page(rows: List[dict], fields: Sequence[str], keys: Sequence[str], limit: int) -> Tuple[List[dict], Optional[str]]:
+    """Trim a limit+1 fetch to the page and build the cursor for the next one"""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = pagination.encode_cursor(*(rows[-1][k] for k in keys))
+    return [{f: r[f] for f in fields} for r in rows], next_cursor
+
+
+USER_SORT_KEYS = ("id",)
+USER_CURSOR_TYPES = (int,)
+
+
+def list_users(db: Session, limit: int = 100, offset: int = 0,
+               fields: Sequence[str] = models.USER_SUMMARY_FIELDS,
+               cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """Users in id order. Pass the returned cursor back to get the next page;
+    offset is only honoured for the first page."""
+    key = pagination.decode_cursor(cursor, USER_CURSOR_TYPES)
+    statement = _project(models.User, fields, USER_SORT_KEYS).order_by(models.User.id)
+    if key:
+        statement = statement.where(models.User.id > key[0])
+    else:
+        statement = statement.offset(offset)
+    rows = _fetch(db, statement.limit(limit + 1))
+    return _page(rows, fields, USER_SORT_KEYS, limit)
 
 
 def get_user_by_profile(db: Session, profile_url: str) -> Optional[models.User]:
+    """Cached; returns a detached copy on a hit, so don't modify the result"""
     statement = select(models.User).where(models.User.profile_url == profile_url)
-    return db.exec(statement).first()
+    return cache.cached(
+        f"user:profile:{profile_url}", lambda: db.exec(statement).first(),
+        _dump_row, lambda d: models.User(**d),
+    )
 
 
 def delete_user(db: Session, user_id: int) -> bool:
     user = get_user(db, user_id)
     if not user:
         return False
+    keys = _user_cache_keys(user)
     db.delete(user)
     db.commit()
+    cache.invalidate(*keys)
     return True
 
+
+def merge_duplicate_users(db: Session) -> int:
+    """One-off cleanup for create_user's upsert: users whose wallet_address only
+    differs in case are merged into the oldest one (artworks, purchases, likes,
+    comments and unlocks move over), and every stored wallet is lowercased.
+    Returns the number of users removed."""
+    u = models.User.__table__
+    wallet = func.lower(u.c.wallet_address)
+    clashing = select(wallet).group_by(wallet).having(func.count() > 1)
+    rows = db.execute(select(u.c.id, wallet.label("wallet"), u.c.profile_url, u.c.wallet_address)
+                      .where(wallet.in_(clashing)).order_by(wallet, u.c.created_at, u.c.id)).all()
+    groups = {}
+    for row in rows:
+        groups.setdefault(row.wallet, []).append(row.id)
+    stale_keys = [k for row in rows for k in (f"user:wallet:{row.wallet_address}", f"user:profile:{row.profile_url}")]
+    stale_keys += [f"user:wallet:{w}" for w in db.execute(
+        select(u.c.wallet_address).where(u.c.wallet_address != wallet)).scalars()]
+
+    removed, moved, relike = 0, set(), set()
+    artworks, purchases, comments = models.Artwork.__table__, models.Purchase.__table__, models.Comment.__table__
+    likes, unlocks, sales = models.Like.__table__, models.PasswordUnlock.__table__, models.SalesAnalytics.__table__
+    for keeper, *others in groups.values():
+        moved.update(db.execute(select(artworks.c.id).where(artworks.c.creator_id.in_(others))).scalars())
+        # Core updates skip the ORM's version counter; bump it so ETags change
+        db.execute(artworks.update().where(artworks.c.creator_id.in_(others))
+                   .values(creator_id=keeper, version=artworks.c.version + 1))
+        db.execute(purchases.update().where(purchases.c.buyer_id.in_(others)).values(buyer_id=keeper))
+        db.execute(comments.update().where(comments.c.user_id.in_(others)).values(user_id=keeper))
+        # one like / unlock per artwork and user: keep the first of the group's rows
+        for table in (likes, unlocks):
+            group = table.c.user_id.in_([keeper, *others])
+            extra = group & table.c.id.notin_(select(func.min(table.c.id)).where(group).group_by(table.c.artwork_id))
+            if table is likes:
+                relike.update(db.execute(select(table.c.artwork_id).where(extra)).scalars())
+            db.execute(table.delete().where(extra))
+            db.execute(table.update().where(table.c.user_id.in_(others)).values(user_id=keeper))
+        db.execute(sales.delete().where(sales.c.seller_id.in_(others)))
+        db.execute(u.delete().where(u.c.id.in_(others)))
+        removed += len(others)
+    if relike:
+        db.execute(artworks.update().where(artworks.c.id.in_(relike)).values(
+            likes_count=select(func.count()).where(likes.c.artwork_id == artworks.c.id).scalar_subquery()))
+
+    db.execute(u.update().where(u.c.wallet_address != wallet).values(wallet_address=wallet))
+    mixed_case = artworks.c.creator_wallet != func.lower(artworks.c.creator_wallet)
+    moved.update(db.execute(select(artworks.c.id).where(mixed_case)).scalars())
+    db.execute(artworks.update().where(mixed_case)
+               .values(creator_wallet=func.lower(artworks.c.creator_wallet), version=artworks.c.version + 1))
+    db.execute(purchases.update().values(buyer_wallet=func.lower(purchases.c.buyer_wallet),
+                                         seller_wallet=func.lower(purchases.c.seller_wallet)))
+    db.commit()
+    for keeper, *_ in groups.values():
+        rebuild_sales_analytics(db, keeper)
+    cache.invalidate(*stale_keys, *(f"artwork:{a}" for a in moved | relike))
+    return removed
+
 # Artworks
 
 def get_artwork(db: Session, artwork_id: int) -> Optional[models.Artwork]:
-    return db.get(models.Artwork, artwork_id)
+    """Cached; returns a detached copy on a hit, so don't modify the result"""
+    return cache.cached(
+        f"artwork:{artwork_id}", lambda: db.get(models.Artwork, artwork_id),
+        _dump_row, lambda d: models.Artwork(**d),
+    )
+
+
+def get_artwork_version(db: Session, artwork_id: int) -> Optional[Tuple[str, int]]:
+    """(artwork_code, version) without loading the row, for cheap revalidation"""
+    statement = select(models.Artwork.artwork_code, models.Artwork.version).where(models.Artwork.id == artwork_id)
+    row = db.execute(statement).first()
+    return None if row is None else (row.artwork_code, row.version)
+
+
+def get_artwork_canvas(db: Session, artwork_id: int) -> Optional[Tuple[bytes, int]]:
+    """(packed pixel_data, version), the base a pixel edit is built on"""
+    statement = select(models.Artwork.pixel_data, models.Artwork.width, models.Artwork.height,
+                       models.Artwork.version).where(models.Artwork.id == artwork_id)
+    row = db.execute(statement).first()
+    if row is None:
+        return None
+    return pixel_codec.encode(row.pixel_data, row.width, row.height), row.version
 
 
-def list_artworks(db: Session, owner_id: Optional[int] = None, limit: int = 100, offset: int = 0) -> List[models.Artwork]:
-    statement = select(models.Artwork)
+def get_artwork_pixels(db: Session, artwork_id: int) -> Optional[bytes]:
+    """Packed pixel_data only (legacy JSON rows are packed on the fly)"""
+    statement = select(models.Artwork.pixel_data, models.Artwork.width, models.Artwork.height).where(
+        models.Artwork.id == artwork_id
+    )
+    row = db.execute(statement).first()
+    if row is None:
+        return None
+    return pixel_codec.encode(row.pixel_data, row.width, row.height)
+
+
+ARTWORK_SORT_KEYS = ("published_at", "id")
+ARTWORK_CURSOR_TYPES = ((datetime, type(None)), int)
+
+
+def list_artworks(db: Session, owner_id: Optional[int] = None, limit: int = 100, offset: int = 0,
+                  fields: Sequence[str] = models.ARTWORK_SUMMARY_FIELDS,
+                  cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """Artworks newest published first, then unpublished ones (SQLite sorts NULL
+    published_at last in DESC order). Every page is an index range scan on
+    (published_at, id), so deep pages cost the same as the first one."""
+    key = pagination.decode_cursor(cursor, ARTWORK_CURSOR_TYPES)
+    base = _project(models.Artwork, fields, ARTWORK_SORT_KEYS)
     if owner_id is not None:
-        statement = statement.where(models.Artwork.creator_id == owner_id)
-    statement = statement.offset(offset).limit(limit)
-    return db.exec(statement).all()
+        base = base.where(models.Artwork.creator_id == owner_id)
+    statement = base.order_by(models.Artwork.published_at.desc(), models.Artwork.id.desc())
+    if key is None:
+        statement = statement.offset(offset)
+    elif key[0] is None:
+        statement = statement.where(models.Artwork.published_at.is_(None), models.Artwork.id < key[1])
+    else:
+        statement = statement.where(tuple_(models.Artwork.published_at, models.Artwork.id) < key)
+    rows = _fetch(db, statement.limit(limit + 1))
+
+    # the row-value comparison never matches NULLs, so top up from the unpublished tail
+    if key is not None and key[0] is not None and len(rows) <= limit:
+        tail = (base.where(models.Artwork.published_at.is_(None))
+                .order_by(models.Artwork.id.desc())
+                .limit(limit + 1 - len(rows)))
+        rows += _fetch(db, tail)
+    return _page(rows, fields, ARTWORK_SORT_KEYS, limit)
+
+
+SEARCH_SORT_KEYS = ("score", "id")
+SEARCH_CURSOR_TYPES = ((float, int), int)
+
+
+def search_artworks(db: Session, q: str, limit: int = 20,
+                    fields: Sequence[str] = models.ARTWORK_SUMMARY_FIELDS,
+                    cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """Published artworks matching q (prefix match on title, description and
+    creator username), best match first; see search.py"""
+    key = pagination.decode_cursor(cursor, SEARCH_CURSOR_TYPES)
+    rows = search.search(db, q, fields, limit + 1, after=key)
+    return _page(rows, fields, SEARCH_SORT_KEYS, limit)
+
+
+def _detail_columns(viewer_id: Optional[int]) -> list:
+    """comments_count and the viewer flags as correlated subqueries on artworks.id"""
+    A = models.Artwork
+    comments = (select(func.count()).where(models.Comment.artwork_id == A.id)
+                .scalar_subquery().label("comments_count"))
+    if viewer_id is None:
+        return [comments, literal(False).label("viewer_unlocked"), literal(False).label("viewer_purchased")]
+    unlocked = exists().where(models.PasswordUnlock.artwork_id == A.id, models.PasswordUnlock.user_id == viewer_id)
+    purchased = exists().where(models.Purchase.artwork_id == A.id, models.Purchase.buyer_id == viewer_id)
+    return [comments, unlocked.label("viewer_unlocked"), purchased.label("viewer_purchased")]
+
+
+def get_artwork_detail(db: Session, artwork_id: int, viewer_id: Optional[int] = None) -> Optional[dict]:
+    """The artwork, its creator (joined), comment count and the viewer's
+    unlock/purchase status in one statement, as fields of models.ArtworkDetail
+    (pixel_data still packed); None if it does not exist"""
+    statement = (select(models.Artwork, *_detail_columns(viewer_id))
+                 .options(joinedload(models.Artwork.creator))
+                 .where(models.Artwork.id == artwork_id))
+    row = db.execute(statement).first()
+    if row is None:
+        return None
+    artwork, comments_count, unlocked, purchased = row
+    creator = models.ArtworkCreator.from_orm(artwork.creator).dict() if artwork.creator else None
+    return dict(artwork.dict(), creator=creator, comments_count=comments_count,
+                viewer_unlocked=unlocked, viewer_purchased=purchased)
+
+
+def get_artwork_cards(db: Session, artwork_ids: Sequence[int],
+                      viewer_id: Optional[int] = None) -> List[models.ArtworkCard]:
+    """ArtworkDetail's extras for a page of artworks, in one statement and in
+    the order given; ids that do not exist are left out"""
+    A, U = models.Artwork, models.User
+    statement = (select(*[getattr(A, f) for f in models.ARTWORK_SUMMARY_FIELDS],
+                        *[getattr(U, f).label(f"creator_{f}") for f in models.ARTWORK_CREATOR_FIELDS],
+                        *_detail_columns(viewer_id))
+                 .outerjoin(U, U.id == A.creator_id)
+                 .where(A.id.in_(artwork_ids)))
+    cards = {}
+    for row in db.execute(statement).mappings():
+        row = dict(row)
+        creator = {f: row.pop(f"creator_{f}") for f in models.ARTWORK_CREATOR_FIELDS}
+        cards[row["id"]] = models.ArtworkCard(**row, creator=creator if creator["id"] is not None else None)
+    return [cards[i] for i in dict.fromkeys(artwork_ids) if i in cards]
 
 
 def create_artwork(db: Session, artwork: models.Artwork) -> models.Artwork:
-    db.add(artwork)
-    db.commit()
+    """Insert an artwork. Without an artwork_code one is allocated from the
+    creator's profile ID (retried on a unique conflict). Indexing, thumbnail
+    and mint work is queued in the same transaction (jobs.py)."""
+    if artwork.is_published and artwork.published_at is None:
+        artwork.published_at = datetime.utcnow()
+    artwork.pixel_data = pixel_codec.encode(artwork.pixel_data, artwork.width, artwork.height)
+    kinds = jobs.artwork_jobs(artwork)
+    if artwork.artwork_code:
+        db.add(artwork)
+        db.flush()
+        jobs.enqueue(db, artwork.id, kinds)
+        db.commit()
+    else:
+        creator = db.get(models.User, artwork.creator_id)
+        profile_id = creator.profile_url if creator else None
+        if creator and not artwork.creator_wallet:
+            artwork.creator_wallet = creator.wallet_address
+        artwork.artwork_code = ids.new_artwork_code(profile_id)
+        ids.insert_with_retry(db, artwork, "artwork_code", "artworks.artwork_code",
+                              lambda: ids.new_artwork_code(profile_id),
+                              before_commit=lambda: jobs.enqueue(db, artwork.id, kinds))
+    jobs.queue.notify(len(kinds))
     db.refresh(artwork)
     return artwork
 
 
-def update_artwork(db: Session, artwork_id: int, **kwargs) -> Optional[models.Artwork]:
-    artwork = get_artwork(db, artwork_id)
+def find_duplicates(db: Session, content_hash: str, phash: int, max_distance: int = dedup.DEFAULT_MAX_DISTANCE,
+                    exclude_id: Optional[int] = None) -> List[dict]:
+    """Matches for hashes from dedup.compute"""
+    return dedup.find_duplicates(db, content_hash, phash, max_distance, exclude_id)
+
+
+class VersionConflict(ValueError):
+    """The artwork changed since the version the client edited"""
+
+    def __init__(self, current: int):
+        super().__init__(f"Artwork was changed by someone else (now at version {current})")
+        self.current = current
+
+
+def update_artwork(db: Session, artwork_id: int, version: Optional[int] = None,
+                   cells: Optional[Sequence] = None, rects: Optional[Sequence] = None,
+                   **kwargs) -> Optional[models.Artwork]:
+    """Update the given columns. pixel_data replaces the grid (width/height only
+    apply together with it); cells/rects patch the stored grid in place. With
+    version set, raises VersionConflict unless it matches the stored one."""
+    artwork = db.get(models.Artwork, artwork_id)
     if not artwork:
         return None
+    if version is not None and artwork.version != version:
+        raise VersionConflict(artwork.version)
+    pixels_changed = kwargs.get("pixel_data") is not None
+    if pixels_changed:
+        kwargs["pixel_data"] = pixel_codec.encode(
+            kwargs["pixel_data"], kwargs.get("width") or artwork.width, kwargs.get("height") or artwork.height
+        )
+        kwargs["width"], kwargs["height"] = pixel_codec.read_header(kwargs["pixel_data"])[:2]
+    else:
+        kwargs.pop("width", None)
+        kwargs.pop("height", None)
     for k, v in kwargs.items():
         if hasattr(artwork, k) and v is not None:
             setattr(artwork, k, v)
+    if cells or rects:
+        blob = pixel_codec.encode(artwork.pixel_data, artwork.width, artwork.height)
+        artwork.pixel_data = pixel_codec.apply_patch(blob, cells or (), rects or ())
+        pixels_changed = True
+    if artwork.is_published and artwork.published_at is None:
+        artwork.published_at = datetime.utcnow()
+    artwork.updated_at = datetime.utcnow()
     db.add(artwork)
+    try:
+        # the UPDATE is guarded by the version read above (models.Artwork version_id_col)
+        db.flush()
+    except StaleDataError:
+        db.rollback()
+        current = db.get(models.Artwork, artwork_id)
+        raise VersionConflict(current.version if current else 0)
+    kinds = jobs.artwork_jobs(artwork, pixels_changed)
+    jobs.enqueue(db, artwork_id, kinds)
     db.commit()
+    jobs.queue.notify(len(kinds))
+    cache.invalidate(f"artwork:{artwork_id}")
     db.refresh(artwork)
     return artwork
 
 
 def delete_artwork(db: Session, artwork_id: int) -> bool:
-    artwork = get_artwork(db, artwork_id)
+    artwork = db.get(models.Artwork, artwork_id)
     if not artwork:
         return False
     db.delete(artwork)
+    search.remove_artwork(db, artwork_id)
+    dedup.remove_artwork(db, artwork_id)
     db.commit()
+    cache.invalidate(f"artwork:{artwork_id}")
     return True
+
+# Purchases and sales analytics
+
+def get_unlock_state(db: Session, artwork_id: int, user_id: int) -> Optional[dict]:
+    """What POST /artworks/{id}/unlock needs, in one query: the stored hash (or
+    legacy plaintext), whether the user exists and whether they already unlocked
+    the artwork. None if the artwork does not exist."""
+    A, U = models.Artwork, models.PasswordUnlock
+    statement = select(
+        A.unlock_hash, A.unlock_password,
+        exists().where(models.User.id == user_id).label("user_exists"),
+        exists().where(U.artwork_id == A.id, U.user_id == user_id).label("unlocked"),
+    ).where(A.id == artwork_id)
+    row = db.execute(statement).mappings().first()
+    return dict(row) if row else None
+
+
+def record_unlock(db: Session, artwork_id: int, user_id: int, upgraded_hash: Optional[str] = None) -> None:
+    """Remember a successful unlock (once per user and artwork); upgraded_hash
+    replaces a legacy plaintext password in the same transaction"""
+    table = models.PasswordUnlock.__table__
+    seen = exists().where(table.c.artwork_id == artwork_id, table.c.user_id == user_id)
+    db.execute(table.insert().from_select(
+        ["artwork_id", "user_id", "unlocked_at"],
+        select(literal(artwork_id), literal(user_id), literal(datetime.utcnow(), DateTime)).where(~seen),
+    ))
+    if upgraded_hash:
+        # not an edit, so the version stays
+        artworks = models.Artwork.__table__
+        db.execute(artworks.update()
+                   .where(artworks.c.id == artwork_id, artworks.c.unlock_hash.is_(None))
+                   .values(unlock_hash=upgraded_hash, unlock_password=""))
+    db.commit()
+    if upgraded_hash:
+        cache.invalidate(f"artwork:{artwork_id}")
+
+
+def record_purchase(db: Session, artwork_id: int, buyer_id: int, price_flow: Optional[float] = None,
+                    transaction_hash: Optional[str] = None) -> Optional[models.Purchase]:
+    """Insert a purchase and bump the seller's sales_analytics row in the same
+    transaction. Returns None if the artwork or buyer does not exist."""
+    artwork = db.get(models.Artwork, artwork_id)
+    buyer = db.get(models.User, buyer_id)
+    if not artwork or not buyer:
+        return None
+    now = datetime.utcnow()
+    purchase = models.Purchase(
+        artwork_id=artwork_id,
+        buyer_id=buyer_id,
+        buyer_wallet=buyer.wallet_address,
+        seller_wallet=artwork.creator_wallet,
+        price_flow=(artwork.price_flow or 0.0) if price_flow is None else price_flow,
+        transaction_hash=transaction_hash,
+        purchased_at=now,
+    )
+    db.add(purchase)
+    table = models.SalesAnalytics.__table__
+    upsert = sqlite_insert(table).values(
+        seller_id=artwork.creator_id, artwork_id=artwork_id, total_sales=1,
+        total_revenue_flow=purchase.price_flow, last_sale_at=now, updated_at=now,
+    )
+    db.execute(upsert.on_conflict_do_update(
+        index_elements=[table.c.seller_id, table.c.artwork_id],
+        set_={
+            "total_sales": func.coalesce(table.c.total_sales, 0) + 1,
+            "total_revenue_flow": func.coalesce(table.c.total_revenue_flow, 0) + upsert.excluded.total_revenue_flow,
+            "last_sale_at": upsert.excluded.last_sale_at,
+            "updated_at": upsert.excluded.updated_at,
+        },
+    ))
+    db.commit()
+    db.refresh(purchase)
+    return purchase
+
+
+def get_seller_sales(db: Session, seller_id: int) -> models.SellerSales:
+    """Precomputed rows only; purchases are never scanned here"""
+    statement = (select(models.SalesAnalytics)
+                 .where(models.SalesAnalytics.seller_id == seller_id)
+                 .order_by(models.SalesAnalytics.total_revenue_flow.desc()))
+    rows = db.exec(statement).all()
+    return models.SellerSales(
+        seller_id=seller_id,
+        total_sales=sum(r.total_sales or 0 for r in rows),
+        total_revenue_flow=sum(r.total_revenue_flow or 0.0 for r in rows),
+        artworks=rows,
+    )
+
+
+def rebuild_sales_analytics(db: Session, seller_id: Optional[int] = None) -> int:
+    """Recompute sales_analytics from purchases (all sellers, or one); returns
+    the number of rows written. For backfills and repairs."""
+    table = models.SalesAnalytics.__table__
+    p, a = models.Purchase.__table__, models.Artwork.__table__
+    source = (select(a.c.creator_id, p.c.artwork_id, func.count(), func.sum(p.c.price_flow),
+                     func.max(p.c.purchased_at), func.datetime("now"))
+              .select_from(p.join(a, a.c.id == p.c.artwork_id))
+              .group_by(a.c.creator_id, p.c.artwork_id))
+    delete = table.delete()
+    if seller_id is not None:
+        source = source.where(a.c.creator_id == seller_id)
+        delete = delete.where(table.c.seller_id == seller_id)
+    db.execute(delete)
+    result = db.execute(table.insert().from_select(
+        ["seller_id", "artwork_id", "total_sales", "total_revenue_flow", "last_sale_at", "updated_at"], source,
+    ))
+    db.commit()
+    return result.rowcount
@@ -1,13 +1,138 @@
+import os
+from typing import Union
+
 from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import event, inspect, text
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool, StaticPool
+from sqlalchemy.schema import CreateColumn
+
+import metrics
+
+DATABASE_URL = os.getenv("PIXELLAR_DATABASE_URL", "sqlite:///./data.db")
+# Set PIXELLAR_ASYNC_DB=1 to serve requests through an aiosqlite AsyncSession
+# instead of sync sessions on the threadpool (see async_crud.py).
+USE_ASYNC_DB = os.getenv("PIXELLAR_ASYNC_DB", "").lower() in ("1", "true", "yes")
+ASYNC_DATABASE_URL = os.getenv(
+    "PIXELLAR_ASYNC_DATABASE_URL", DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
+)
+
+# Connection pragmas applied to every new SQLite connection. "wal" lets readers
+# run alongside a writer and waits on locks instead of failing with
+# "database is locked"; "legacy" keeps SQLite's defaults.
+SQLITE_PROFILES = {
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -64000,  # KiB
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+    "legacy": {},
+}
+SQLITE_PROFILE = os.getenv("PIXELLAR_SQLITE_PROFILE", "wal")
+POOL_SIZE = int(os.getenv("PIXELLAR_DB_POOL_SIZE", 5))
+POOL_MAX_OVERFLOW = int(os.getenv("PIXELLAR_DB_POOL_MAX_OVERFLOW", 10))
+
+
+def _is_memory(url: str) -> bool:
+    return url.rstrip("/").endswith(("sqlite:", "sqlite+aiosqlite:")) or ":memory:" in url
+
+
+def _apply_pragmas(engine, read_only: bool = False):
+    pragmas = SQLITE_PROFILES[SQLITE_PROFILE]
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+
+def _pool_args(url: str, poolclass) -> dict:
+    if _is_memory(url):
+        # every connection to :memory: is a new database, so share one
+        return {"poolclass": StaticPool}
+    return {"poolclass": poolclass, "pool_size": POOL_SIZE, "max_overflow": POOL_MAX_OVERFLOW}
 
-DATABASE_URL = "sqlite:///./data.db"
 
-engine = create_engine(DATABASE_URL, echo=False, connect_args={"check_same_thread": False})
+def make_engine(url: str = DATABASE_URL, read_only: bool = False):
+    engine = create_engine(
+        url, echo=False, connect_args={"check_same_thread": False}, **_pool_args(url, QueuePool)
+    )
+    _apply_pragmas(engine, read_only)
+    metrics.instrument(engine)
+    return engine
+
+
+def make_async_engine(url: str = ASYNC_DATABASE_URL, read_only: bool = False):
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    engine = create_async_engine(url, echo=False, **_pool_args(url, AsyncAdaptedQueuePool))
+    _apply_pragmas(engine.sync_engine, read_only)
+    metrics.instrument(engine.sync_engine)
+    return engine
+
+
+# Writes go through engine; GET endpoints use read_engine, whose connections are
+# query_only so a stray write fails loudly instead of taking the write lock.
+engine = make_engine(DATABASE_URL)
+read_engine = engine if _is_memory(DATABASE_URL) else make_engine(DATABASE_URL, read_only=True)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=Session)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine, class_=Session)
+
+async_engine = None
+async_read_engine = None
+AsyncSessionLocal = None
+AsyncReadSessionLocal = None
+if USE_ASYNC_DB:
+    async_engine = make_async_engine(ASYNC_DATABASE_URL)
+    async_read_engine = (
+        async_engine if _is_memory(ASYNC_DATABASE_URL) else make_async_engine(ASYNC_DATABASE_URL, read_only=True)
+    )
+    # responses are serialized after the session closes, so keep loaded attributes
+    AsyncSessionLocal = sessionmaker(
+        autocommit=False, autoflush=False, expire_on_commit=False, bind=async_engine, class_=AsyncSession
+    )
+    AsyncReadSessionLocal = sessionmaker(
+        autocommit=False, autoflush=False, expire_on_commit=False, bind=async_read_engine, class_=AsyncSession
+    )
+
+AnySession = Union[Session, AsyncSession]
+
+
+def _add_missing_columns(table):
+    """ALTER TABLE ... ADD COLUMN for model columns an older database lacks
+    (they need to be nullable or have a server_default)"""
+    existing = {c["name"] for c in inspect(engine).get_columns(table.name)}
+    missing = [c for c in table.columns if c.name not in existing]
+    if not missing:
+        return
+    with engine.begin() as conn:
+        for column in missing:
+            ddl = CreateColumn(column).compile(dialect=engine.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
 
 
 def init_db():
     # Import models here to ensure they are registered on SQLModel.metadata
     import models  # noqa: F401
     SQLModel.metadata.create_all(engine)
+    # create_all skips tables that already exist, so add any new columns and indexes
+    for table in SQLModel.metadata.sorted_tables:
+        _add_missing_columns(table)
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    if engine.dialect.name == "sqlite":
+        import search
+        search.ensure_index(engine)
+
+
+async def dispose():
+    for e in {async_engine, async_read_engine} - {None}:
+        await e.dispose()
@@ -20,15 +20,16 @@ CREATE INDEX idx_wallet_address ON users(wallet_address);
 -- Artworks table: stores artwork metadata
 CREATE TABLE artworks (
     id SERIAL PRIMARY KEY,
-    artwork_code VARCHAR(14) NOT NULL UNIQUE, -- 9 (profile) + 5 (random) characters
+    artwork_code VARCHAR(14) NOT NULL UNIQUE, -- 9 (profile) + 4 (random) characters, see ids.py
     creator_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
     creator_wallet VARCHAR(18) NOT NULL,
     title VARCHAR(200) NOT NULL,
     description TEXT,
-    pixel_data TEXT NOT NULL, -- JSON string of pixel art data
+    pixel_data BYTEA NOT NULL, -- packed pixel grid (palette + RLE/zlib, see pixel_codec.py)
     width INTEGER NOT NULL,
     height INTEGER NOT NULL,
-    unlock_password VARCHAR(6) NOT NULL, -- 6 character alphanumeric password
+    unlock_password VARCHAR(6) NOT NULL, -- legacy plaintext, blanked once unlock_hash is set
+    unlock_hash TEXT, -- salted scrypt hash of the unlock password (passwords.py)
     price_flow DECIMAL(18, 8) NOT NULL, -- Price in FLOW tokens
     publish_fee DECIMAL(18, 8) NOT NULL, -- Fee paid to publish
     is_published BOOLEAN DEFAULT FALSE,
@@ -38,7 +39,8 @@ CREATE TABLE artworks (
     likes_count INTEGER DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     published_at TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    version INTEGER NOT NULL DEFAULT 1 -- bumped on every update, for optimistic locking
 );
 
 -- Indexes for artwork queries
@@ -46,6 +48,9 @@ CREATE INDEX idx_artwork_code ON artworks(artwork_code);
 CREATE INDEX idx_creator_id ON artworks(creator_id);
 CREATE INDEX idx_is_published ON artworks(is_published);
 CREATE INDEX idx_published_at ON artworks(published_at DESC);
+-- Keyset pagination: ORDER BY published_at DESC, id DESC
+CREATE INDEX idx_artworks_published_id ON artworks(published_at, id);
+CREATE INDEX idx_artworks_creator_published_id ON artworks(creator_id, published_at, id);
 
 -- Purchases table: tracks artwork purchases
 CREATE TABLE purchases (
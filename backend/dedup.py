@@ -0,0 +1,291 @@
+"""Exact and near-duplicate detection for pixel_data.
+
+Every artwork gets a row in artwork_hashes:
+- content_hash: sha256 of the decoded RGBA pixels and size, so the same grid
+  matches whatever palette order or packing it was stored with;
+- phash: 64-bit difference hash (dHash) of the grid shrunk to 9x8 luminance
+  (transparent pixels count as white), which changes by only a few bits when
+  a few pixels are edited or the grid is rescaled.
+
+Near-duplicates are found with an in-memory multi-index hash table over phash
+(HammingIndex), so a lookup touches a few buckets instead of comparing
+against every row. Flat or smoothly shaded grids have almost no luminance
+edges, so their dHash is (nearly) all zeros or all ones whatever the colours;
+those stay out of the table and only match exact copies, by content_hash.
+
+The index loads from artwork_hashes on first use and, before each lookup,
+re-reads the rows written since (by seq, so edits made by other processes
+count too); candidates are re-checked against the table, so entries for
+deleted artworks never leak into results.
+
+Hashes are written by the hash job crud queues on create/update (jobs.py).
+For rows written before that:
+
+    python dedup.py backfill
+"""
+import hashlib
+import sys
+import threading
+from itertools import combinations
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+import pixel_codec
+
+HASH_WIDTH, HASH_HEIGHT = 9, 8
+DEFAULT_MAX_DISTANCE = 4
+# a phash with fewer set (or unset) bits than this is too featureless to compare
+MIN_PHASH_BITS = 8
+BACKFILL_BATCH = 500
+
+
+def _to_signed(value: int) -> int:
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _to_unsigned(value: int) -> int:
+    return value & 0xFFFFFFFFFFFFFFFF
+
+
+def _luma(rgba) -> float:
+    r, g, b, a = rgba
+    # Rec. 601 luma, blended over white
+    y = 0.299 * r + 0.587 * g + 0.114 * b
+    return (y * a + 255 * (255 - a)) / 255
+
+
+def compute(blob) -> Tuple[str, int]:
+    """(content_hash, phash) for packed or JSON pixel_data"""
+    width, height, palette, indices = pixel_codec.decode_indices(pixel_codec.encode(blob))
+    digest = hashlib.sha256(f"{width}x{height}|".encode())
+    colors = [bytes(c) for c in palette]
+    digest.update(b"".join(colors[i] for i in indices))
+    if not width or not height:
+        return digest.hexdigest(), 0
+
+    luma = [_luma(c) for c in palette]
+    # box-average the grid down to HASH_WIDTH x HASH_HEIGHT (nearest cell when upscaling)
+    cells = []
+    for ty in range(HASH_HEIGHT):
+        y0 = ty * height // HASH_HEIGHT
+        y1 = max(y0 + 1, (ty + 1) * height // HASH_HEIGHT)
+        for tx in range(HASH_WIDTH):
+            x0 = tx * width // HASH_WIDTH
+            x1 = max(x0 + 1, (tx + 1) * width // HASH_WIDTH)
+            total = 0.0
+            for y in range(y0, y1):
+                row = y * width
+                total += sum(luma[i] for i in indices[row + x0:row + x1])
+            cells.append(total / ((y1 - y0) * (x1 - x0)))
+    phash = 0
+    for ty in range(HASH_HEIGHT):
+        row = cells[ty * HASH_WIDTH:(ty + 1) * HASH_WIDTH]
+        for tx in range(HASH_WIDTH - 1):
+            phash = (phash << 1) | (row[tx] > row[tx + 1])
+    return digest.hexdigest(), phash
+
+
+def distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def informative(phash: int) -> bool:
+    """Whether phash has enough edges for near matches to mean anything"""
+    bits = bin(_to_unsigned(phash)).count("1")
+    return MIN_PHASH_BITS <= bits <= 64 - MIN_PHASH_BITS
+
+
+class HammingIndex:
+    """Multi-index hashing over 64-bit hashes. The bits are split into CHUNKS
+    parts with a bucket table each; two hashes within r bits of each other agree
+    to within r // CHUNKS bits on at least one part (pigeonhole), so a lookup
+    only probes those buckets and checks the few ids found there."""
+
+    CHUNKS = 5
+
+    def __init__(self):
+        widths = [64 // self.CHUNKS + (i < 64 % self.CHUNKS) for i in range(self.CHUNKS)]
+        self._parts: List[Tuple[int, int]] = []  # (shift, width)
+        shift = 0
+        for w in widths:
+            self._parts.append((shift, w))
+            shift += w
+        self._tables: List[Dict[int, Set[int]]] = [{} for _ in self._parts]
+        self._hash_of: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._hash_of)
+
+    def _keys(self, value: int):
+        return [(value >> shift) & ((1 << width) - 1) for shift, width in self._parts]
+
+    def add(self, item_id: int, value: int) -> None:
+        self.remove(item_id)
+        self._hash_of[item_id] = value
+        for table, key in zip(self._tables, self._keys(value)):
+            table.setdefault(key, set()).add(item_id)
+
+    def remove(self, item_id: int) -> None:
+        value = self._hash_of.pop(item_id, None)
+        if value is None:
+            return
+        for table, key in zip(self._tables, self._keys(value)):
+            bucket = table[key]
+            bucket.discard(item_id)
+            if not bucket:
+                del table[key]
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, int]]:
+        """[(id, distance)] for every hash within max_distance"""
+        flips = max_distance // self.CHUNKS
+        seen: Set[int] = set()
+        found = []
+        for table, key, (_, width) in zip(self._tables, self._keys(value), self._parts):
+            probes = [key]
+            for n in range(1, flips + 1):
+                for bits in combinations(range(width), n):
+                    probes.append(key ^ sum(1 << b for b in bits))
+            for probe in probes:
+                for item_id in table.get(probe, ()):
+                    if item_id in seen:
+                        continue
+                    seen.add(item_id)
+                    d = distance(value, self._hash_of[item_id])
+                    if d <= max_distance:
+                        found.append((item_id, d))
+        return found
+
+
+class DedupIndex:
+    """Process-wide HammingIndex over artwork_hashes.phash"""
+
+    def __init__(self):
+        self.hashes = HammingIndex()
+        self._lock = threading.Lock()
+        # rows from before the seq column have seq 0
+        self._last_seq = -1
+
+    def add(self, artwork_id: int, phash: int) -> None:
+        with self._lock:
+            if informative(phash):
+                self.hashes.add(artwork_id, _to_unsigned(phash))
+            else:
+                self.hashes.remove(artwork_id)
+
+    def remove(self, artwork_id: int) -> None:
+        with self._lock:
+            self.hashes.remove(artwork_id)
+
+    def _catch_up(self, conn) -> None:
+        rows = conn.execute(
+            text("SELECT artwork_id, phash, seq FROM artwork_hashes WHERE seq > :last ORDER BY seq"),
+            {"last": self._last_seq},
+        ).all()
+        for artwork_id, phash, _ in rows:
+            if informative(phash):
+                self.hashes.add(artwork_id, _to_unsigned(phash))
+            else:
+                self.hashes.remove(artwork_id)
+        if rows:
+            self._last_seq = rows[-1][2]
+
+    def candidates(self, conn, phash: int, max_distance: int) -> List[int]:
+        with self._lock:
+            self._catch_up(conn)
+            return [i for i, _ in self.hashes.search(_to_unsigned(phash), max_distance)]
+
+
+index = DedupIndex()
+
+
+def index_artwork(conn, artwork_id: int, blob) -> Tuple[str, int]:
+    """Write the artwork's hashes for its stored pixel_data"""
+    content_hash, phash = compute(blob)
+    # SQLite has one writer at a time, so seqs become visible in order
+    conn.execute(
+        text("INSERT OR REPLACE INTO artwork_hashes (artwork_id, content_hash, phash, seq) "
+             "VALUES (:id, :c, :p, (SELECT COALESCE(MAX(seq), 0) + 1 FROM artwork_hashes))"),
+        {"id": artwork_id, "c": content_hash, "p": _to_signed(phash)},
+    )
+    index.add(artwork_id, phash)
+    return content_hash, phash
+
+
+def remove_artwork(conn, artwork_id: int) -> None:
+    conn.execute(text("DELETE FROM artwork_hashes WHERE artwork_id = :id"), {"id": artwork_id})
+    index.remove(artwork_id)
+
+
+def find_duplicates(conn, content_hash: str, phash: int, max_distance: int = DEFAULT_MAX_DISTANCE,
+                    exclude_id: Optional[int] = None) -> List[dict]:
+    """Artworks whose pixels are identical (exact) or within max_distance bits of
+    phash, closest first. Hash the query pixels with compute() first; that is the
+    CPU-bound part, so the API does it on the threadpool."""
+    if not informative(phash):
+        # every flat grid is within a few bits of every other; only exact copies count
+        rows = conn.execute(
+            text("SELECT artwork_id FROM artwork_hashes WHERE content_hash = :c ORDER BY artwork_id"),
+            {"c": content_hash},
+        ).all()
+        return [{"artwork_id": i, "distance": 0, "exact": True} for (i,) in rows if i != exclude_id]
+    # identical pixels always share a phash, so exact copies are among the candidates
+    ids: Set[int] = set(index.candidates(conn, phash, max_distance))
+    ids.discard(exclude_id)
+    if not ids:
+        return []
+    params = {f"i{n}": i for n, i in enumerate(ids)}
+    rows = conn.execute(
+        text(f"SELECT artwork_id, content_hash, phash FROM artwork_hashes "
+             f"WHERE artwork_id IN ({', '.join(':' + k for k in params)})"),
+        params,
+    ).all()
+    found = []
+    for artwork_id, row_hash, row_phash in rows:
+        exact = row_hash == content_hash
+        d = distance(phash, _to_unsigned(row_phash))
+        if d <= max_distance:
+            found.append({"artwork_id": artwork_id, "distance": d, "exact": exact})
+    found.sort(key=lambda r: (r["distance"], r["artwork_id"]))
+    return found
+
+
+def index_missing(conn, codes: Optional[Iterable[str]] = None, batch_size: int = BACKFILL_BATCH) -> int:
+    """Hash artworks that have no artwork_hashes row yet (optionally only the given codes)"""
+    where = "h.artwork_id IS NULL"
+    params = {}
+    if codes is not None:
+        params = {f"c{n}": c for n, c in enumerate(codes)}
+        if not params:
+            return 0
+        where += f" AND a.artwork_code IN ({', '.join(':' + k for k in params)})"
+    done = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            text("SELECT a.id, a.pixel_data, a.width, a.height FROM artworks a "
+                 "LEFT JOIN artwork_hashes h ON h.artwork_id = a.id "
+                 f"WHERE {where} AND a.id > :last ORDER BY a.id LIMIT :n"),
+            {**params, "last": last_id, "n": batch_size},
+        ).all()
+        if not rows:
+            return done
+        for artwork_id, blob, width, height in rows:
+            last_id = artwork_id
+            try:
+                index_artwork(conn, artwork_id, pixel_codec.encode(blob, width, height))
+                done += 1
+            except pixel_codec.PixelCodecError:
+                pass
+
+
+if __name__ == "__main__":
+    import database
+
+    if sys.argv[1:] != ["backfill"]:
+        print(__doc__.strip().splitlines()[-1].strip())
+        raise SystemExit(1)
+    database.init_db()
+    with database.engine.begin() as conn:
+        print(f"Hashed {index_missing(conn)} artworks")
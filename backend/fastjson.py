@@ -0,0 +1,65 @@
+"""Opt-in orjson path for list endpoints (PIXELLAR_FAST_JSON=1).
+
+Normally list rows go through the response_model: Pydantic builds and
+validates a model per row, then FastAPI's jsonable_encoder and json.dumps
+walk the result again. The rows from crud are already plain dicts of known
+columns, so this path only fixes up the few values whose Python type differs
+from the API type (SQLite 0/1 -> bool, NUMERIC ints -> float, datetimes
+read as text, packed pixel_data -> rows) and hands the list to orjson, which
+also writes datetimes itself. The JSON is the same either way;
+bench_json.py compares the cost of both paths.
+"""
+import os
+from datetime import datetime
+from functools import lru_cache
+from typing import Callable, Dict, List, Mapping, Optional
+
+from fastapi.responses import ORJSONResponse
+
+import pixel_codec
+
+ENABLED = os.getenv("PIXELLAR_FAST_JSON", "").lower() in ("1", "true", "yes")
+
+
+def _to_float(v):
+    return v if v is None or isinstance(v, float) else float(v)
+
+
+def _to_bool(v):
+    return v if v is None or isinstance(v, bool) else bool(v)
+
+
+def _to_datetime(v):
+    return datetime.fromisoformat(v) if isinstance(v, str) else v
+
+
+def _to_grid(v):
+    return pixel_codec.decode(v) if isinstance(v, (bytes, str)) else v
+
+
+_CONVERTERS = {float: _to_float, bool: _to_bool, datetime: _to_datetime}
+
+
+@lru_cache(maxsize=None)
+def converters(model) -> Dict[str, Callable]:
+    """Per-field fixups for a list item model, from its field types"""
+    out = {}
+    for name, field in model.__fields__.items():
+        if name == "pixel_data":
+            out[name] = _to_grid
+        elif field.outer_type_ in _CONVERTERS:
+            out[name] = _CONVERTERS[field.outer_type_]
+    return out
+
+
+def shape(rows: List[dict], model) -> List[dict]:
+    """Convert rows in place to what the response_model would have produced"""
+    fixes = converters(model)
+    for row in rows:
+        for key in fixes.keys() & row.keys():
+            row[key] = fixes[key](row[key])
+    return rows
+
+
+def response(rows: List[dict], model, headers: Optional[Mapping[str, str]] = None) -> ORJSONResponse:
+    return ORJSONResponse(shape(rows, model), headers=dict(headers or {}))
@@ -0,0 +1,124 @@
+"""Profile IDs and artwork codes.
+
+- profile_url: 9 letters/digits (the first 3 follow the wallet address when
+  one is given, like before).
+- artwork_code: the creator's 9-char profile ID + a 4-char random suffix,
+  13 chars in total as the README describes.
+
+IDs are not checked before use. Callers insert and, if the unique index
+rejects the value, draw a new one and retry (insert_with_retry), so the
+cost does not grow with table size. PIXELLAR_ID_BLOCK_SIZE > 0 also keeps a
+block of pre-checked profile IDs in memory, refilled with one IN query.
+"""
+import os
+import secrets
+import string
+import threading
+from collections import deque
+from typing import Callable, Optional, TypeVar
+
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+ALPHABET = string.ascii_letters + string.digits
+PROFILE_ID_LENGTH = 9
+ARTWORK_SUFFIX_LENGTH = 4
+MAX_ATTEMPTS = 8
+BLOCK_SIZE = int(os.getenv("PIXELLAR_ID_BLOCK_SIZE", 0))
+
+
+T = TypeVar("T")
+
+
+class IdAllocationError(RuntimeError):
+    pass
+
+
+def random_id(length: int) -> str:
+    return "".join(secrets.choice(ALPHABET) for _ in range(length))
+
+
+def new_profile_id(base: Optional[str] = None) -> str:
+    prefix = "".join(c for c in (base or "").replace("0x", "") if c in ALPHABET)[:3]
+    return prefix + random_id(PROFILE_ID_LENGTH - len(prefix))
+
+
+def new_artwork_code(profile_id: Optional[str]) -> str:
+    prefix = (profile_id or "")[:PROFILE_ID_LENGTH]
+    if len(prefix) < PROFILE_ID_LENGTH:
+        prefix += random_id(PROFILE_ID_LENGTH - len(prefix))
+    return prefix + random_id(ARTWORK_SUFFIX_LENGTH)
+
+
+class ProfileIdBlock:
+    """Pre-allocated profile IDs, checked against users in one query per refill"""
+
+    def __init__(self, size: int = BLOCK_SIZE):
+        self.size = size
+        self._ids: deque = deque()
+        self._lock = threading.Lock()
+
+    def take(self, db: Session) -> str:
+        with self._lock:
+            if not self._ids:
+                self._refill(db)
+            return self._ids.popleft()
+
+    def _refill(self, db: Session):
+        import models
+
+        candidates = {random_id(PROFILE_ID_LENGTH) for _ in range(self.size)}
+        taken = set(db.exec(select(models.User.profile_url).where(models.User.profile_url.in_(candidates))).all())
+        self._ids.extend(candidates - taken)
+        if not self._ids:
+            raise IdAllocationError("could not allocate a block of profile IDs")
+
+
+profile_block = ProfileIdBlock() if BLOCK_SIZE > 0 else None
+
+
+def allocate_profile_id(db: Session, base: Optional[str] = None) -> str:
+    if profile_block is not None:
+        return profile_block.take(db)
+    return new_profile_id(base)
+
+
+def _is_conflict_on(exc: IntegrityError, column: str) -> bool:
+    return "UNIQUE" in str(exc.orig) and column in str(exc.orig)
+
+
+def insert_with_retry(db: Session, obj, field: str, column: str, generate: Callable[[], str],
+                      attempts: int = MAX_ATTEMPTS, before_commit: Optional[Callable[[], None]] = None):
+    """Add and commit obj; when the unique index on column (e.g. "users.profile_url")
+    rejects obj.<field>, roll back, draw a new value and try again. Anything else
+    pending in the session is rolled back too, so call this with a clean session.
+    before_commit runs after the insert is flushed, in the same transaction."""
+    for _ in range(attempts):
+        db.add(obj)
+        try:
+            db.flush()
+            if before_commit is not None:
+                before_commit()
+            db.commit()
+            return obj
+        except IntegrityError as exc:
+            db.rollback()
+            if not _is_conflict_on(exc, column):
+                raise
+            setattr(obj, field, generate())
+    raise IdAllocationError(f"no free {column} after {attempts} attempts")
+
+
+def execute_with_retry(db: Session, execute: Callable[[], T], column: str, attempts: int = MAX_ATTEMPTS) -> T:
+    """Like insert_with_retry for a Core statement: execute() should draw a fresh
+    value for column on every call. Commits on success."""
+    for _ in range(attempts):
+        try:
+            result = execute()
+            db.commit()
+            return result
+        except IntegrityError as exc:
+            db.rollback()
+            if not _is_conflict_on(exc, column):
+                raise
+    raise IdAllocationError(f"no free {column} after {attempts} attempts")
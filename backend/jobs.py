@@ -0,0 +1,377 @@
+"""Background jobs for the slow parts of saving an artwork.
+
+crud.create_artwork / update_artwork don't index or render anything inline;
+they add rows to the jobs table in the same transaction as the artwork (so a
+job exists exactly when its change was committed) and return. JobQueue workers,
+started from the app lifespan, then do the work:
+- search: refresh the artwork's artworks_fts row (search.py);
+- hash: content hash and phash for duplicate detection (dedup.py);
+- thumbnail: render the default PNG into the thumbnail cache (thumbnails.py);
+- mint: if PIXELLAR_MINT_COMMAND is set, run it for a published artwork that has
+  no nft_id yet, as "<command> <artwork id> <artwork code> <creator wallet>",
+  and store the NFT id it prints in artworks.nft_id.
+
+PIXELLAR_JOB_WORKERS workers (2) each claim one due job at a time under a lease,
+so several processes can share the table and the job of a worker that died is
+claimed again once its lease runs out. A failed job is retried with exponential
+backoff up to PIXELLAR_JOB_MAX_ATTEMPTS times (5), then left as failed. A job
+still waiting for the same artwork absorbs a new one of the same kind. Once
+PIXELLAR_JOB_MAX_PENDING jobs (10000) are outstanding, creating and updating
+artworks answers 503 until the workers catch up.
+
+    python jobs.py status | retry | drain
+"""
+import asyncio
+import logging
+import os
+import shlex
+import sys
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, Sequence
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import DateTime, Integer, bindparam, text
+
+import cache
+import database
+import dedup
+import pixel_codec
+import search
+import thumbnails
+
+WORKERS = int(os.getenv("PIXELLAR_JOB_WORKERS", 2))
+MAX_ATTEMPTS = int(os.getenv("PIXELLAR_JOB_MAX_ATTEMPTS", 5))
+MAX_PENDING = int(os.getenv("PIXELLAR_JOB_MAX_PENDING", 10000))
+POLL_INTERVAL = float(os.getenv("PIXELLAR_JOB_POLL_INTERVAL", 5))
+TIMEOUT = float(os.getenv("PIXELLAR_JOB_TIMEOUT", 60))
+MINT_COMMAND = os.getenv("PIXELLAR_MINT_COMMAND", "")
+# a claim outlives the job's timeout, so only a dead worker's job is taken over
+LEASE_SECONDS = TIMEOUT * 2 + 30
+RETRY_BASE_SECONDS = 2
+RETRY_MAX_SECONDS = 600
+# sent with the 503 when the queue is full
+RETRY_AFTER_SECONDS = 5
+ERROR_MAX_CHARS = 500
+
+SEARCH, HASH, THUMBNAIL, MINT = "search", "hash", "thumbnail", "mint"
+
+log = logging.getLogger(__name__)
+
+
+class JobError(RuntimeError):
+    pass
+
+
+def artwork_jobs(artwork, pixels_changed: bool = True) -> list:
+    """Kinds of job a saved artwork needs"""
+    kinds = [SEARCH]
+    if pixels_changed:
+        kinds += [HASH, THUMBNAIL]
+    if MINT_COMMAND and artwork.is_published and artwork.nft_id is None:
+        kinds.append(MINT)
+    return kinds
+
+
+def _datetimes(*names):
+    return [bindparam(n, type_=DateTime()) for n in names]
+
+
+def enqueue(conn, artwork_id: int, kinds: Sequence[str], max_attempts: int = MAX_ATTEMPTS) -> int:
+    """Add jobs in the caller's transaction; call queue.notify() once it commits"""
+    if not kinds:
+        return 0
+    params = {"a": artwork_id, "now": datetime.utcnow(), "m": max_attempts}
+    params.update((f"k{i}", kind) for i, kind in enumerate(kinds))
+    names = ", ".join(f":k{i}" for i in range(len(kinds)))
+    values = ", ".join(f"(:k{i})" for i in range(len(kinds)))
+    # a job still waiting for this artwork covers the new change as well; just don't let it wait
+    conn.execute(text(
+        "UPDATE jobs SET run_after = :now "
+        f"WHERE artwork_id = :a AND status = 'queued' AND kind IN ({names}) AND run_after > :now"
+    ).bindparams(*_datetimes("now")), params)
+    conn.execute(text(
+        "INSERT INTO jobs (kind, artwork_id, status, attempts, max_attempts, run_after, created_at) "
+        f"SELECT k.column1, :a, 'queued', 0, :m, :now, :now FROM (VALUES {values}) k "
+        "WHERE NOT EXISTS (SELECT 1 FROM jobs j WHERE j.artwork_id = :a AND j.kind = k.column1 AND j.status = 'queued')"
+    ).bindparams(*_datetimes("now")), params)
+    return len(kinds)
+
+
+# SQLAlchemy 1.4 cannot compile RETURNING for SQLite, so this one is written out.
+# Jobs whose lease ran out come first; they have been waiting longest.
+_CLAIM = text(
+    "UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_until = :lease "
+    "WHERE id = COALESCE("
+    "(SELECT id FROM jobs WHERE status = 'running' AND locked_until < :now LIMIT 1), "
+    "(SELECT id FROM jobs WHERE status = 'queued' AND run_after <= :now ORDER BY run_after LIMIT 1)) "
+    "RETURNING id, kind, artwork_id, attempts, max_attempts"
+).bindparams(*_datetimes("now", "lease"))
+
+
+_COUNT = text(
+    "SELECT COUNT(*) AS n, MIN(CASE WHEN status = 'queued' THEN run_after END) AS next_due "
+    "FROM jobs WHERE status IN ('queued', 'running')"
+).columns(n=Integer(), next_due=DateTime())
+
+
+class JobQueue:
+    def __init__(self, engine=None, workers: int = WORKERS, max_pending: int = MAX_PENDING):
+        self.engine = engine
+        self.workers = workers
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        # outstanding jobs as last counted, plus those notified since
+        self._pending = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.handlers = {
+            SEARCH: self._index_search,
+            HASH: self._index_hash,
+            THUMBNAIL: self._render_thumbnail,
+            MINT: self._mint,
+        }
+        self.done = 0
+        self.retried = 0
+        self.failed = 0
+
+    @property
+    def _engine(self):
+        return self.engine or database.engine
+
+    def notify(self, n: int = 1) -> None:
+        """Wake the workers for n newly committed jobs; safe from any thread"""
+        loop, wakeup = self._loop, self._wakeup
+        if loop is None:
+            return
+        with self._lock:
+            self._pending += n
+        loop.call_soon_threadsafe(wakeup.set)
+
+    def full(self) -> bool:
+        return self._loop is not None and self._pending >= self.max_pending
+
+    def count(self) -> float:
+        """Recount outstanding jobs; returns seconds until the next queued one is due"""
+        with self._engine.connect() as conn:
+            n, next_due = conn.execute(_COUNT).first()
+        with self._lock:
+            self._pending = n
+        if next_due is None:
+            return POLL_INTERVAL
+        return min(max((next_due - datetime.utcnow()).total_seconds(), 0), POLL_INTERVAL)
+
+    def claim(self):
+        now = datetime.utcnow()
+        with self._engine.begin() as conn:
+            return conn.execute(_CLAIM, {"now": now, "lease": now + timedelta(seconds=LEASE_SECONDS)}).first()
+
+    def _finish(self, job_id: int) -> None:
+        with self._engine.begin() as conn:
+            conn.execute(text("DELETE FROM jobs WHERE id = :id"), {"id": job_id})
+        self.done += 1
+        self._settled()
+
+    def _fail(self, job, error: str) -> None:
+        """Schedule a retry, or give up once max_attempts is used"""
+        final = job.attempts >= job.max_attempts
+        delay = min(RETRY_BASE_SECONDS * 2 ** (job.attempts - 1), RETRY_MAX_SECONDS)
+        with self._engine.begin() as conn:
+            conn.execute(text(
+                "UPDATE jobs SET status = :status, run_after = :run_after, locked_until = NULL, "
+                "last_error = :error WHERE id = :id"
+            ).bindparams(*_datetimes("run_after")), {
+                "id": job.id, "status": "failed" if final else "queued", "error": error[:ERROR_MAX_CHARS],
+                "run_after": datetime.utcnow() + timedelta(seconds=delay),
+            })
+        if final:
+            self.failed += 1
+            self._settled()
+        else:
+            self.retried += 1
+
+    def _release(self, job_id: int) -> None:
+        """Put back a job interrupted by shutdown, without counting the attempt"""
+        with self._engine.begin() as conn:
+            conn.execute(text(
+                "UPDATE jobs SET status = 'queued', attempts = attempts - 1, locked_until = NULL "
+                "WHERE id = :id AND status = 'running'"
+            ), {"id": job_id})
+
+    def _settled(self) -> None:
+        with self._lock:
+            self._pending = max(self._pending - 1, 0)
+
+    async def execute(self, job) -> bool:
+        """Run one claimed job; True if it succeeded"""
+        handler = self.handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise JobError(f"unknown job kind {job.kind!r}")
+            await asyncio.wait_for(handler(job.artwork_id), TIMEOUT)
+        except asyncio.CancelledError:
+            await asyncio.shield(run_in_threadpool(self._release, job.id))
+            raise
+        except Exception as exc:
+            error = f"{type(exc).__name__}: {exc}"
+            log.warning("job %s (%s, artwork %s) failed on attempt %s: %s",
+                        job.id, job.kind, job.artwork_id, job.attempts, error)
+            await run_in_threadpool(self._fail, job, error)
+            return False
+        await run_in_threadpool(self._finish, job.id)
+        return True
+
+    async def _work(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                job = await run_in_threadpool(self.claim)
+            except Exception:
+                log.exception("claiming a job failed, will retry")
+                job = None
+            if job is not None:
+                await self.execute(job)
+                continue
+            try:
+                idle = await run_in_threadpool(self.count)
+                await asyncio.wait_for(self._wakeup.wait(), timeout=idle)
+            except asyncio.TimeoutError:
+                pass
+            except Exception:
+                log.exception("counting jobs failed")
+                await asyncio.sleep(POLL_INTERVAL)
+
+    async def run(self):
+        """Worker pool; started from the app lifespan"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        workers = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            # let interrupted jobs go back to the queue before the engine is disposed
+            await asyncio.gather(*workers, return_exceptions=True)
+            self._loop = self._wakeup = None
+
+    async def drain(self) -> int:
+        """Run every job that is due now, one at a time; returns how many succeeded"""
+        ok = 0
+        while True:
+            job = await run_in_threadpool(self.claim)
+            if job is None:
+                return ok
+            ok += await self.execute(job)
+
+    # handlers: each gets the artwork id and reads the artwork as it is now
+
+    def _pixels(self, conn, artwork_id: int) -> Optional[bytes]:
+        row = conn.execute(
+            text("SELECT pixel_data, width, height FROM artworks WHERE id = :id"), {"id": artwork_id}
+        ).first()
+        return None if row is None else pixel_codec.encode(row.pixel_data, row.width, row.height)
+
+    async def _index_search(self, artwork_id: int) -> None:
+        def index():
+            with self._engine.begin() as conn:
+                search.index_artwork(conn, artwork_id)
+        await run_in_threadpool(index)
+
+    async def _index_hash(self, artwork_id: int) -> None:
+        def index():
+            with self._engine.begin() as conn:
+                blob = self._pixels(conn, artwork_id)
+                if blob is not None:
+                    dedup.index_artwork(conn, artwork_id, blob)
+        await run_in_threadpool(index)
+
+    async def _render_thumbnail(self, artwork_id: int) -> None:
+        def pixels():
+            with self._engine.connect() as conn:
+                return self._pixels(conn, artwork_id)
+        blob = await run_in_threadpool(pixels)
+        if blob is None:
+            return
+        try:
+            await thumbnails.get_thumbnail(blob)
+        except thumbnails.ThumbnailError:
+            pass  # too large for the default scale; rendered on request at a smaller one
+
+    async def _mint(self, artwork_id: int) -> None:
+        def artwork():
+            with self._engine.connect() as conn:
+                return conn.execute(text(
+                    "SELECT artwork_code, creator_wallet, is_published, nft_id FROM artworks WHERE id = :id"
+                ), {"id": artwork_id}).first()
+        row = await run_in_threadpool(artwork)
+        if not MINT_COMMAND or row is None or not row.is_published or row.nft_id is not None:
+            return
+        process = await asyncio.create_subprocess_exec(
+            *shlex.split(MINT_COMMAND), str(artwork_id), row.artwork_code, row.creator_wallet,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            out, err = await process.communicate()
+        except asyncio.CancelledError:
+            process.kill()
+            raise
+        if process.returncode != 0:
+            raise JobError(f"mint command exited with {process.returncode}: "
+                           f"{err.decode(errors='replace').strip()[-200:]}")
+        try:
+            nft_id = int(out.split()[-1])
+        except (IndexError, ValueError):
+            raise JobError(f"mint command printed no NFT id: {out[-200:]!r}")
+        await run_in_threadpool(self._set_nft_id, artwork_id, nft_id)
+
+    def _set_nft_id(self, artwork_id: int, nft_id: int) -> None:
+        # bookkeeping, not an edit: leave version alone so it can't conflict with the owner's autosave
+        # (read_artwork puts nft_id in its ETag for that reason)
+        with self._engine.begin() as conn:
+            conn.execute(text("UPDATE artworks SET nft_id = :n WHERE id = :id AND nft_id IS NULL"),
+                         {"n": nft_id, "id": artwork_id})
+        cache.invalidate(f"artwork:{artwork_id}")
+
+
+queue = JobQueue()
+
+
+def status():
+    """(kind, status, n, oldest) per kind and status, and the latest failures"""
+    with database.engine.connect() as conn:
+        counts = conn.execute(text(
+            "SELECT kind, status, COUNT(*) AS n, MIN(created_at) AS oldest FROM jobs GROUP BY kind, status "
+            "ORDER BY kind, status"
+        )).all()
+        failures = conn.execute(text(
+            "SELECT id, kind, artwork_id, last_error FROM jobs WHERE status = 'failed' ORDER BY id DESC LIMIT 10"
+        )).all()
+    return counts, failures
+
+
+def retry_failed() -> int:
+    """Queue every failed job again with fresh attempts"""
+    with database.engine.begin() as conn:
+        return conn.execute(text(
+            "UPDATE jobs SET status = 'queued', attempts = 0, run_after = :now, last_error = NULL "
+            "WHERE status = 'failed'"
+        ).bindparams(*_datetimes("now")), {"now": datetime.utcnow()}).rowcount
+
+
+if __name__ == "__main__":
+    command = sys.argv[1:]
+    if command not in (["status"], ["retry"], ["drain"]):
+        raise SystemExit("usage: python jobs.py status | retry | drain")
+    database.init_db()
+    if command == ["status"]:
+        counts, failures = status()
+        for row in counts:
+            print(f"{row.kind:10} {row.status:8} {row.n:8}  oldest {row.oldest}")
+        for row in failures:
+            print(f"failed job {row.id} ({row.kind}, artwork {row.artwork_id}): {row.last_error}")
+    elif command == ["retry"]:
+        print(f"Queued {retry_failed()} failed jobs again")
+    else:
+        print(f"Ran {asyncio.run(queue.drain())} jobs")
+        thumbnails.shutdown()
@@ -1,23 +1,41 @@
-from fastapi import FastAPI, HTTPException, Depends
+import asyncio
+import hashlib
+import hmac
+import math
+import os
+from functools import lru_cache
+
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from sqlmodel import Session
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.utils import create_response_field
 from typing import List
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError, conint
 
 from contextlib import asynccontextmanager
 
-import database, models, crud
+import database, models, crud, async_crud, bulk, cache, compression, counters, dedup, fastjson, jobs, metrics, passwords, pixel_codec, pagination, thumbnails
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup actions
     database.init_db()
+    flusher = asyncio.create_task(counters.buffer.run())
+    job_workers = asyncio.create_task(jobs.queue.run())
     try:
         yield
     finally:
-        # Place for shutdown actions if needed in future
-        pass
+        flusher.cancel()
+        job_workers.cancel()
+        # interrupted jobs are put back in the queue before the pools and engines go
+        await asyncio.gather(job_workers, return_exceptions=True)
+        await run_in_threadpool(counters.buffer.flush)
+        thumbnails.shutdown()
+        passwords.shutdown()
+        await database.dispose()
 
 
 app = FastAPI(title="Pixellar-FLOW Backend", lifespan=lifespan)
@@ -29,13 +47,135 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Artwork-Version", "ETag"],
 )
+app.add_middleware(compression.CompressionMiddleware)
+# outermost, so request timings include compression
+app.add_middleware(metrics.MetricsMiddleware)
 
 
 # Dependency
-def get_db():
-    with database.SessionLocal() as session:
-        yield session
+async def get_db():
+    if database.USE_ASYNC_DB:
+        async with database.AsyncSessionLocal() as session:
+            yield session
+    else:
+        with database.SessionLocal() as session:
+            yield session
+
+
+async def get_read_db():
+    """Session on the read-only engine, for endpoints that never write"""
+    if database.USE_ASYNC_DB:
+        async with database.AsyncReadSessionLocal() as session:
+            yield session
+    else:
+        with database.ReadSessionLocal() as session:
+            yield session
+
+
+def parse_fields(fields: str | None, default: tuple, allowed: tuple) -> tuple:
+    """Turn ?fields=a,b,c into a column list; "*" selects every listable column"""
+    if not fields:
+        return default
+    if fields.strip() == "*":
+        return allowed
+    selected = tuple(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in selected if f not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return selected or default
+
+
+# bearer token for bulk import and export; without it those endpoints stay disabled
+ADMIN_TOKEN = os.getenv("PIXELLAR_ADMIN_TOKEN", "")
+
+
+def require_admin(authorization: str | None = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Bulk import/export is disabled; set PIXELLAR_ADMIN_TOKEN")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Admin token required", headers={"WWW-Authenticate": "Bearer"})
+
+
+async def bulk_import(kind: str, request: Request) -> dict:
+    """Stream an NDJSON request body into bulk.Importer; parsing and inserts run on the threadpool"""
+    importer = bulk.Importer(kind)
+
+    def feed(lines):
+        for line in lines:
+            importer.add(line)
+
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        if lines:
+            await run_in_threadpool(feed, lines)
+    await run_in_threadpool(feed, [pending])
+    await run_in_threadpool(importer.flush)
+    return importer.summary()
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match check; uses weak comparison, as the spec asks for GETs"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [t.strip().removeprefix("W/") for t in header.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+# JSON reads may be cached but must be revalidated; a match costs a 304 and no body
+REVALIDATE = "no-cache"
+
+
+def weak_etag(*parts) -> str:
+    return 'W/"' + hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest() + '"'
+
+
+def not_modified(request: Request, response: Response, etag: str) -> Response | None:
+    """Attach the validator to response; returns a 304 to send instead if the client is current"""
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+def set_next_cursor(response: Response, next_cursor: str | None):
+    """List endpoints keep returning a plain array; the next page cursor travels in a header"""
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+
+@lru_cache(maxsize=None)
+def _response_field(model):
+    return create_response_field(name="response", type_=model)
+
+
+def _render_model(model, content, headers: dict, exclude_unset: bool) -> JSONResponse:
+    if isinstance(content, BaseModel):
+        content = content.dict(exclude_unset=exclude_unset)
+    field = _response_field(model)
+    value, errors = field.validate(content, {}, loc=("response",))
+    if errors:
+        raise ValidationError(errors if isinstance(errors, list) else [errors], field.type_)
+    return JSONResponse(jsonable_encoder(value, exclude_unset=exclude_unset), headers=headers)
+
+
+async def model_response(response: Response, content, model, exclude_unset: bool = False) -> JSONResponse:
+    """What response_model does, but on the threadpool: validating unpacks pixel_data
+    and encoding walks every cell, which would otherwise block the event loop"""
+    return await run_in_threadpool(_render_model, model, content, dict(response.headers), exclude_unset)
+
+
+async def list_response(response: Response, rows: List[dict], item_model) -> Response:
+    """rows through the response_model, or straight to orjson with PIXELLAR_FAST_JSON=1"""
+    if fastjson.ENABLED:
+        return await run_in_threadpool(fastjson.response, rows, item_model, response.headers)
+    return await model_response(response, rows, List[item_model], exclude_unset=True)
 
 
 # Users
@@ -47,16 +187,13 @@ class UserCreate(BaseModel):
 
 
 @app.post("/users/", response_model=models.User)
-def create_user(user: UserCreate, db: Session = Depends(get_db)):
-    # prefer username lookup, else wallet lookup
-    existing = None
-    if user.username:
-        existing = crud.get_user_by_username(db, user.username)
-    if not existing and user.wallet_address:
-        existing = crud.get_user_by_wallet(db, user.wallet_address)
-
-    if existing:
-        return existing
+async def create_user(user: UserCreate, db: database.AnySession = Depends(get_db)):
+    """Create or return the user for a wallet; one upsert, see crud.create_user"""
+    if not user.wallet_address and user.username:
+        # username-only signups get a wallet derived from the name, so look them up first
+        existing = await async_crud.get_user_by_username(db, user.username)
+        if existing:
+            return existing
 
     # Build minimal user data for DB
     payload = {
@@ -64,53 +201,101 @@ def create_user(user: UserCreate, db: Session = Depends(get_db)):
         "wallet_address": user.wallet_address or ("0x" + (user.username or "")).lower(),
         # profile_url will be generated in crud.create_user if missing
     }
-    return crud.create_user(db, payload)
+    return await async_crud.create_user(db, payload)
 
 
-@app.get("/users/", response_model=List[models.User])
-def read_users(limit: int = 100, offset: int = 0, db: Session = Depends(get_db)):
-    return crud.list_users(db, limit=limit, offset=offset)
+@app.get("/users/", response_model=List[models.UserListItem], response_model_exclude_unset=True)
+async def read_users(response: Response, limit: int = Query(100, ge=1, le=pagination.MAX_LIMIT),
+               offset: int = Query(0, ge=0), cursor: str | None = None,
+               fields: str | None = None, db: database.AnySession = Depends(get_read_db)):
+    columns = parse_fields(fields, models.USER_SUMMARY_FIELDS, models.USER_LIST_FIELDS)
+    try:
+        users, next_cursor = await async_crud.list_users(
+            db, limit=limit, offset=offset, fields=columns, cursor=cursor
+        )
+    except pagination.InvalidCursor as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    set_next_cursor(response, next_cursor)
+    return await list_response(response, users, models.UserListItem)
+
+
+@app.post("/users/bulk", dependencies=[Depends(require_admin)])
+async def bulk_import_users(request: Request):
+    """NDJSON body, one user object per line"""
+    return await bulk_import("users", request)
+
+
+@app.get("/users/export", dependencies=[Depends(require_admin)])
+def export_users():
+    return StreamingResponse(bulk.export_lines("users"), media_type="application/x-ndjson")
 
 
 @app.get("/users/{user_id}", response_model=models.User)
-def read_user(user_id: int, db: Session = Depends(get_db)):
-    user = crud.get_user(db, user_id)
+async def read_user(user_id: int, db: database.AnySession = Depends(get_read_db)):
+    user = await async_crud.get_user(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
 
 @app.get("/users/by-profile/{profile_url}", response_model=models.User)
-def read_user_by_profile(profile_url: str, db: Session = Depends(get_db)):
-    user = crud.get_user_by_profile(db, profile_url)
+async def read_user_by_profile(request: Request, response: Response, profile_url: str,
+                               db: database.AnySession = Depends(get_read_db)):
+    user = await async_crud.get_user_by_profile(db, profile_url)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+    return not_modified(request, response, weak_etag("user", user.id, user.updated_at)) or user
+
+
+@app.get("/users/{user_id}/sales", response_model=models.SellerSales)
+async def read_user_sales(user_id: int, db: database.AnySession = Depends(get_read_db)):
+    """Sells tab: precomputed sales_analytics rows, see crud.record_purchase"""
+    return await async_crud.get_seller_sales(db, user_id)
 
 
 @app.delete("/users/{user_id}")
-def delete_user(user_id: int, db: Session = Depends(get_db)):
-    success = crud.delete_user(db, user_id)
+async def delete_user(user_id: int, db: database.AnySession = Depends(get_db)):
+    success = await async_crud.delete_user(db, user_id)
     if not success:
         raise HTTPException(status_code=404, detail="User not found")
     return {"ok": True}
 
 
 # Artworks
-@app.post("/artworks/", response_model=models.Artwork)
+CanvasSide = conint(ge=1, le=pixel_codec.MAX_DIM)
+
+
 class ArtworkCreate(BaseModel):
     title: str
     description: str | None = None
     image_url: str | None = None
+    # list of rows of "#RRGGBB" / null cells, or the same as a JSON string
+    pixel_data: list | str | None = None
+    width: CanvasSide = 64
+    height: CanvasSide = 64
     price_cents: int | None = None
     is_published: bool = False
     owner_id: int | None = None
+    unlock_password: str | None = None
+
+
+def check_unlock_password(password: str):
+    if not 1 <= len(password) <= passwords.MAX_LENGTH:
+        raise HTTPException(status_code=400, detail=f"unlock_password must be 1-{passwords.MAX_LENGTH} characters")
+
 
+def check_job_backlog():
+    # saving queues indexing/thumbnail work; past this much of it, ask clients to come back
+    if jobs.queue.full():
+        raise HTTPException(status_code=503, detail="Too much background work pending, try again shortly",
+                            headers={"Retry-After": str(jobs.RETRY_AFTER_SECONDS)})
 
-@app.post("/artworks/", response_model=models.Artwork)
-def create_artwork(artwork: ArtworkCreate, db: Session = Depends(get_db)):
+
+@app.post("/artworks/", response_model=models.ArtworkRead)
+async def create_artwork(response: Response, artwork: ArtworkCreate, db: database.AnySession = Depends(get_db)):
+    check_job_backlog()
     # ensure owner exists if provided
-    if artwork.owner_id is not None and not crud.get_user(db, artwork.owner_id):
+    if artwork.owner_id is not None and not await async_crud.get_user(db, artwork.owner_id):
         raise HTTPException(status_code=400, detail="Owner (user) not found")
 
     # map incoming payload to Artwork model fields; fill required defaults
@@ -120,52 +305,343 @@ def create_artwork(artwork: ArtworkCreate, db: Session = Depends(get_db)):
     else:
         price_flow = 0.0
 
+    try:
+        pixels = await run_in_threadpool(pixel_codec.encode, artwork.pixel_data, artwork.width, artwork.height)
+    except pixel_codec.PixelCodecError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    if artwork.unlock_password is not None:
+        check_unlock_password(artwork.unlock_password)
+    unlock_hash = await passwords.hash_password_async(artwork.unlock_password or passwords.DEFAULT_PASSWORD)
+
+    # artwork_code (creator profile ID + 4 chars) is allocated by crud.create_artwork
     art = models.Artwork(
-        artwork_code=(artwork.title[:9] or "art") + "00001",
         creator_id=artwork.owner_id or 0,
         creator_wallet="",
         title=artwork.title,
         description=artwork.description or "",
-        pixel_data="[]",
-        width=64,
-        height=64,
-        unlock_password="000000",
+        pixel_data=pixels,
+        width=artwork.width,
+        height=artwork.height,
+        unlock_password="",
+        unlock_hash=unlock_hash,
         price_flow=price_flow,
         publish_fee=0.0,
         is_published=artwork.is_published,
         thumbnail_url=artwork.image_url or "",
     )
-    return crud.create_artwork(db, art)
+    created = await async_crud.create_artwork(db, art)
+    return await model_response(response, created, models.ArtworkRead)
+
+
+@app.get("/artworks/", response_model=List[models.ArtworkListItem], response_model_exclude_unset=True)
+async def read_artworks(request: Request, response: Response, owner_id: int | None = None,
+                  limit: int = Query(100, ge=1, le=pagination.MAX_LIMIT),
+                  offset: int = Query(0, ge=0), cursor: str | None = None, fields: str | None = None,
+                  db: database.AnySession = Depends(get_read_db)):
+    columns = parse_fields(fields, models.ARTWORK_SUMMARY_FIELDS, models.ARTWORK_LIST_FIELDS)
+    try:
+        artworks, next_cursor = await async_crud.list_artworks(
+            db, owner_id=owner_id, limit=limit, offset=offset, fields=columns, cursor=cursor
+        )
+    except pagination.InvalidCursor as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    # the page is already in memory, so the validator is a hash of exactly what would be sent
+    etag = weak_etag("artworks", columns, artworks, next_cursor)
+    set_next_cursor(response, next_cursor)
+    cached = not_modified(request, response, etag)
+    if cached:
+        set_next_cursor(cached, next_cursor)
+        return cached
+    return await list_response(response, artworks, models.ArtworkListItem)
+
+
+@app.get("/artworks/search", response_model=List[models.ArtworkListItem], response_model_exclude_unset=True)
+async def search_artworks(response: Response, q: str, limit: int = Query(20, ge=1, le=pagination.MAX_LIMIT),
+                          cursor: str | None = None, fields: str | None = None,
+                          db: database.AnySession = Depends(get_read_db)):
+    """Published artworks whose title, description or creator username contain
+    words starting with each word of q, best match first"""
+    columns = parse_fields(fields, models.ARTWORK_SUMMARY_FIELDS, models.ARTWORK_LIST_FIELDS)
+    try:
+        artworks, next_cursor = await async_crud.search_artworks(
+            db, q, limit=limit, fields=columns, cursor=cursor
+        )
+    except pagination.InvalidCursor as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    set_next_cursor(response, next_cursor)
+    return await list_response(response, artworks, models.ArtworkListItem)
+
+
+MAX_CARD_IDS = 100
+
+
+@app.get("/artworks/cards", response_model=List[models.ArtworkCard])
+async def read_artwork_cards(ids: str, viewer_id: int | None = None,
+                             db: database.AnySession = Depends(get_read_db)):
+    """Cards for a page of artworks (?ids=1,2,3): creator, comment count and the
+    viewer's unlock/purchase status for all of them in one query"""
+    try:
+        artwork_ids = [int(i) for i in ids.split(",") if i.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be comma-separated integers")
+    if len(artwork_ids) > MAX_CARD_IDS:
+        raise HTTPException(status_code=400, detail=f"at most {MAX_CARD_IDS} ids")
+    return await async_crud.get_artwork_cards(db, artwork_ids, viewer_id)
+
+
+@app.post("/artworks/bulk", dependencies=[Depends(require_admin)])
+async def bulk_import_artworks(request: Request):
+    """NDJSON body, one artwork object per line (pixel_data as rows, or pixel_data_b64 from an export)"""
+    return await bulk_import("artworks", request)
+
+
+@app.get("/artworks/export", dependencies=[Depends(require_admin)])
+def export_artworks(pixels: str = "packed"):
+    if pixels not in ("packed", "grid"):
+        raise HTTPException(status_code=400, detail="pixels must be packed or grid")
+    return StreamingResponse(bulk.export_lines("artworks", pixels=pixels), media_type="application/x-ndjson")
+
+
+class DuplicateQuery(BaseModel):
+    pixel_data: list | str
+    width: CanvasSide | None = None
+    height: CanvasSide | None = None
+    max_distance: int = dedup.DEFAULT_MAX_DISTANCE
 
 
-@app.get("/artworks/", response_model=List[models.Artwork])
-def read_artworks(owner_id: int | None = None, limit: int = 100, offset: int = 0, db: Session = Depends(get_db)):
-    return crud.list_artworks(db, owner_id=owner_id, limit=limit, offset=offset)
+MAX_DUPLICATE_DISTANCE = 10
 
 
-@app.get("/artworks/{artwork_id}", response_model=models.Artwork)
-def read_artwork(artwork_id: int, db: Session = Depends(get_db)):
-    artwork = crud.get_artwork(db, artwork_id)
+def check_distance(max_distance: int):
+    if not 0 <= max_distance <= MAX_DUPLICATE_DISTANCE:
+        raise HTTPException(status_code=400, detail=f"max_distance must be 0-{MAX_DUPLICATE_DISTANCE}")
+
+
+@app.post("/artworks/duplicates", response_model=List[models.DuplicateMatch])
+async def find_duplicates(query: DuplicateQuery, db: database.AnySession = Depends(get_read_db)):
+    """Artworks whose pixels match or nearly match the given grid, e.g. before publishing it"""
+    check_distance(query.max_distance)
+    try:
+        # encoding and hashing a big grid takes a while; keep it off the event loop
+        content_hash, phash = await run_in_threadpool(
+            lambda: dedup.compute(pixel_codec.encode(query.pixel_data, query.width, query.height)))
+    except pixel_codec.PixelCodecError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return await async_crud.find_duplicates(db, content_hash, phash, query.max_distance)
+
+
+@app.get("/artworks/{artwork_id}", response_model=models.ArtworkRead)
+async def read_artwork(request: Request, response: Response, artwork_id: int,
+                       db: database.AnySession = Depends(get_read_db)):
+    artwork = await async_crud.get_artwork(db, artwork_id)
     if not artwork:
         raise HTTPException(status_code=404, detail="Artwork not found")
-    return artwork
+    # version moves on every edit; the counters and the mint job's nft_id are written without touching it.
+    # SQLite hands a deleted top id out again, so artwork_code tells the rows apart
+    etag = weak_etag("artwork", artwork.id, artwork.artwork_code, artwork.version, artwork.views_count,
+                     artwork.likes_count, artwork.nft_id)
+    return not_modified(request, response, etag) or await model_response(response, artwork, models.ArtworkRead)
+
+
+@app.get("/artworks/{artwork_id}/detail", response_model=models.ArtworkDetail)
+async def read_artwork_detail(response: Response, artwork_id: int, viewer_id: int | None = None,
+                              db: database.AnySession = Depends(get_read_db)):
+    """Everything the artwork modal shows, in one query"""
+    artwork = await async_crud.get_artwork_detail(db, artwork_id, viewer_id)
+    if not artwork:
+        raise HTTPException(status_code=404, detail="Artwork not found")
+    return await model_response(response, artwork, models.ArtworkDetail)
+
+
+@app.get("/artworks/{artwork_id}/thumbnail")
+async def read_artwork_thumbnail(request: Request, artwork_id: int, scale: int = thumbnails.DEFAULT_SCALE,
+                                 format: str = "png", db: database.AnySession = Depends(get_read_db)):
+    try:
+        thumbnails.check_options(scale, format)
+    except thumbnails.ThumbnailError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    current = await async_crud.get_artwork_version(db, artwork_id)
+    if current is None:
+        raise HTTPException(status_code=404, detail="Artwork not found")
+    # revalidation only needs the version, so answer it before loading or rendering pixels
+    etag = thumbnails.etag(artwork_id, *current, scale, format)
+    headers = {"ETag": etag, "Cache-Control": thumbnails.CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    blob = await async_crud.get_artwork_pixels(db, artwork_id)
+    if blob is None:
+        raise HTTPException(status_code=404, detail="Artwork not found")
+    try:
+        image = await thumbnails.get_thumbnail(blob, scale=scale, fmt=format)
+    except (thumbnails.ThumbnailError, pixel_codec.PixelCodecError) as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return Response(content=image, media_type=thumbnails.MEDIA_TYPES[format], headers=headers)
+
+
+@app.get("/artworks/{artwork_id}/duplicates", response_model=List[models.DuplicateMatch])
+async def read_artwork_duplicates(artwork_id: int, max_distance: int = dedup.DEFAULT_MAX_DISTANCE,
+                                  db: database.AnySession = Depends(get_read_db)):
+    check_distance(max_distance)
+    blob = await async_crud.get_artwork_pixels(db, artwork_id)
+    if blob is None:
+        raise HTTPException(status_code=404, detail="Artwork not found")
+    content_hash, phash = await run_in_threadpool(dedup.compute, blob)
+    return await async_crud.find_duplicates(db, content_hash, phash, max_distance, exclude_id=artwork_id)
+
 
+# Views and likes are buffered in memory and flushed in batches (counters.py),
+# so these return 202 and the counts on the artwork catch up on the next flush.
+class LikeRequest(BaseModel):
+    user_id: int
 
-@app.patch("/artworks/{artwork_id}", response_model=models.Artwork)
-def patch_artwork(artwork_id: int, artwork: models.Artwork, db: Session = Depends(get_db)):
-    updated = crud.update_artwork(db, artwork_id, **artwork.dict(exclude_unset=True))
+
+@app.post("/artworks/{artwork_id}/view", status_code=202)
+async def record_view(artwork_id: int):
+    counters.buffer.add_view(artwork_id)
+    return {"ok": True}
+
+
+@app.post("/artworks/{artwork_id}/like", status_code=202)
+async def like_artwork(artwork_id: int, like: LikeRequest):
+    counters.buffer.set_like(artwork_id, like.user_id, True)
+    return {"ok": True}
+
+
+@app.delete("/artworks/{artwork_id}/like", status_code=202)
+async def unlike_artwork(artwork_id: int, user_id: int):
+    counters.buffer.set_like(artwork_id, user_id, False)
+    return {"ok": True}
+
+
+class UnlockRequest(BaseModel):
+    user_id: int
+    password: str
+
+
+@app.post("/artworks/{artwork_id}/unlock")
+async def unlock_artwork(request: Request, artwork_id: int, unlock: UnlockRequest,
+                         db: database.AnySession = Depends(get_db)):
+    """Check an unlock password. Users who unlocked before pass without one; the
+    rest are rate limited per user, per artwork and per client address"""
+    state = await async_crud.get_unlock_state(db, artwork_id, unlock.user_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Artwork not found")
+    if not state["user_exists"]:
+        raise HTTPException(status_code=404, detail="User not found")
+    if state["unlocked"]:
+        return {"unlocked": True}
+    # rejected before any hashing, so flooding this costs us next to nothing
+    client = request.client.host if request.client else None
+    allowed, retry_after = passwords.acquire_attempt(unlock.user_id, artwork_id, client)
+    if not allowed:
+        raise HTTPException(status_code=429, detail="Too many attempts",
+                            headers={"Retry-After": str(math.ceil(retry_after))})
+    if not await passwords.verify_password_async(unlock.password, state["unlock_hash"], state["unlock_password"]):
+        raise HTTPException(status_code=403, detail="Wrong password")
+    upgraded = None if state["unlock_hash"] else await passwords.hash_password_async(unlock.password)
+    await async_crud.record_unlock(db, artwork_id, unlock.user_id, upgraded)
+    return {"unlocked": True}
+
+
+# times a PATCH without a version is rebuilt when someone else's edit lands first
+PATCH_RETRIES = 3
+
+
+async def build_pixels(db: database.AnySession, artwork_id: int, changes: dict) -> dict | None:
+    """changes with pixel_data / cells / rects turned into the finished blob, built on
+    the threadpool from the stored grid (crud.update_artwork runs on the event loop
+    with PIXELLAR_ASYNC_DB=1). The version the blob was built on is pinned, so an
+    edit saved in between is a conflict rather than lost. None if the artwork is gone."""
+    cells, rects = changes.pop("cells", None), changes.pop("rects", None)
+    if changes.get("pixel_data") is None and not cells and not rects:
+        return changes
+    current = await async_crud.get_artwork_canvas(db, artwork_id)
+    if current is None:
+        return None
+    blob, version = current
+    if changes.get("version") is not None and changes["version"] != version:
+        raise crud.VersionConflict(version)
+
+    def build() -> bytes:
+        out = blob
+        if changes.get("pixel_data") is not None:
+            width, height, _ = pixel_codec.read_header(blob)
+            out = pixel_codec.encode(changes["pixel_data"], changes.get("width") or width,
+                                     changes.get("height") or height)
+        if cells or rects:
+            out = pixel_codec.apply_patch(out, cells or (), rects or ())
+        return out
+
+    return dict(changes, pixel_data=await run_in_threadpool(build), version=version)
+
+
+@app.patch("/artworks/{artwork_id}", response_model=models.ArtworkRead)
+async def patch_artwork(response: Response, artwork_id: int, artwork: models.ArtworkUpdate,
+                        db: database.AnySession = Depends(get_db)):
+    """Partial update. For autosave send only the changed pixels as cells / rects
+    together with the version last seen; a 409 means the artwork moved on"""
+    check_job_backlog()
+    changes = artwork.dict(exclude_unset=True)
+    if changes.get("unlock_password") is not None:
+        check_unlock_password(changes["unlock_password"])
+        changes["unlock_hash"] = await passwords.hash_password_async(changes["unlock_password"])
+        changes["unlock_password"] = ""
+    for attempt in range(PATCH_RETRIES):
+        try:
+            built = await build_pixels(db, artwork_id, dict(changes))
+            updated = built is not None and await async_crud.update_artwork(db, artwork_id, **built)
+            break
+        except pixel_codec.PixelCodecError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        except crud.VersionConflict as exc:
+            if changes.get("version") is None and attempt + 1 < PATCH_RETRIES:
+                continue
+            raise HTTPException(status_code=409, detail=str(exc), headers={"X-Artwork-Version": str(exc.current)})
     if not updated:
         raise HTTPException(status_code=404, detail="Artwork not found")
-    return updated
+    return await model_response(response, updated, models.ArtworkRead)
 
 
 @app.delete("/artworks/{artwork_id}")
-def delete_artwork(artwork_id: int, db: Session = Depends(get_db)):
-    success = crud.delete_artwork(db, artwork_id)
+async def delete_artwork(artwork_id: int, db: database.AnySession = Depends(get_db)):
+    success = await async_crud.delete_artwork(db, artwork_id)
     if not success:
         raise HTTPException(status_code=404, detail="Artwork not found")
     return {"ok": True}
 
+
+class PurchaseCreate(BaseModel):
+    artwork_id: int
+    buyer_id: int
+    # defaults to the artwork's current price
+    price_flow: float | None = None
+    transaction_hash: str | None = None
+
+
+@app.post("/purchases/", response_model=models.Purchase)
+async def create_purchase(purchase: PurchaseCreate, db: database.AnySession = Depends(get_db)):
+    recorded = await async_crud.record_purchase(
+        db, purchase.artwork_id, purchase.buyer_id,
+        price_flow=purchase.price_flow, transaction_hash=purchase.transaction_hash,
+    )
+    if not recorded:
+        raise HTTPException(status_code=404, detail="Artwork or buyer not found")
+    return recorded
+
+
+@app.get("/cache/stats")
+def read_cache_stats():
+    return cache.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    """Prometheus scrape target, see metrics.py"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/")
 def main():
     return {"message": "Welcome to the Pixellar-FLOW Backend API!",
@@ -174,15 +650,35 @@ def main():
                     "create_user": "/users/ [POST]",
                     "list_users": "/users/ [GET]",
                     "get_user": "/users/{user_id} [GET]",
+                    "get_user_sales": "/users/{user_id}/sales [GET]",
+                    "bulk_import_users": "/users/bulk [POST, NDJSON, admin token]",
+                    "export_users": "/users/export [GET, NDJSON, admin token]",
                     "delete_user": "/users/{user_id} [DELETE]"
                 },
                 "artworks": {
                     "create_artwork": "/artworks/ [POST]",
                     "list_artworks": "/artworks/ [GET]",
+                    "search_artworks": "/artworks/search?q= [GET]",
                     "get_artwork": "/artworks/{artwork_id} [GET]",
+                    "get_artwork_detail": "/artworks/{artwork_id}/detail?viewer_id= [GET]",
+                    "get_artwork_cards": "/artworks/cards?ids=&viewer_id= [GET]",
+                    "bulk_import_artworks": "/artworks/bulk [POST, NDJSON, admin token]",
+                    "export_artworks": "/artworks/export [GET, NDJSON, admin token]",
+                    "get_artwork_thumbnail": "/artworks/{artwork_id}/thumbnail [GET]",
+                    "find_duplicates": "/artworks/duplicates [POST]",
+                    "get_artwork_duplicates": "/artworks/{artwork_id}/duplicates [GET]",
                     "update_artwork": "/artworks/{artwork_id} [PATCH]",
-                    "delete_artwork": "/artworks/{artwork_id} [DELETE]"
-                }
+                    "delete_artwork": "/artworks/{artwork_id} [DELETE]",
+                    "record_view": "/artworks/{artwork_id}/view [POST]",
+                    "unlock_artwork": "/artworks/{artwork_id}/unlock [POST]",
+                    "like_artwork": "/artworks/{artwork_id}/like [POST]",
+                    "unlike_artwork": "/artworks/{artwork_id}/like?user_id= [DELETE]"
+                },
+                "purchases": {
+                    "create_purchase": "/purchases/ [POST]"
+                },
+                "cache_stats": "/cache/stats [GET]",
+                "metrics": "/metrics [GET, Prometheus text]"
             }
             }
 
@@ -0,0 +1,21 @@
+"""Merge users whose wallet_address differs only in case, and lowercase wallets.
+
+POST /users/ upserts on wallet_address (crud.create_user) instead of cleaning
+up duplicates on every signup; run this once on databases from before that so
+every wallet maps to exactly one lowercase row:
+
+    python merge_duplicate_users.py
+"""
+import crud
+import database
+
+
+def main():
+    database.init_db()
+    with database.SessionLocal() as db:
+        removed = crud.merge_duplicate_users(db)
+    print(f'Merged {removed} duplicate users')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""Request and query instrumentation, served as Prometheus text at GET /metrics.
+
+MetricsMiddleware times every request and labels it with the route template
+(GET /artworks/{artwork_id}, not the raw path). instrument(engine) adds
+before/after_cursor_execute hooks that time each SQL statement and charge it to
+the request being served, found through a context variable that follows the
+request onto the threadpool and into the async engine's greenlets. Queries
+outside a request (startup, the counters flusher) are labelled "background".
+
+Per route this keeps request counts by status, a latency histogram, queries per
+request, total query time, and the slowest statements over
+PIXELLAR_SLOW_QUERY_MS as samples. PIXELLAR_METRICS=0 turns it all off.
+"""
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+ENABLED = os.getenv("PIXELLAR_METRICS", "1").lower() not in ("0", "false", "no")
+SLOW_QUERY_SECONDS = float(os.getenv("PIXELLAR_SLOW_QUERY_MS", 50)) / 1000
+SLOW_SAMPLES = 5  # per route
+STATEMENT_MAX_CHARS = 300
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+BACKGROUND = "background"
+UNMATCHED = "unmatched"
+
+
+class _RequestStats:
+    __slots__ = ("scope", "queries")
+
+    def __init__(self, scope: Scope):
+        self.scope = scope
+        self.queries = 0
+
+    @property
+    def route(self) -> str:
+        # the router leaves the matched route in scope before calling the endpoint
+        route = getattr(self.scope.get("route"), "path", None)
+        return f"{self.scope['method']} {route}" if route else UNMATCHED
+
+
+_current: ContextVar[Optional[_RequestStats]] = ContextVar("pixellar_request_stats", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests: Dict[Tuple[str, str], int] = {}
+            self.latency: Dict[str, Histogram] = {}
+            self.queries_per_request: Dict[str, Histogram] = {}
+            self.query_latency: Dict[str, Histogram] = {}
+            self.slow_queries: Dict[str, int] = {}
+            self.slow_samples: Dict[str, List[Tuple[float, str]]] = {}
+
+    def observe_request(self, route: str, status: int, seconds: float, queries: int) -> None:
+        with self._lock:
+            key = (route, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self._histogram(self.latency, route, LATENCY_BUCKETS).observe(seconds)
+            self._histogram(self.queries_per_request, route, QUERY_COUNT_BUCKETS).observe(queries)
+
+    def observe_query(self, route: str, statement: str, seconds: float) -> None:
+        with self._lock:
+            self._histogram(self.query_latency, route, QUERY_BUCKETS).observe(seconds)
+            if seconds < SLOW_QUERY_SECONDS:
+                return
+            self.slow_queries[route] = self.slow_queries.get(route, 0) + 1
+            samples = self.slow_samples.setdefault(route, [])
+            statement = _normalize(statement)
+            for i, (previous, text) in enumerate(samples):
+                if text == statement:
+                    samples[i] = (max(previous, seconds), text)
+                    break
+            else:
+                samples.append((seconds, statement))
+            samples.sort(reverse=True)
+            del samples[SLOW_SAMPLES:]
+
+    @staticmethod
+    def _histogram(family: Dict[str, Histogram], route: str, buckets) -> Histogram:
+        histogram = family.get(route)
+        if histogram is None:
+            histogram = family[route] = Histogram(buckets)
+        return histogram
+
+    def render(self) -> str:
+        """Prometheus text exposition format 0.0.4"""
+        out: List[str] = []
+        with self._lock:
+            _family(out, "pixellar_http_requests_total", "counter", "HTTP requests by route and status")
+            for (route, status), n in sorted(self.requests.items()):
+                out.append(f"pixellar_http_requests_total{_labels(route=route, status=status)} {n}")
+            _histograms(out, "pixellar_http_request_duration_seconds", "Request latency", self.latency)
+            _histograms(out, "pixellar_db_queries_per_request", "SQL statements per request",
+                        self.queries_per_request)
+            _histograms(out, "pixellar_db_query_duration_seconds", "SQL statement latency", self.query_latency)
+            _family(out, "pixellar_db_slow_queries_total", "counter",
+                    f"SQL statements slower than {SLOW_QUERY_SECONDS * 1000:g} ms")
+            for route, n in sorted(self.slow_queries.items()):
+                out.append(f"pixellar_db_slow_queries_total{_labels(route=route)} {n}")
+            _family(out, "pixellar_db_slow_query_seconds", "gauge", "Slowest statements seen per route")
+            for route, samples in sorted(self.slow_samples.items()):
+                for seconds, statement in samples:
+                    out.append(f"pixellar_db_slow_query_seconds{_labels(route=route, statement=statement)} "
+                               f"{seconds:.6f}")
+        return "\n".join(out) + "\n"
+
+
+def _normalize(statement: str) -> str:
+    statement = re.sub(r"\s+", " ", statement).strip()
+    return statement if len(statement) <= STATEMENT_MAX_CHARS else statement[:STATEMENT_MAX_CHARS] + "..."
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def _family(out: List[str], name: str, kind: str, help_text: str) -> None:
+    out.append(f"# HELP {name} {help_text}")
+    out.append(f"# TYPE {name} {kind}")
+
+
+def _histograms(out: List[str], name: str, help_text: str, family: Dict[str, Histogram]) -> None:
+    _family(out, name, "histogram", help_text)
+    for route, h in sorted(family.items()):
+        cumulative = 0
+        for bound, n in zip(h.buckets + (float("inf"),), h.counts):
+            cumulative += n
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            out.append(f"{name}_bucket{_labels(route=route, le=le)} {cumulative}")
+        out.append(f"{name}_sum{_labels(route=route)} {h.sum:.6f}")
+        out.append(f"{name}_count{_labels(route=route)} {h.count}")
+
+
+registry = Registry()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("pixellar_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("pixellar_query_start")
+    if not starts:
+        return
+    seconds = time.perf_counter() - starts.pop()
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+    registry.observe_query(stats.route if stats is not None else BACKGROUND, statement, seconds)
+
+
+def instrument(engine) -> None:
+    """Time every statement run on a sync Engine (for async engines pass .sync_engine)"""
+    if not ENABLED:
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not ENABLED:
+            await self.app(scope, receive, send)
+            return
+        stats = _RequestStats(scope)
+        token = _current.set(stats)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _current.reset(token)
+            registry.observe_request(stats.route, status, time.perf_counter() - start, stats.queries)
@@ -0,0 +1,57 @@
+"""Convert artworks.pixel_data from JSON text to packed blobs (see pixel_codec.py).
+
+Rows that are already packed are left alone, so the script can be re-run.
+"""
+import sqlite3
+import sys
+from pathlib import Path
+
+import pixel_codec
+
+BASE = Path(__file__).parent
+DB_FILE = BASE / 'data.db'
+BATCH_SIZE = 500
+
+
+def migrate(db_file: Path = DB_FILE, batch_size: int = BATCH_SIZE) -> int:
+    conn = sqlite3.connect(db_file)
+    size_before = db_file.stat().st_size
+    converted = failed = 0
+    last_id = 0
+    try:
+        while True:
+            rows = conn.execute(
+                "SELECT id, pixel_data, width, height FROM artworks "
+                "WHERE id > ? AND typeof(pixel_data) = 'text' ORDER BY id LIMIT ?",
+                (last_id, batch_size),
+            ).fetchall()
+            if not rows:
+                break
+            updates = []
+            for art_id, text, width, height in rows:
+                last_id = art_id
+                try:
+                    updates.append((pixel_codec.encode(text, width, height), art_id))
+                except pixel_codec.PixelCodecError as e:
+                    failed += 1
+                    print(f'SKIP artwork {art_id}: {e}')
+            with conn:
+                conn.executemany("UPDATE artworks SET pixel_data = ? WHERE id = ?", updates)
+            converted += len(updates)
+            print(f'Converted {converted} artworks...')
+        if converted:
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+    print(f'Converted {converted} artworks ({failed} skipped). '
+          f'DB size {size_before} -> {db_file.stat().st_size} bytes')
+    return converted
+
+
+if __name__ == '__main__':
+    target = Path(sys.argv[1]) if len(sys.argv) > 1 else DB_FILE
+    if not target.exists():
+        print(f'{target} not found')
+        raise SystemExit(1)
+    migrate(target)
@@ -1,81 +1,672 @@
+"""Load a PostgreSQL schema/dump (database.sql, or pg_dump output) into SQLite.
+
+The dump is read in chunks and split into statements by a small tokenizer
+that knows about quoted strings, identifiers, comments and $$ bodies, so
+semicolons inside them are safe and memory stays bounded whatever the dump's
+size. Then, per statement:
+- CREATE TABLE / INDEX / VIEW are rewritten to SQLite types and syntax;
+- INSERTs run as they are, and COPY ... FROM stdin blocks become batched
+  executemany() INSERTs; rows are committed every --batch-rows;
+- ALTER TABLE ... ADD CONSTRAINT UNIQUE / PRIMARY KEY become unique indexes;
+- plpgsql trigger functions and their CREATE TRIGGERs are translated into
+  SQLite triggers (IF TG_OP branches, NEW.col := ... assignments and plain
+  SQL) and created after the data is in, so they do not fire on it. The
+  sales_analytics and likes_count triggers are skipped unless --all-triggers
+  is given: crud.record_purchase and counters.py do that work in the app.
+- anything else (SET, sequences, grants, ...) is skipped and counted.
+
+Each commit also records how far into the dump it got, so an interrupted run
+continues from there when started again with the same arguments (--restart
+starts over); otherwise an existing target is backed up first, as before.
+
+    python migrate_sql_to_sqlite.py [dump.sql] [target.db] [--batch-rows N]
+"""
+import argparse
+import io
+import json
 import re
 import sqlite3
-from pathlib import Path
+import sys
+import time
 from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
 
 BASE = Path(__file__).parent
 SQL_FILE = BASE / 'database.sql'
 DB_FILE = BASE / 'data.db'
+CHUNK_SIZE = 1 << 20
+BATCH_ROWS = 20000
+PROGRESS_SECONDS = 2.0
+PROGRESS_TABLE = '_migration_progress'
+# the app keeps these up to date itself (crud.record_purchase, counters.py)
+APP_MAINTAINED_TRIGGERS = {'trigger_update_sales_analytics', 'trigger_update_likes_count'}
+
+
+# -- tokenizer ---------------------------------------------------------------
+
+class Item:
+    """A statement (kind "stmt"), a COPY data row ("row") or the end of a COPY
+    block ("copy_end"); end is the dump offset just past it"""
+    __slots__ = ('kind', 'text', 'end')
+
+    def __init__(self, kind: str, text, end: int):
+        self.kind, self.text, self.end = kind, text, end
+
+
+_SPECIAL = re.compile(rb";|'|\"|\$|--|/\*")
+_DOLLAR_TAG = re.compile(rb'\$([A-Za-z_][A-Za-z_0-9]*)?\$')
+_COPY_FROM_STDIN = re.compile(r'^COPY\s.+\sFROM\s+stdin', re.IGNORECASE | re.DOTALL)
+_ESCAPED_STRING_END = re.compile(rb"[\\']")
+_IDENT_BYTES = b'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_'
+
+
+class SQLStream:
+    """Split a dump into statements without loading it. Works on bytes (every
+    SQL delimiter is ASCII, which never occurs inside a UTF-8 sequence), so the
+    offsets it reports can be seeked to when resuming."""
+
+    def __init__(self, f, offset: int = 0, in_copy: bool = False, chunk_size: int = CHUNK_SIZE):
+        f.seek(offset)
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = b''
+        self.base = offset  # dump offset of buf[0]
+        self.start = 0  # buf[:start] has been handed out
+        self.eof = False
+        self.in_copy = in_copy
+
+    def _more(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf += chunk
+        return True
+
+    def _compact(self):
+        """Forget what has been handed out, once that is worth a copy"""
+        if self.start and (self.start >= len(self.buf) or self.start > self.chunk_size):
+            self.buf = self.buf[self.start:]
+            self.base += self.start
+            self.start = 0
+
+    def _find(self, needle, pos: int) -> int:
+        """Index of needle (bytes or compiled pattern) at or after pos, reading
+        more as needed; -1 at end of input"""
+        while True:
+            if isinstance(needle, bytes):
+                i = self.buf.find(needle, pos)
+            else:
+                m = needle.search(self.buf, pos)
+                i = m.start() if m else -1
+            if i >= 0:
+                return i
+            if not self._more():
+                return -1
+
+    def __iter__(self) -> Iterator[Item]:
+        while True:
+            if self.in_copy:
+                yield from self._copy_rows()
+                self.in_copy = False
+            text = self._statement()
+            if text is None:
+                return
+            yield Item('stmt', text, self.base + self.start)
+            if _COPY_FROM_STDIN.match(strip_comments(text)):
+                self.in_copy = True
+
+    def _copy_rows(self) -> Iterator[Item]:
+        if self.start >= len(self.buf):
+            self._compact()
+            self._more()
+        if self.buf[self.start:self.start + 1] == b'\n':
+            self.start += 1  # the newline after "FROM stdin;"
+        while True:
+            nl = self.buf.find(b'\n', self.start)
+            if nl < 0:
+                self._compact()
+                if self._more():
+                    continue
+                nl = len(self.buf)
+            line = self.buf[self.start:nl].rstrip(b'\r')
+            self.start = min(nl + 1, len(self.buf))
+            if line == b'\\.' or (not line and nl == len(self.buf)):
+                yield Item('copy_end', None, self.base + self.start)
+                return
+            yield Item('row', line, self.base + self.start)
+
+    def _skip_blank(self, pos: int) -> int:
+        """Past whitespace, line comments and psql meta-commands (\\connect,
+        \\restrict), which are lines rather than statements"""
+        while True:
+            while pos < len(self.buf) or self._more():
+                if self.buf[pos:pos + 1] in (b' ', b'\t', b'\r', b'\n'):
+                    pos += 1
+                else:
+                    break
+            if not (self.buf[pos:pos + 1] == b'\\' or self.buf.startswith(b'--', pos)):
+                return pos
+            nl = self._find(b'\n', pos)
+            pos = nl + 1 if nl >= 0 else len(self.buf)
+
+    def _statement(self) -> Optional[str]:
+        self._compact()
+        pos = self.start = self._skip_blank(self.start)
+        while True:
+            i = self._find(_SPECIAL, pos)
+            if i < 0:
+                text = self.buf[self.start:].decode('utf-8', 'replace')
+                self.start = len(self.buf)
+                return text if strip_comments(text) else None
+            c = self.buf[i:i + 1]
+            if c == b';':
+                text = self.buf[self.start:i + 1].decode('utf-8', 'replace')
+                self.start = i + 1
+                if strip_comments(text[:-1]):
+                    return text
+                pos = self.start = self._skip_blank(self.start)
+            elif c == b"'":
+                escapes = i > 0 and self.buf[i - 1:i] in (b'E', b'e') and (
+                    i < 2 or self.buf[i - 2:i - 1] not in _IDENT_BYTES)
+                pos = self._end_of_string(i + 1, escapes)
+            elif c == b'"':
+                pos = self._end_of_quoted(i + 1, b'"')
+            elif c == b'-':
+                nl = self._find(b'\n', i)
+                pos = nl + 1 if nl >= 0 else len(self.buf)
+            elif c == b'/':
+                close = self._find(b'*/', i + 2)
+                pos = close + 2 if close >= 0 else len(self.buf)
+            else:  # $
+                pos = self._end_of_dollar_quote(i)
 
-if not SQL_FILE.exists():
-    print('database.sql not found')
-    raise SystemExit(1)
-
-# Backup existing DB
-if DB_FILE.exists():
-    bak = BASE / f'data.db.bak.{datetime.now().strftime("%Y%m%d%H%M%S")}'
-    DB_FILE.rename(bak)
-    print(f'Existing DB backed up to {bak}')
-
-sql = SQL_FILE.read_text()
-# Remove dollar-quoted function bodies and plpgsql blocks
-# Remove CREATE OR REPLACE FUNCTION ... LANGUAGE plpgsql; blocks
-sql = re.sub(r"CREATE OR REPLACE FUNCTION[\s\S]*?LANGUAGE plpgsql;", "", sql, flags=re.IGNORECASE)
-# Remove CREATE TRIGGER lines that reference those functions (best-effort: keep CREATE TRIGGER lines but they may fail)
-# We'll remove remaining "CREATE TRIGGER ... FOR EACH ROW EXECUTE FUNCTION ...;" patterns
-sql = re.sub(r"CREATE TRIGGER[\s\S]*?EXECUTE FUNCTION[\s\S]*?;", "", sql, flags=re.IGNORECASE)
-
-# Basic type conversions
-replacements = [
-    (r"\bSERIAL\b", "INTEGER"),
-    (r"\bVARCHAR\(\d+\)\b", "TEXT"),
-    (r"\bDECIMAL\(\d+,\s*\d+\)\b", "NUMERIC"),
-    (r"\bBOOLEAN\b", "INTEGER"),
-    (r"\bTIMESTAMP\b", "TEXT"),
-    (r"DEFAULT\s+CURRENT_TIMESTAMP", "DEFAULT (datetime('now'))"),
-    (r"ON DELETE CASCADE", "ON DELETE CASCADE"),
+    def _end_of_string(self, pos: int, escapes: bool) -> int:
+        pattern = _ESCAPED_STRING_END if escapes else b"'"
+        while True:
+            i = self._find(pattern, pos)
+            if i < 0:
+                return len(self.buf)
+            if self.buf[i:i + 1] == b'\\':
+                pos = i + 2
+                continue
+            if self.buf[i + 1:i + 2] == b'' and not self.eof:
+                self._more()
+            if self.buf[i + 1:i + 2] == b"'":
+                pos = i + 2  # '' inside a string
+                continue
+            return i + 1
+
+    def _end_of_quoted(self, pos: int, quote: bytes) -> int:
+        while True:
+            i = self._find(quote, pos)
+            if i < 0:
+                return len(self.buf)
+            if self.buf[i + 1:i + 2] == b'' and not self.eof:
+                self._more()
+            if self.buf[i + 1:i + 2] == quote:
+                pos = i + 2
+                continue
+            return i + 1
+
+    def _end_of_dollar_quote(self, i: int) -> int:
+        if i > 0 and self.buf[i - 1:i] in _IDENT_BYTES:
+            return i + 1  # $ inside an identifier, or a $1 parameter
+        while len(self.buf) - i < 64 and self._more():
+            pass
+        m = _DOLLAR_TAG.match(self.buf, i)
+        if not m:
+            return i + 1
+        close = self._find(m.group(0), m.end())
+        return close + len(m.group(0)) if close >= 0 else len(self.buf)
+
+
+def split_statements(sql: str) -> List[str]:
+    """The statements of an in-memory SQL text, e.g. a function body"""
+    return [item.text for item in SQLStream(io.BytesIO(sql.encode())) if item.kind == 'stmt']
+
+
+_LEADING_COMMENTS = re.compile(r'^(?:\s+|--[^\n]*(?:\n|$)|/\*.*?\*/)+', re.DOTALL)
+
+
+def strip_comments(text: str) -> str:
+    return _LEADING_COMMENTS.sub('', text).strip()
+
+
+# -- dialect -----------------------------------------------------------------
+
+_TYPE_REWRITES = [
+    (r'\bBIGSERIAL\b|\bSMALLSERIAL\b|\bSERIAL\b', 'INTEGER'),
+    (r'\bcharacter varying(\(\d+\))?|\bVARCHAR\(\d+\)|\bcharacter\(\d+\)', 'TEXT'),
+    (r'\b(DECIMAL|NUMERIC)\(\d+,\s*\d+\)', 'NUMERIC'),
+    (r'\bdouble precision\b', 'REAL'),
+    (r'\bBOOLEAN\b', 'INTEGER'),
+    (r'\bBYTEA\b', 'BLOB'),
+    (r'\bjsonb?\b|\buuid\b', 'TEXT'),
+    (r'\bTIMESTAMP( with(out)? time zone)?\b', 'TEXT'),
+    (r'DEFAULT\s+CURRENT_TIMESTAMP|DEFAULT\s+now\(\)', "DEFAULT (datetime('now'))"),
+    (r"\s+DEFAULT\s+nextval\('[^']*'(::regclass)?\)", ''),
+    (r'::(character varying|timestamp( with(out)? time zone)?|double precision|[a-z_]+)(\(\d+(,\s*\d+)?\))?', ''),
+    (r'\bUSING\s+btree\s*', ''),
+    (r'\bpublic\.', ''),
+    (r'\bONLY\s+', ''),
 ]
-for patt, repl in replacements:
-    sql = re.sub(patt, repl, sql, flags=re.IGNORECASE)
-
-# Remove "CREATE VIEW ... AS SELECT ... GROUP BY ...;" - SQLite supports CREATE VIEW, so keep it
-# Convert "ON CONFLICT (seller_id, artwork_id) DO UPDATE SET" - SQLite uses ON CONFLICT clause at table level or use UPSERT syntax
-# We'll replace the ON CONFLICT ... DO UPDATE snippet inside the function blocks (already removed), so safe.
-
-# Remove PG-specific "ALTER TABLE ... ADD CONSTRAINT ... UNIQUE (...)" convert to CREATE UNIQUE INDEX
-alter_uniques = re.findall(r"ALTER TABLE\s+(\w+)\s+ADD CONSTRAINT\s+(\w+)\s+UNIQUE\s*\(([^)]+)\);", sql, flags=re.IGNORECASE)
-for table, cname, cols in alter_uniques:
-    cols_clean = cols.strip()
-    idx_stmt = f"CREATE UNIQUE INDEX IF NOT EXISTS idx_unique_{table}_{cname} ON {table}({cols_clean});"
-    sql += "\n" + idx_stmt + "\n"
-# Remove ALTER TABLE ADD CONSTRAINT lines
-sql = re.sub(r"ALTER TABLE[\s\S]*?ADD CONSTRAINT[\s\S]*?;", "", sql, flags=re.IGNORECASE)
-
-# Ensure statements end with semicolons
-stmts = [s.strip() for s in sql.split(';') if s.strip()]
-
-conn = sqlite3.connect(DB_FILE)
-cur = conn.cursor()
-
-executed = 0
-for s in stmts:
-    # skip language or create function remnants
-    low = s.lower()
-    if low.startswith('create or replace function') or 'language plpgsql' in low:
-        continue
-    try:
-        cur.execute(s + ';')
-        executed += 1
-    except Exception as e:
-        print('SKIP/ERROR executing statement:', e)
-        print('Statement snippet:', s[:200].replace('\n',' '))
+_TYPE_REWRITES = [(re.compile(p, re.IGNORECASE), r) for p, r in _TYPE_REWRITES]
+
+
+def rewrite_ddl(sql: str) -> str:
+    for pattern, replacement in _TYPE_REWRITES:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+_BOOLEAN_COLUMN = re.compile(r'^\s*"?(\w+)"?\s+boolean\b', re.IGNORECASE | re.MULTILINE)
+_BYTEA_COLUMN = re.compile(r'^\s*"?(\w+)"?\s+bytea\b', re.IGNORECASE | re.MULTILINE)
+_TABLE_NAME = re.compile(r'^CREATE\s+(?:UNLOGGED\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(?:public\.)?"?(\w+)"?',
+                         re.IGNORECASE)
+_ADD_UNIQUE = re.compile(r'^ALTER\s+TABLE\s+(?:ONLY\s+)?(?:public\.)?"?(\w+)"?\s+ADD\s+CONSTRAINT\s+"?(\w+)"?\s+'
+                         r'(UNIQUE|PRIMARY\s+KEY)\s*\(([^)]+)\)', re.IGNORECASE)
+_COPY_HEADER = re.compile(r'^COPY\s+(?:public\.)?"?(\w+)"?\s*(?:\(([^)]*)\))?\s+FROM\s+stdin', re.IGNORECASE)
+_INSERT_TABLE = re.compile(r'^(INSERT\s+INTO\s+)public\.', re.IGNORECASE)
+_FUNCTION = re.compile(r'^CREATE\s+(?:OR\s+REPLACE\s+)?FUNCTION\s+(?:public\.)?(\w+)\s*\(\s*\)\s*RETURNS\s+TRIGGER',
+                       re.IGNORECASE)
+_FUNCTION_BODY = re.compile(r'(\$\w*\$)(.*)\1', re.DOTALL)
+_TRIGGER = re.compile(
+    r'^CREATE\s+(?:OR\s+REPLACE\s+)?TRIGGER\s+"?(\w+)"?\s+(BEFORE|AFTER)\s+(.+?)\s+ON\s+(?:ONLY\s+)?(?:public\.)?"?(\w+)"?'
+    r'\s+FOR\s+EACH\s+ROW\s+(?:WHEN\s*\((.+)\)\s+)?EXECUTE\s+(?:FUNCTION|PROCEDURE)\s+(?:public\.)?(\w+)\s*\(\s*\)',
+    re.IGNORECASE | re.DOTALL)
+
+
+class Unsupported(ValueError):
+    pass
+
+
+_BRANCH = re.compile(r"^(IF|ELSIF|ELSEIF)\s+TG_OP\s*=\s*'(\w+)'\s+THEN\b\s*", re.IGNORECASE)
+_ASSIGNMENT = re.compile(r'^NEW\.(\w+)\s*:?=\s*(.+)$', re.IGNORECASE | re.DOTALL)
+
 
-conn.commit()
+def parse_trigger_body(body: str) -> List[Tuple[Optional[str], str]]:
+    """(TG_OP the statement is limited to or None, statement) for a simple
+    plpgsql trigger body: BEGIN, IF/ELSIF TG_OP = '...' THEN, SQL, NEW.x := y,
+    RETURN, END"""
+    out = []
+    branch, taken = None, set()
+    for raw in split_statements(body):
+        text = strip_comments(raw.rstrip().rstrip(';'))
+        while text:
+            upper = text.upper()
+            if upper.startswith('BEGIN'):
+                text = text[5:].strip()
+                continue
+            m = _BRANCH.match(text)
+            if m:
+                branch = m.group(2).upper()
+                taken.add(branch)
+                text = text[m.end():]
+                continue
+            if re.match(r'^ELSE\b', upper):
+                branch = ('ELSE', frozenset(taken))
+                text = text[4:].strip()
+                continue
+            if re.match(r'^END(\s+IF)?$', upper):
+                if upper != 'END':
+                    branch, taken = None, set()
+                text = ''
+                continue
+            if upper.startswith('RETURN'):
+                text = ''
+                continue
+            if re.match(r'^(DECLARE|PERFORM|RAISE|IF|LOOP|FOR|WHILE|CASE)\b', upper) or 'TG_' in upper:
+                raise Unsupported(f'plpgsql construct: {text[:60]}')
+            out.append((branch, text))
+            text = ''
+    return out
+
+
+def translate_trigger(statement: str, functions: Dict[str, str]) -> List[str]:
+    """SQLite CREATE TRIGGER statements (one per event) for a PostgreSQL one"""
+    m = _TRIGGER.match(statement)
+    if not m:
+        raise Unsupported('not a row-level trigger calling a function')
+    name, timing, events, table, when, function = m.groups()
+    if function not in functions:
+        raise Unsupported(f'function {function} was not translated')
+    body = parse_trigger_body(functions[function])
+    events = [e.strip().upper() for e in re.split(r'\s+OR\s+', events, flags=re.IGNORECASE)]
+    out = []
+    for event in events:
+        op = event.split()[0]
+        statements, assigned = [], []
+        for branch, text in body:
+            applies = (branch is None or branch == op
+                       or (isinstance(branch, tuple) and op not in branch[1]))
+            if not applies:
+                continue
+            a = _ASSIGNMENT.match(text)
+            if a:
+                if op == 'DELETE':
+                    raise Unsupported('assignment to NEW in a DELETE trigger')
+                assigned.append((a.group(1), a.group(2).strip()))
+            else:
+                statements.append(rewrite_ddl(text))
+        event_timing, conditions = timing.upper(), [rewrite_ddl(when)] if when else []
+        if assigned:
+            # SQLite cannot change NEW, so write the values back after the row is stored,
+            # unless the statement already set them itself
+            event_timing = 'AFTER'
+            sets = ', '.join(f'{col} = {expr}' for col, expr in assigned)
+            statements.append(f'UPDATE {table} SET {sets} WHERE rowid = NEW.rowid')
+            if op == 'UPDATE':
+                conditions += [f'NEW.{col} IS OLD.{col}' for col, _ in assigned]
+        if not statements:
+            continue
+        trigger_name = name if len(events) == 1 else f'{name}_{op.lower()}'
+        when_clause = f" WHEN {' AND '.join(f'({c})' for c in conditions)}" if conditions else ''
+        out.append(f'CREATE TRIGGER IF NOT EXISTS {trigger_name} {event_timing} {event} ON {table} '
+                   f'FOR EACH ROW{when_clause} BEGIN ' + '; '.join(statements) + '; END')
+    return out
+
+
+_COPY_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v', '\\': '\\'}
+_COPY_ESCAPE = re.compile(r'\\(?:([bfnrtv\\])|([0-7]{1,3})|x([0-9A-Fa-f]{1,2})|(.))')
+
+
+def _copy_escape(m) -> str:
+    if m.group(1):
+        return _COPY_ESCAPES[m.group(1)]
+    if m.group(2):
+        return chr(int(m.group(2), 8))
+    if m.group(3):
+        return chr(int(m.group(3), 16))
+    return m.group(4)
+
+
+def _unescape_copy(value: str) -> str:
+    return _COPY_ESCAPE.sub(_copy_escape, value)
+
+
+_STRING_LITERAL = re.compile(r"(?<![\w'])[Ee]'((?:[^'\\]|\\.|'')*)'|'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"", re.DOTALL)
+
+
+def standard_strings(sql: str) -> str:
+    """E'...' literals (backslash escapes) as plain SQL strings"""
+    if "E'" not in sql and "e'" not in sql:
+        return sql
+    return _STRING_LITERAL.sub(lambda m: m.group(0) if m.group(1) is None else
+                               "'" + _unescape_copy(m.group(1).replace("''", "'")).replace("'", "''") + "'", sql)
+
+
+def parse_copy_row(line: bytes, booleans: List[bool], blobs: List[bool]) -> list:
+    """A COPY text-format line: tab-separated, \\N for NULL, backslash escapes"""
+    values = []
+    for i, field in enumerate(line.decode('utf-8', 'replace').split('\t')):
+        if field == '\\N':
+            values.append(None)
+            continue
+        value = _unescape_copy(field) if '\\' in field else field
+        if i < len(blobs) and blobs[i] and value.startswith('\\x'):
+            value = bytes.fromhex(value[2:])
+        elif i < len(booleans) and booleans[i]:
+            value = 1 if value in ('t', 'true') else 0
+        values.append(value)
+    return values
+
+
+# -- migration ---------------------------------------------------------------
+
+class Migration:
+    def __init__(self, source: Path, target: Path, batch_rows: int = BATCH_ROWS,
+                 all_triggers: bool = False, strict: bool = False, quiet: bool = False):
+        self.source = source
+        self.target = target
+        self.batch_rows = batch_rows
+        self.all_triggers = all_triggers
+        self.strict = strict
+        self.quiet = quiet
+        self.size = source.stat().st_size
+        self.conn: Optional[sqlite3.Connection] = None
+        # survives restarts through the progress table
+        self.state = {'offset': 0, 'copy': None, 'functions': {}, 'triggers': [], 'columns': {},
+                      'statements': 0, 'rows': 0, 'skipped': {}, 'errors': 0}
+        self.pending_rows: List[list] = []
+        self.uncommitted = 0
+        self.last_report = 0.0
+        self.started = time.monotonic()
+        self.start_offset = 0
+
+    # progress / resume
+
+    def _fingerprint(self) -> str:
+        return f'{self.source.resolve()}:{self.size}:{int(self.source.stat().st_mtime)}'
+
+    def open(self, restart: bool = False) -> bool:
+        """Connect to the target; True if an earlier run is being resumed"""
+        resumable = self.target.exists() and not restart and self._saved_state() is not None
+        if self.target.exists() and not resumable:
+            bak = self.target.with_name(f'{self.target.name}.bak.{datetime.now().strftime("%Y%m%d%H%M%S")}')
+            self.target.rename(bak)
+            for suffix in ('-wal', '-shm'):
+                Path(f'{self.target}{suffix}').unlink(missing_ok=True)
+            self.log(f'Existing DB backed up to {bak}')
+        self.conn = sqlite3.connect(self.target, isolation_level=None)
+        for pragma in ('journal_mode = WAL', 'synchronous = OFF', 'cache_size = -200000', 'temp_store = MEMORY'):
+            self.conn.execute(f'PRAGMA {pragma}')
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS {PROGRESS_TABLE} '
+                          '(source TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at TEXT)')
+        if resumable:
+            self.state.update(json.loads(self._saved_state()))
+            self.start_offset = self.state['offset']
+            self.log(f'Resuming at byte {self.start_offset} of {self.size} '
+                     f'({self.state["rows"]} rows already loaded)')
+        self.conn.execute('BEGIN')
+        return resumable
+
+    def _saved_state(self) -> Optional[str]:
+        conn = sqlite3.connect(self.target)
+        try:
+            row = conn.execute(f'SELECT state FROM {PROGRESS_TABLE} WHERE source = ?',
+                               (self._fingerprint(),)).fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def commit(self, offset: int):
+        self._flush_rows()
+        self.state['offset'] = offset
+        self.conn.execute(f'INSERT OR REPLACE INTO {PROGRESS_TABLE} VALUES (?, ?, ?)',
+                          (self._fingerprint(), json.dumps(self.state), datetime.now().isoformat()))
+        self.conn.execute('COMMIT')
+        self.conn.execute('BEGIN')
+        self.uncommitted = 0
+        self.report(offset, force=offset == self.size)
+
+    def report(self, offset: int, force: bool = False):
+        now = time.monotonic()
+        if self.quiet or (not force and now - self.last_report < PROGRESS_SECONDS):
+            return
+        self.last_report = now
+        elapsed = now - self.started
+        rate = (offset - self.start_offset) / elapsed if elapsed else 0
+        eta = (self.size - offset) / rate if rate else 0
+        print(f'{offset / self.size * 100 if self.size else 100:5.1f}%  {offset / 1e6:,.1f} / {self.size / 1e6:,.1f} MB  '
+              f'{self.state["rows"]:,} rows  {rate / 1e6:.1f} MB/s  ETA {eta:.0f} s', file=sys.stderr)
+
+    def log(self, message: str):
+        if not self.quiet:
+            print(message)
+
+    def fail(self, what: str, exc: Exception, text: str):
+        self.state['errors'] += 1
+        if self.strict:
+            raise SystemExit(f'{what}: {exc}\n{text[:200]}')
+        print(f'SKIP/ERROR {what}: {exc}')
+        print('Statement snippet:', text[:200].replace('\n', ' '))
+
+    # statements
+
+    def run(self):
+        with self.source.open('rb') as f:
+            stream = SQLStream(f, self.state['offset'], in_copy=self.state['copy'] is not None)
+            kinds = None  # boolean / bytea flags of the columns being copied
+            for item in stream:
+                if item.kind == 'row':
+                    if self.state['copy'] is None:
+                        continue  # rows of a COPY that could not be set up, already reported
+                    if kinds is None:
+                        kinds = self._copy_kinds()
+                    self.pending_rows.append(parse_copy_row(item.text, *kinds))
+                    if len(self.pending_rows) >= self.batch_rows:
+                        self.commit(item.end)
+                    continue
+                if item.kind == 'copy_end':
+                    self._flush_rows()
+                    self.state['copy'], kinds = None, None
+                    self.uncommitted += 1
+                else:
+                    self.execute(item.text)
+                if self.uncommitted >= self.batch_rows or item.kind == 'copy_end':
+                    self.commit(item.end)
+        self.commit(self.size)
+        self.create_triggers()
+        self.conn.execute(f'DELETE FROM {PROGRESS_TABLE} WHERE source = ?', (self._fingerprint(),))
+        self.conn.execute('COMMIT')
+        self.conn.execute(f'DROP TABLE IF EXISTS {PROGRESS_TABLE}')
+
+    def execute(self, raw: str):
+        text = strip_comments(raw).rstrip().rstrip(';').rstrip()
+        upper = text[:40].upper()
+        self.state['statements'] += 1
+        self.uncommitted += 1
+        if upper.startswith('INSERT'):
+            self._run(standard_strings(_INSERT_TABLE.sub(r'\1', text)), 'insert', rows=True)
+        elif upper.startswith('COPY'):
+            self._start_copy(text)
+        elif re.match(r'CREATE\s+(UNLOGGED\s+)?TABLE', upper):
+            self._remember_columns(text)
+            self._run(rewrite_ddl(text), 'create table')
+        elif re.match(r'CREATE\s+(UNIQUE\s+)?INDEX|CREATE\s+(OR\s+REPLACE\s+)?VIEW', upper):
+            self._run(rewrite_ddl(text).replace('CREATE OR REPLACE VIEW', 'CREATE VIEW'), 'create index/view')
+        elif re.match(r'CREATE\s+(OR\s+REPLACE\s+)?FUNCTION', upper):
+            self._remember_function(text)
+        elif re.match(r'CREATE\s+(OR\s+REPLACE\s+)?TRIGGER', upper):
+            self._remember_trigger(text)
+        elif upper.startswith('ALTER') and _ADD_UNIQUE.match(text):
+            table, constraint, _, columns = _ADD_UNIQUE.match(text).groups()
+            self._run(f'CREATE UNIQUE INDEX IF NOT EXISTS idx_unique_{table}_{constraint} ON {table}({columns.strip()})',
+                      'add constraint')
+        else:
+            words = text.split()[:2]
+            kind = ' '.join(words if words[0].upper() in ('CREATE', 'ALTER', 'DROP') else words[:1]).upper()
+            self.state['skipped'][kind] = self.state['skipped'].get(kind, 0) + 1
+
+    def _run(self, sql: str, what: str, rows: bool = False):
+        try:
+            cursor = self.conn.execute(sql)
+        except sqlite3.Error as exc:
+            self.fail(what, exc, sql)
+            return
+        if rows:
+            self.state['rows'] += max(cursor.rowcount, 0)
+
+    def _remember_columns(self, text: str):
+        m = _TABLE_NAME.match(text)
+        if m:
+            self.state['columns'][m.group(1)] = {
+                'boolean': _BOOLEAN_COLUMN.findall(text), 'bytea': _BYTEA_COLUMN.findall(text),
+            }
+
+    def _remember_function(self, text: str):
+        m, body = _FUNCTION.match(text), _FUNCTION_BODY.search(text)
+        if m and body and re.search(r'LANGUAGE\s+plpgsql', text, re.IGNORECASE):
+            self.state['functions'][m.group(1)] = body.group(2)
+        else:
+            self.state['skipped']['CREATE FUNCTION'] = self.state['skipped'].get('CREATE FUNCTION', 0) + 1
+
+    def _remember_trigger(self, text: str):
+        name = _TRIGGER.match(text).group(1) if _TRIGGER.match(text) else '?'
+        if name in APP_MAINTAINED_TRIGGERS and not self.all_triggers:
+            self.log(f'Trigger {name} left out: the app maintains this itself (--all-triggers to keep it)')
+            return
+        try:
+            self.state['triggers'].extend(translate_trigger(text, self.state['functions']))
+        except Unsupported as exc:
+            self.fail(f'trigger {name} not translated', exc, text)
+
+    def _start_copy(self, text: str):
+        m = _COPY_HEADER.match(text)
+        if not m:
+            self.fail('copy', ValueError('unsupported COPY'), text)
+            return
+        table, columns = m.group(1), m.group(2)
+        if columns:
+            names = [c.strip().strip('"') for c in columns.split(',')]
+        else:
+            names = [r[1] for r in self.conn.execute(f'PRAGMA table_info("{table}")')]
+        self.state['copy'] = {'table': table, 'columns': names}
+
+    def _copy_kinds(self) -> Tuple[List[bool], List[bool]]:
+        copy = self.state['copy']
+        kinds = self.state['columns'].get(copy['table'], {})
+        return ([c in kinds.get('boolean', ()) for c in copy['columns']],
+                [c in kinds.get('bytea', ()) for c in copy['columns']])
+
+    def _flush_rows(self):
+        if not self.pending_rows:
+            return
+        copy = self.state['copy']
+        columns = ', '.join(f'"{c}"' for c in copy['columns'])
+        marks = ', '.join('?' * len(copy['columns']))
+        try:
+            self.conn.executemany(f'INSERT INTO "{copy["table"]}" ({columns}) VALUES ({marks})', self.pending_rows)
+            self.state['rows'] += len(self.pending_rows)
+        except sqlite3.Error as exc:
+            self.fail(f'copy into {copy["table"]}', exc, repr(self.pending_rows[0]))
+        self.pending_rows = []
+
+    def create_triggers(self):
+        for sql in self.state['triggers']:
+            self._run(sql, 'create trigger')
+
+    def summary(self):
+        for row in self.conn.execute(
+                f"SELECT name, type FROM sqlite_master WHERE type IN ('table','index','view','trigger') "
+                f"AND name != '{PROGRESS_TABLE}' ORDER BY type, name"):
+            self.log(str(row))
+        skipped = ', '.join(f'{k} x{n}' for k, n in sorted(self.state['skipped'].items())) or 'none'
+        self.log(f'Executed {self.state["statements"]} statements, loaded {self.state["rows"]} rows, '
+                 f'{self.state["errors"]} errors, in {time.monotonic() - self.started:.1f} s. '
+                 f'Skipped: {skipped}. DB at: {self.target}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('source', nargs='?', default=str(SQL_FILE), help='SQL dump (default database.sql)')
+    parser.add_argument('target', nargs='?', default=str(DB_FILE), help='SQLite file (default data.db)')
+    parser.add_argument('--batch-rows', type=int, default=BATCH_ROWS, help='rows or statements per transaction')
+    parser.add_argument('--restart', action='store_true', help='ignore an interrupted earlier run')
+    parser.add_argument('--all-triggers', action='store_true',
+                        help='also create the triggers whose work the app already does')
+    parser.add_argument('--strict', action='store_true', help='stop at the first failing statement')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args(argv)
+
+    source, target = Path(args.source), Path(args.target)
+    if not source.exists():
+        print(f'{source} not found')
+        raise SystemExit(1)
+    migration = Migration(source, target, args.batch_rows, args.all_triggers, args.strict, args.quiet)
+    migration.open(restart=args.restart)
+    try:
+        migration.run()
+        migration.summary()
+    finally:
+        migration.conn.close()
 
-# Print tables created
-cur.execute("SELECT name, type FROM sqlite_master WHERE type IN ('table','index','view') ORDER BY type, name;")
-for row in cur.fetchall():
-    print(row)
 
-print(f'Executed {executed} statements (best-effort). DB at: {DB_FILE}')
-conn.close()
+if __name__ == '__main__':
+    main()
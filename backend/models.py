@@ -1,7 +1,31 @@
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Union
+from pydantic import validator
+from sqlalchemy import Column, Index, Integer, LargeBinary
+from sqlalchemy.types import TypeDecorator
 from sqlmodel import SQLModel, Field, Relationship
 
+import pixel_codec
+
+
+class PixelBlob(TypeDecorator):
+    """LargeBinary that also reads legacy JSON text rows (see migrate_pixel_data.py)"""
+    impl = LargeBinary
+    cache_ok = True
+
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            if value is None or isinstance(value, str):
+                return value
+            return bytes(value)
+        return process
+
+
+def _unpack_pixel_data(cls, v):
+    if isinstance(v, (bytes, str)):
+        return pixel_codec.decode(v)
+    return v
+
 
 class User(SQLModel, table=True):
     """Maps to users table in database.sql"""
@@ -18,19 +42,31 @@ class User(SQLModel, table=True):
     artworks: List["Artwork"] = Relationship(back_populates="creator")
 
 
-class Artwork(SQLModel, table=True):
-    """Maps to artworks table in database.sql"""
-    __tablename__ = "artworks"
-    id: Optional[int] = Field(default=None, primary_key=True)
+# Columns loaded by GET /users/ unless ?fields= asks for others
+USER_SUMMARY_FIELDS = ("id", "wallet_address", "profile_url", "username", "avatar_url")
+USER_LIST_FIELDS = ("id", "wallet_address", "profile_url", "username", "bio", "avatar_url", "created_at", "updated_at")
+
+
+class UserListItem(SQLModel):
+    """A projected users row; only the selected columns are present"""
+    id: Optional[int] = None
+    wallet_address: Optional[str] = None
+    profile_url: Optional[str] = None
+    username: Optional[str] = None
+    bio: Optional[str] = None
+    avatar_url: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+
+class ArtworkBase(SQLModel):
     artwork_code: str = Field(nullable=False, sa_column_kwargs={"unique": True}, max_length=14)
     creator_id: int = Field(foreign_key="users.id", nullable=False)
     creator_wallet: str = Field(nullable=False)
     title: str = Field(nullable=False)
     description: Optional[str] = None
-    pixel_data: str = Field(nullable=False)
     width: int = Field(nullable=False)
     height: int = Field(nullable=False)
-    unlock_password: str = Field(nullable=False, max_length=6)
     price_flow: Optional[float] = None
     publish_fee: Optional[float] = None
     is_published: Optional[bool] = Field(default=False)
@@ -42,11 +78,148 @@ class Artwork(SQLModel, table=True):
     published_at: Optional[datetime] = None
     updated_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
 
+
+# bumped by every ORM update; an update whose row changed underneath it raises
+# StaleDataError instead of overwriting (see crud.update_artwork)
+_artwork_version = Column("version", Integer, nullable=False, server_default="1")
+
+
+class Artwork(ArtworkBase, table=True):
+    """Maps to artworks table in database.sql"""
+    __tablename__ = "artworks"
+    # keyset pagination indexes, see crud.list_artworks
+    __table_args__ = (
+        Index("idx_artworks_published_id", "published_at", "id"),
+        Index("idx_artworks_creator_published_id", "creator_id", "published_at", "id"),
+    )
+    __mapper_args__ = {"version_id_col": _artwork_version}
+    id: Optional[int] = Field(default=None, primary_key=True)
+    # packed palette/RLE blob, see pixel_codec.py (legacy rows may still hold JSON text)
+    pixel_data: bytes = Field(sa_column=Column(PixelBlob, nullable=False))
+    version: int = Field(default=1, sa_column=_artwork_version)
+    # legacy plaintext unlock code, blanked once hashed; kept off ArtworkBase so
+    # ArtworkRead can't return it
+    unlock_password: str = Field(nullable=False, max_length=6)
+    # salted scrypt hash of the unlock password (passwords.py); never returned by the API
+    unlock_hash: Optional[str] = None
+
     creator: Optional[User] = Relationship(back_populates="artworks")
 
 
+class ArtworkRead(ArtworkBase):
+    """Artwork as returned by the API, with pixel_data unpacked to a list of rows"""
+    id: int
+    version: int = 1
+    pixel_data: Optional[pixel_codec.Grid] = None
+
+    _unpack_pixel_data = validator("pixel_data", pre=True, allow_reuse=True)(_unpack_pixel_data)
+
+
+class ArtworkCreator(SQLModel):
+    """The public part of an artwork's creator"""
+    id: int
+    wallet_address: str
+    profile_url: str
+    username: Optional[str] = None
+    avatar_url: Optional[str] = None
+
+
+class ArtworkDetail(ArtworkRead):
+    """Artwork modal: the artwork with its creator, comment count and, for a
+    viewer, whether they unlocked or bought it (crud.get_artwork_detail)"""
+    creator: Optional[ArtworkCreator] = None
+    comments_count: int = 0
+    viewer_unlocked: bool = False
+    viewer_purchased: bool = False
+
+
+# Creator columns joined into artwork cards, as creator_<name>
+ARTWORK_CREATOR_FIELDS = ("id", "wallet_address", "profile_url", "username", "avatar_url")
+
+
+class ArtworkCard(SQLModel):
+    """Marketplace card: summary columns plus what ArtworkDetail adds, without pixels"""
+    id: int
+    artwork_code: str
+    title: str
+    thumbnail_url: Optional[str] = None
+    price_flow: Optional[float] = None
+    views_count: Optional[int] = None
+    likes_count: Optional[int] = None
+    creator: Optional[ArtworkCreator] = None
+    comments_count: int = 0
+    viewer_unlocked: bool = False
+    viewer_purchased: bool = False
+
+
+# Columns loaded by GET /artworks/ unless ?fields= asks for others.
+# unlock_password is never selectable in listings.
+ARTWORK_SUMMARY_FIELDS = (
+    "id", "artwork_code", "title", "thumbnail_url", "price_flow", "views_count", "likes_count",
+)
+ARTWORK_LIST_FIELDS = (
+    "id", "artwork_code", "creator_id", "creator_wallet", "title", "description", "pixel_data", "width",
+    "height", "price_flow", "publish_fee", "is_published", "nft_id", "thumbnail_url", "views_count",
+    "likes_count", "created_at", "published_at", "updated_at", "version",
+)
+
+
+class ArtworkListItem(SQLModel):
+    """A projected artworks row; only the selected columns are present"""
+    id: Optional[int] = None
+    artwork_code: Optional[str] = None
+    creator_id: Optional[int] = None
+    creator_wallet: Optional[str] = None
+    title: Optional[str] = None
+    description: Optional[str] = None
+    pixel_data: Optional[pixel_codec.Grid] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    price_flow: Optional[float] = None
+    publish_fee: Optional[float] = None
+    is_published: Optional[bool] = None
+    nft_id: Optional[int] = None
+    thumbnail_url: Optional[str] = None
+    views_count: Optional[int] = None
+    likes_count: Optional[int] = None
+    created_at: Optional[datetime] = None
+    published_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    version: Optional[int] = None
+
+    _unpack_pixel_data = validator("pixel_data", pre=True, allow_reuse=True)(_unpack_pixel_data)
+
+
+class ArtworkUpdate(SQLModel):
+    """PATCH /artworks/{id} body; only the fields that are sent are changed.
+
+    Pixels can be replaced whole (pixel_data, optionally with a new width and
+    height) or edited in place with cells ([x, y, colour] triples) and rects
+    (see pixel_codec.apply_patch). version, when sent, must match the stored
+    one or the update is rejected, so concurrent editors don't overwrite
+    each other."""
+    title: Optional[str] = None
+    description: Optional[str] = None
+    width: Optional[int] = Field(None, ge=1, le=pixel_codec.MAX_DIM)
+    height: Optional[int] = Field(None, ge=1, le=pixel_codec.MAX_DIM)
+    unlock_password: Optional[str] = None
+    price_flow: Optional[float] = None
+    publish_fee: Optional[float] = None
+    is_published: Optional[bool] = None
+    nft_id: Optional[int] = None
+    thumbnail_url: Optional[str] = None
+    pixel_data: Optional[Union[list, str]] = None
+    cells: Optional[List[list]] = None
+    rects: Optional[List[dict]] = None
+    version: Optional[int] = None
+
+
 class Purchase(SQLModel, table=True):
     __tablename__ = "purchases"
+    __table_args__ = (
+        Index("idx_artwork_purchases", "artwork_id"),
+        Index("idx_buyer_purchases", "buyer_id"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     artwork_id: int = Field(foreign_key="artworks.id", nullable=False)
     buyer_id: int = Field(foreign_key="users.id", nullable=False)
@@ -59,6 +232,10 @@ class Purchase(SQLModel, table=True):
 
 class Like(SQLModel, table=True):
     __tablename__ = "likes"
+    __table_args__ = (
+        Index("idx_artwork_likes", "artwork_id"),
+        Index("idx_user_likes", "user_id"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     artwork_id: int = Field(foreign_key="artworks.id", nullable=False)
     user_id: int = Field(foreign_key="users.id", nullable=False)
@@ -67,6 +244,7 @@ class Like(SQLModel, table=True):
 
 class Comment(SQLModel, table=True):
     __tablename__ = "comments"
+    __table_args__ = (Index("idx_artwork_comments", "artwork_id"),)
     id: Optional[int] = Field(default=None, primary_key=True)
     artwork_id: int = Field(foreign_key="artworks.id", nullable=False)
     user_id: int = Field(foreign_key="users.id", nullable=False)
@@ -77,14 +255,56 @@ class Comment(SQLModel, table=True):
 
 class PasswordUnlock(SQLModel, table=True):
     __tablename__ = "password_unlocks"
+    __table_args__ = (Index("idx_artwork_unlocks", "artwork_id"),)
     id: Optional[int] = Field(default=None, primary_key=True)
     artwork_id: int = Field(foreign_key="artworks.id", nullable=False)
     user_id: int = Field(foreign_key="users.id", nullable=False)
     unlocked_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
 
 
+class ArtworkHash(SQLModel, table=True):
+    """Content and perceptual hash of an artwork's pixels, see dedup.py"""
+    __tablename__ = "artwork_hashes"
+    artwork_id: int = Field(foreign_key="artworks.id", primary_key=True)
+    content_hash: str = Field(index=True, max_length=64)
+    # 64-bit dHash stored as a signed integer
+    phash: int
+    # one more than the highest so far on every write, whichever process made it,
+    # so DedupIndex can pick up edits as well as new rows
+    seq: int = Field(default=0, sa_column=Column(Integer, nullable=False, server_default="0", index=True))
+
+
+class Job(SQLModel, table=True):
+    """Background work queued for an artwork, see jobs.py"""
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("idx_jobs_due", "status", "run_after"),
+        Index("idx_jobs_artwork", "artwork_id", "kind"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str = Field(max_length=20)
+    # no foreign key: a job for a deleted artwork just finds nothing to do
+    artwork_id: int
+    # queued -> running -> deleted when done, or back to queued to retry, or failed
+    status: str = Field(default="queued", max_length=10)
+    attempts: int = 0
+    max_attempts: int = 5
+    run_after: datetime = Field(default_factory=datetime.utcnow)
+    locked_until: Optional[datetime] = None
+    last_error: Optional[str] = None
+    created_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
+
+
+class DuplicateMatch(SQLModel):
+    artwork_id: int
+    distance: int
+    exact: bool
+
+
 class SalesAnalytics(SQLModel, table=True):
+    """One row per (seller, artwork), kept up to date by crud.record_purchase"""
     __tablename__ = "sales_analytics"
+    __table_args__ = (Index("idx_unique_sales_analytics_unique_seller_artwork", "seller_id", "artwork_id", unique=True),)
     id: Optional[int] = Field(default=None, primary_key=True)
     seller_id: int = Field(foreign_key="users.id", nullable=False)
     artwork_id: int = Field(foreign_key="artworks.id", nullable=False)
@@ -92,3 +312,11 @@ class SalesAnalytics(SQLModel, table=True):
     total_revenue_flow: Optional[float] = Field(default=0.0)
     last_sale_at: Optional[datetime] = None
     updated_at: Optional[datetime] = Field(default_factory=datetime.utcnow)
+
+
+class SellerSales(SQLModel):
+    """Sells tab: per-artwork rows from sales_analytics plus their totals"""
+    seller_id: int
+    total_sales: int = 0
+    total_revenue_flow: float = 0.0
+    artworks: List[SalesAnalytics] = []
@@ -0,0 +1,55 @@
+"""Opaque keyset cursors for the list endpoints.
+
+A cursor is the sort key of the last row of a page, e.g. (published_at, id)
+for artworks or (id,) for users, packed as urlsafe base64 JSON. Clients only
+ever pass it back as ?cursor=, so the format can change freely.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Sequence, Tuple
+
+_DT_PREFIX = "dt:"
+# largest ?limit= a list endpoint serves in one page
+MAX_LIMIT = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _dump(value):
+    if isinstance(value, datetime):
+        return _DT_PREFIX + value.isoformat()
+    return value
+
+
+def _load(value):
+    if isinstance(value, str) and value.startswith(_DT_PREFIX):
+        return datetime.fromisoformat(value[len(_DT_PREFIX):])
+    return value
+
+
+def encode_cursor(*key) -> str:
+    raw = json.dumps([_dump(v) for v in key], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: Optional[str], types: Sequence) -> Optional[Tuple]:
+    """The key packed in token, or None without one. types holds the accepted
+    type (or tuple of types) of each key column; anything else is an InvalidCursor."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        key = json.loads(raw)
+        if not isinstance(key, list) or len(key) != len(types):
+            raise ValueError("wrong key size")
+        key = tuple(_load(v) for v in key)
+    except ValueError as exc:
+        raise InvalidCursor("Invalid cursor") from exc
+    for value, expected in zip(key, types):
+        # bool is an int subclass but never a sort key
+        if isinstance(value, bool) or not isinstance(value, expected):
+            raise InvalidCursor("Invalid cursor")
+    return key
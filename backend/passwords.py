@@ -0,0 +1,217 @@
+"""Unlock passwords: salted scrypt hashes, verified off the event loop.
+
+Artworks keep the hash in artworks.unlock_hash as
+"scrypt$<log2 n>$<r>$<p>$<salt>$<key>" (base64), and unlock_password is
+blanked. The cost is tunable with PIXELLAR_UNLOCK_SCRYPT_LOG_N (14, about
+60 ms per check); old hashes keep verifying after it changes. Hashing and
+verifying run on a small dedicated thread pool (scrypt releases the GIL), so
+a burst of attempts queues there instead of stalling requests.
+
+Rows from before this still hold the plaintext; those are
+compared in constant time and upgraded to a hash on the first successful
+unlock, or all at once with:
+
+    python passwords.py backfill
+
+python passwords.py hash <password> prints an unlock_hash for bulk import lines.
+
+UnlockLimiter token buckets, per user and artwork, per artwork and per client
+address (acquire_attempt), are what POST /artworks/{id}/unlock checks before
+doing any of that work.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+SCHEME = "scrypt"
+LOG_N = int(os.getenv("PIXELLAR_UNLOCK_SCRYPT_LOG_N", 14))
+BLOCK_SIZE = 8
+PARALLELISM = 1
+SALT_BYTES = 16
+KEY_BYTES = 32
+POOL_WORKERS = int(os.getenv("PIXELLAR_UNLOCK_WORKERS", 2))
+DEFAULT_PASSWORD = "000000"
+MAX_LENGTH = 6
+
+# attempts per user and artwork: RATE per minute on average, up to BURST at once
+RATE_PER_MINUTE = float(os.getenv("PIXELLAR_UNLOCK_RATE", 5))
+BURST = int(os.getenv("PIXELLAR_UNLOCK_BURST", 5))
+# user ids are free to make, so every artwork and every client address also get a
+# bucket of their own that holds whatever user_id the attempt claims
+ARTWORK_RATE_PER_MINUTE = float(os.getenv("PIXELLAR_UNLOCK_ARTWORK_RATE", 30))
+ARTWORK_BURST = int(os.getenv("PIXELLAR_UNLOCK_ARTWORK_BURST", 30))
+CLIENT_RATE_PER_MINUTE = float(os.getenv("PIXELLAR_UNLOCK_CLIENT_RATE", 20))
+CLIENT_BURST = int(os.getenv("PIXELLAR_UNLOCK_CLIENT_BURST", 20))
+LIMITER_MAX_KEYS = 100_000
+BACKFILL_BATCH = 500
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _scrypt(password: str, salt: bytes, log_n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=1 << log_n, r=r, p=p,
+                          maxmem=256 * r * (1 << log_n), dklen=KEY_BYTES)
+
+
+def hash_password(password: str, log_n: int = LOG_N) -> str:
+    salt = secrets.token_bytes(SALT_BYTES)
+    key = _scrypt(password, salt, log_n, BLOCK_SIZE, PARALLELISM)
+    return f"{SCHEME}${log_n}${BLOCK_SIZE}${PARALLELISM}${_b64(salt)}${_b64(key)}"
+
+
+def is_hash(value) -> bool:
+    """Whether value has the shape hash_password produces"""
+    if not isinstance(value, str):
+        return False
+    parts = value.split("$")
+    return (len(parts) == 6 and parts[0] == SCHEME and all(p.isdigit() for p in parts[1:4])
+            and all(parts[4:]))
+
+
+def verify_password(password: str, stored_hash: Optional[str], legacy_plaintext: Optional[str] = None) -> bool:
+    """Check password against a hash from hash_password, or, for rows not
+    upgraded yet, against the stored plaintext"""
+    if stored_hash:
+        try:
+            scheme, log_n, r, p, salt, key = stored_hash.split("$")
+            if scheme != SCHEME:
+                return False
+            candidate = _scrypt(password, _unb64(salt), int(log_n), int(r), int(p))
+        except ValueError:
+            return False
+        return hmac.compare_digest(candidate, _unb64(key))
+    if legacy_plaintext:
+        return hmac.compare_digest(password.encode(), legacy_plaintext.encode())
+    return False
+
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=POOL_WORKERS, thread_name_prefix="pixellar-kdf")
+        return _pool
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+async def hash_password_async(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(get_pool(), hash_password, password)
+
+
+async def verify_password_async(password: str, stored_hash: Optional[str],
+                                legacy_plaintext: Optional[str] = None) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(
+        get_pool(), verify_password, password, stored_hash, legacy_plaintext
+    )
+
+
+class UnlockLimiter:
+    """Token buckets keyed by (user_id, artwork_id); the least recently used
+    keys are dropped beyond max_keys (a dropped bucket was idle, so full anyway
+    or close to it)"""
+
+    def __init__(self, rate_per_minute: float = RATE_PER_MINUTE, burst: int = BURST,
+                 max_keys: int = LIMITER_MAX_KEYS):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def acquire(self, key) -> Tuple[bool, float]:
+        """Take a token; returns (allowed, seconds until the next token)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            else:
+                self.rejected += 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        retry_after = 0.0 if tokens >= 1 else (1 - tokens) / self.rate if self.rate else float("inf")
+        return allowed, retry_after
+
+
+limiter = UnlockLimiter()
+artwork_limiter = UnlockLimiter(ARTWORK_RATE_PER_MINUTE, ARTWORK_BURST)
+client_limiter = UnlockLimiter(CLIENT_RATE_PER_MINUTE, CLIENT_BURST)
+
+
+def acquire_attempt(user_id: int, artwork_id: int, client: Optional[str]) -> Tuple[bool, float]:
+    """Take a token from the client's, the artwork's and the user's bucket; the
+    attempt is allowed only if all three had one"""
+    checks = [(client_limiter, client), (artwork_limiter, artwork_id), (limiter, (user_id, artwork_id))]
+    allowed, retry_after = True, 0.0
+    for bucket, key in checks:
+        if key is None:
+            continue
+        ok, wait = bucket.acquire(key)
+        if not ok:
+            allowed, retry_after = False, max(retry_after, wait)
+    return allowed, retry_after
+
+
+def backfill(batch_size: int = BACKFILL_BATCH) -> int:
+    """Hash every remaining plaintext unlock_password; returns the rows updated"""
+    from sqlalchemy import text
+
+    import database
+
+    done = 0
+    while True:
+        with database.engine.begin() as conn:
+            rows = conn.execute(text(
+                "SELECT id, unlock_password FROM artworks "
+                "WHERE unlock_hash IS NULL AND unlock_password != '' LIMIT :n"
+            ), {"n": batch_size}).all()
+            if not rows:
+                return done
+            conn.execute(
+                text("UPDATE artworks SET unlock_hash = :h, unlock_password = '' WHERE id = :id"),
+                [{"id": row.id, "h": hash_password(row.unlock_password)} for row in rows],
+            )
+        done += len(rows)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "hash":
+        # an unlock_hash for bulk import lines
+        print(hash_password(sys.argv[2]))
+        raise SystemExit
+    if sys.argv[1:] != ["backfill"]:
+        raise SystemExit("usage: python passwords.py backfill | hash <password>")
+    import database
+
+    database.init_db()
+    print(f"Hashed {backfill()} unlock passwords")
@@ -0,0 +1,288 @@
+"""Packed binary storage for artwork pixel grids.
+
+Artworks used to keep their pixels as a JSON text column (a list of rows of
+hex colour strings). That is very wasteful for pixel art, which only uses a
+handful of colours and long runs of the same colour. Grids are now stored as:
+
+    magic "PXL" | version (u8) | width (u16) | height (u16) | palette size (u16)
+    palette entries (RGBA, 4 bytes each)
+    zlib( run-length encoded palette indices as (run, index) varint pairs )
+
+Decoding gives back a list of rows where every cell is "#RRGGBB",
+"#RRGGBBAA" (when not fully opaque) or None (fully transparent).
+"""
+import json
+import struct
+import zlib
+from typing import List, Optional, Sequence, Tuple, Union
+
+MAGIC = b"PXL"
+VERSION = 1
+_HEADER = struct.Struct(">3sBHHH")
+
+TRANSPARENT = (0, 0, 0, 0)
+# largest canvas side accepted from clients; the header itself could hold 65535
+MAX_DIM = 1024
+
+Grid = List[List[Optional[str]]]
+RGBA = Tuple[int, int, int, int]
+
+
+class PixelCodecError(ValueError):
+    pass
+
+
+def is_packed(data) -> bool:
+    return isinstance(data, (bytes, bytearray, memoryview)) and bytes(data[:3]) == MAGIC
+
+
+def parse_color(value) -> RGBA:
+    """Parse "#RGB", "#RRGGBB" or "#RRGGBBAA" (null / "" means transparent)."""
+    if value is None or value == "" or value == "transparent":
+        return TRANSPARENT
+    if isinstance(value, (list, tuple)):
+        if len(value) in (3, 4) and all(isinstance(c, int) and 0 <= c <= 255 for c in value):
+            return tuple(value) if len(value) == 4 else (*value, 255)
+        raise PixelCodecError(f"invalid colour: {value!r}")
+    if not isinstance(value, str):
+        raise PixelCodecError(f"invalid colour: {value!r}")
+    h = value.lstrip("#")
+    try:
+        if len(h) == 3:
+            return (int(h[0] * 2, 16), int(h[1] * 2, 16), int(h[2] * 2, 16), 255)
+        if len(h) == 6:
+            return (int(h[0:2], 16), int(h[2:4], 16), int(h[4:6], 16), 255)
+        if len(h) == 8:
+            return (int(h[0:2], 16), int(h[2:4], 16), int(h[4:6], 16), int(h[6:8], 16))
+    except ValueError:
+        pass
+    raise PixelCodecError(f"invalid colour: {value!r}")
+
+
+def format_color(rgba: RGBA) -> Optional[str]:
+    r, g, b, a = rgba
+    if a == 0:
+        return None
+    if a == 255:
+        return f"#{r:02X}{g:02X}{b:02X}"
+    return f"#{r:02X}{g:02X}{b:02X}{a:02X}"
+
+
+def _write_varint(out: bytearray, n: int) -> None:
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_varint(buf: bytes, pos: int) -> Tuple[int, int]:
+    n = shift = 0
+    while True:
+        if pos >= len(buf):
+            raise PixelCodecError("truncated pixel stream")
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _check_size(width, height) -> None:
+    for name, n in (("width", width), ("height", height)):
+        if n is not None and (not isinstance(n, int) or isinstance(n, bool) or not 0 <= n <= MAX_DIM):
+            raise PixelCodecError(f"{name} must be an integer from 0 to {MAX_DIM}, got {n!r}")
+
+
+def _flatten(pixels, width: Optional[int], height: Optional[int]) -> Tuple[List, int, int]:
+    """Turn a list of rows (or a flat list) into a flat cell list padded to width*height."""
+    if not isinstance(pixels, (list, tuple)):
+        raise PixelCodecError(f"pixel_data must be a list of rows, got {type(pixels).__name__}")
+    _check_size(width, height)
+    # rows are lists of cells; a flat list of [r, g, b(, a)] cells starts with an int
+    if pixels and isinstance(pixels[0], list) and not (pixels[0] and isinstance(pixels[0][0], int)):
+        rows = pixels
+        if not all(isinstance(r, (list, tuple)) for r in rows):
+            raise PixelCodecError("pixel_data rows must be lists of cells")
+        height = height or len(rows)
+        width = width or max((len(r) for r in rows), default=0)
+        _check_size(width, height)
+        flat = []
+        for y in range(height):
+            row = rows[y] if y < len(rows) else []
+            flat.extend(row[:width])
+            if len(row) < width:
+                flat.extend([None] * (width - len(row)))
+        return flat, width, height
+    if width is None or height is None:
+        raise PixelCodecError("width and height are required for a flat pixel list")
+    flat = list(pixels[: width * height])
+    flat.extend([None] * (width * height - len(flat)))
+    return flat, width, height
+
+
+def encode(pixels: Union[str, bytes, Sequence, None], width: Optional[int] = None, height: Optional[int] = None) -> bytes:
+    """Pack a pixel grid. Accepts a JSON string, a list of rows, a flat list
+    (with width/height) or an already packed blob, which is returned as is."""
+    if is_packed(pixels):
+        return bytes(pixels)
+    if isinstance(pixels, (bytes, bytearray, str)):
+        try:
+            if not isinstance(pixels, str):
+                pixels = pixels.decode("utf-8")
+            pixels = json.loads(pixels) if pixels.strip() else []
+        except ValueError as exc:
+            raise PixelCodecError(f"pixel_data is not valid JSON: {exc}") from exc
+    if isinstance(pixels, dict):
+        width = width or pixels.get("width")
+        height = height or pixels.get("height")
+        pixels = pixels.get("pixels")
+    if pixels is None:
+        pixels = []
+    if not pixels and (width is None or height is None):
+        width, height = width or 0, height or 0
+
+    flat, width, height = _flatten(pixels, width, height)
+    return _pack(width, height, (parse_color(cell) for cell in flat))
+
+
+def _pack(width: int, height: int, cells) -> bytes:
+    """Pack width*height RGBA tuples, palette in order of first use."""
+    if width > 0xFFFF or height > 0xFFFF:
+        raise PixelCodecError("canvas too large")
+
+    palette: dict = {}
+    stream = bytearray()
+    prev_idx = None
+    run = 0
+    for rgba in cells:
+        if rgba[3] == 0:
+            rgba = TRANSPARENT
+        idx = palette.get(rgba)
+        if idx is None:
+            idx = palette[rgba] = len(palette)
+        if idx == prev_idx:
+            run += 1
+            continue
+        if run:
+            _write_varint(stream, run)
+            _write_varint(stream, prev_idx)
+        prev_idx, run = idx, 1
+    if run:
+        _write_varint(stream, run)
+        _write_varint(stream, prev_idx)
+
+    out = bytearray(_HEADER.pack(MAGIC, VERSION, width, height, len(palette)))
+    for rgba in palette:
+        out.extend(bytes(rgba))
+    out.extend(zlib.compress(bytes(stream), 9))
+    return bytes(out)
+
+
+def read_header(blob: bytes) -> Tuple[int, int, List[RGBA]]:
+    """Return (width, height, palette) without inflating the pixel stream."""
+    blob = bytes(blob)
+    if len(blob) < _HEADER.size:
+        raise PixelCodecError("pixel blob too short")
+    magic, version, width, height, n = _HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise PixelCodecError("not a packed pixel blob")
+    if version != VERSION:
+        raise PixelCodecError(f"unsupported pixel blob version {version}")
+    off = _HEADER.size
+    palette = [tuple(blob[off + 4 * i: off + 4 * i + 4]) for i in range(n)]
+    return width, height, palette
+
+
+def decode_indices(blob: bytes) -> Tuple[int, int, List[RGBA], List[int]]:
+    """Return (width, height, palette, flat index list)."""
+    blob = bytes(blob)
+    width, height, palette = read_header(blob)
+    total = width * height
+    # the packer never writes more than a 1-byte run and a 3-byte index per pixel,
+    # so anything that inflates past that is not ours (or is a zlib bomb)
+    inflater = zlib.decompressobj()
+    try:
+        body = inflater.decompress(blob[_HEADER.size + 4 * len(palette):], 4 * total + 16)
+    except zlib.error as exc:
+        raise PixelCodecError(f"corrupt pixel stream: {exc}") from exc
+    if inflater.unconsumed_tail:
+        raise PixelCodecError("pixel stream larger than the canvas")
+    if not inflater.eof:
+        raise PixelCodecError("truncated pixel stream")
+    indices: List[int] = []
+    pos = 0
+    while pos < len(body):
+        run, pos = _read_varint(body, pos)
+        idx, pos = _read_varint(body, pos)
+        if idx >= len(palette):
+            raise PixelCodecError("palette index out of range")
+        if len(indices) + run > total:
+            raise PixelCodecError("pixel count does not match canvas size")
+        indices.extend([idx] * run)
+    if len(indices) != width * height:
+        raise PixelCodecError("pixel count does not match canvas size")
+    return width, height, palette, indices
+
+
+def _coord(value, what: str) -> int:
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise PixelCodecError(f"{what} must be an integer, got {value!r}")
+    return value
+
+
+def apply_patch(blob: bytes, cells: Sequence = (), rects: Sequence = ()) -> bytes:
+    """Apply a pixel diff to a packed grid and return the new blob. cells are
+    (x, y, colour) triples; rects are dicts with x, y and either width, height
+    and one fill "color", or "pixels" as a list of rows painted from (x, y).
+    The canvas size never changes; anything outside it is an error."""
+    width, height, palette, indices = decode_indices(blob)
+    pixels = [palette[i] for i in indices]
+
+    def put(x: int, y: int, value):
+        if not (0 <= x < width and 0 <= y < height):
+            raise PixelCodecError(f"pixel ({x}, {y}) is outside the {width}x{height} canvas")
+        pixels[y * width + x] = parse_color(value)
+
+    for cell in cells:
+        if not isinstance(cell, (list, tuple)) or len(cell) != 3:
+            raise PixelCodecError(f"invalid cell: {cell!r}")
+        x, y, value = cell
+        put(_coord(x, "cell x"), _coord(y, "cell y"), value)
+    for rect in rects:
+        if not isinstance(rect, dict):
+            raise PixelCodecError(f"invalid rectangle: {rect!r}")
+        x0, y0 = _coord(rect.get("x", 0), "rectangle x"), _coord(rect.get("y", 0), "rectangle y")
+        rows = rect.get("pixels")
+        if rows is not None:
+            if not isinstance(rows, list) or not all(isinstance(row, list) for row in rows):
+                raise PixelCodecError("rectangle pixels must be a list of rows")
+            for dy, row in enumerate(rows):
+                for dx, value in enumerate(row):
+                    put(x0 + dx, y0 + dy, value)
+            continue
+        w, h = _coord(rect.get("width", 0), "rectangle width"), _coord(rect.get("height", 0), "rectangle height")
+        if w <= 0 or h <= 0 or x0 < 0 or y0 < 0 or x0 + w > width or y0 + h > height:
+            raise PixelCodecError(f"rectangle {x0},{y0} {w}x{h} is outside the {width}x{height} canvas")
+        rgba = parse_color(rect.get("color"))
+        for y in range(y0, y0 + h):
+            pixels[y * width + x0:y * width + x0 + w] = [rgba] * w
+    return _pack(width, height, pixels)
+
+
+def decode(data: Union[bytes, str, None]) -> Grid:
+    """Unpack stored pixel_data into a list of rows. Legacy JSON text is
+    parsed and returned unchanged so unmigrated rows keep working."""
+    if data is None:
+        return []
+    if not is_packed(data):
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data).decode("utf-8")
+        return json.loads(data) if data.strip() else []
+    width, height, palette, indices = decode_indices(data)
+    colors = [format_color(c) for c in palette]
+    return [[colors[i] for i in indices[y * width:(y + 1) * width]] for y in range(height)]
+
+
+def to_json(data: Union[bytes, str, None]) -> str:
+    return json.dumps(decode(data), separators=(",", ":"))
@@ -0,0 +1,26 @@
+"""Recompute sales_analytics from the purchases table.
+
+New purchases keep sales_analytics current on their own (crud.record_purchase);
+run this once to backfill purchases recorded before that, or to repair the
+table. Pass a seller id to rebuild just that seller's rows:
+
+    python rebuild_sales_analytics.py [seller_id]
+"""
+import sys
+
+import crud
+import database
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    seller_id = int(argv[0]) if argv else None
+    database.init_db()
+    with database.SessionLocal() as db:
+        written = crud.rebuild_sales_analytics(db, seller_id)
+    target = f'seller {seller_id}' if seller_id is not None else 'all sellers'
+    print(f'Rebuilt {written} sales_analytics rows for {target}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Full-text search over artworks (SQLite FTS5).
+
+artworks_fts holds one row per artwork, keyed by rowid = artworks.id, with
+the title, description and the creator's username. Deleting an artwork removes
+its row in the same transaction (remove_artwork); creates and updates queue a
+search job that re-indexes it moments later (index_artwork, see jobs.py), so it
+never needs a rescan; rebuild() repopulates it from scratch.
+
+Queries are split into words and every word is matched as a prefix
+("sun set" -> "sun"* "set"*), ranked by bm25 with the title weighted highest.
+"""
+import re
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+
+FTS_TABLE = "artworks_fts"
+# bm25 weights, in column order: title, description, creator
+WEIGHTS = (10.0, 2.0, 5.0)
+MAX_TERMS = 8
+
+_CREATE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "title, description, creator, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+_INDEX_SELECT = (
+    f"INSERT INTO {FTS_TABLE} (rowid, title, description, creator) "
+    "SELECT a.id, a.title, COALESCE(a.description, ''), COALESCE(u.username, '') "
+    "FROM artworks a LEFT JOIN users u ON u.id = a.creator_id"
+)
+
+
+def ensure_index(engine) -> bool:
+    """Create artworks_fts if it is missing and fill it; returns True if it was created"""
+    with engine.begin() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :n"), {"n": FTS_TABLE}
+        ).first()
+        if exists:
+            return False
+        conn.execute(text(_CREATE))
+        conn.execute(text(_INDEX_SELECT))
+    return True
+
+
+def rebuild(conn) -> int:
+    conn.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    return conn.execute(text(_INDEX_SELECT)).rowcount
+
+
+def index_artwork(conn, artwork_id: int) -> None:
+    """(Re)index one artwork from its stored row"""
+    conn.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {"id": artwork_id})
+    conn.execute(text(_INDEX_SELECT + " WHERE a.id = :id"), {"id": artwork_id})
+
+
+def index_artwork_codes(conn, codes: Sequence[str]) -> None:
+    """Index artworks by code, for bulk inserts that don't know the new ids"""
+    if not codes:
+        return
+    params = {f"c{i}": c for i, c in enumerate(codes)}
+    placeholders = ", ".join(f":{k}" for k in params)
+    conn.execute(
+        text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT id FROM artworks WHERE artwork_code IN ({placeholders}))"),
+        params,
+    )
+    conn.execute(text(_INDEX_SELECT + f" WHERE a.artwork_code IN ({placeholders})"), params)
+
+
+def remove_artwork(conn, artwork_id: int) -> None:
+    conn.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {"id": artwork_id})
+
+
+def match_expression(query: str) -> Optional[str]:
+    """Turn free text into an FTS5 prefix query; None if it has no searchable words.
+    Every word is quoted, so FTS5 operators in the input are matched literally."""
+    terms = re.findall(r"\w+", query.lower())[:MAX_TERMS]
+    if not terms:
+        return None
+    return " ".join(f'"{t}"*' for t in terms)
+
+
+def search(conn, query: str, columns: Sequence[str], limit: int,
+           after: Optional[Tuple[float, int]] = None, published_only: bool = True) -> List[dict]:
+    """Matching artworks rows (the given columns plus score and id), best first.
+    after=(score, id) of the last row of the previous page continues from there."""
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    weights = ", ".join(map(str, WEIGHTS))
+    selected = ", ".join(dict.fromkeys(f"a.{c}" for c in (*columns, "id")))
+    sql = (
+        f"SELECT {selected}, s.score FROM ("
+        f"SELECT rowid AS id, bm25({FTS_TABLE}, {weights}) AS score FROM {FTS_TABLE} "
+        f"WHERE {FTS_TABLE} MATCH :q) s JOIN artworks a ON a.id = s.id"
+    )
+    where = []
+    params = {"q": expression, "limit": limit}
+    if published_only:
+        where.append("a.is_published = 1")
+    if after is not None:
+        where.append("(s.score, s.id) > (:score, :id)")
+        params.update(score=after[0], id=after[1])
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY s.score, s.id LIMIT :limit"
+    return [dict(r) for r in conn.execute(text(sql), params).mappings()]
@@ -0,0 +1,227 @@
+"""Server-side thumbnails rendered from packed pixel_data.
+
+PNGs are written directly from the palette (indexed colour + tRNS), so they
+need nothing beyond the stdlib; WebP needs Pillow and is only offered when it
+is installed. Rendering happens in a process pool and results are kept in a
+content-addressed on-disk cache with LRU eviction by total size.
+"""
+import asyncio
+import hashlib
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional, Tuple
+
+import pixel_codec
+
+try:
+    from PIL import Image
+except ImportError:  # WebP is optional
+    Image = None
+
+BASE = Path(__file__).parent
+CACHE_DIR = Path(os.getenv("PIXELLAR_THUMB_DIR", BASE / "thumbnails"))
+CACHE_MAX_BYTES = int(os.getenv("PIXELLAR_THUMB_CACHE_BYTES", 256 * 1024 * 1024))
+POOL_WORKERS = int(os.getenv("PIXELLAR_THUMB_WORKERS", 2))
+
+SCALES = (1, 2, 4, 8)
+DEFAULT_SCALE = 4
+MAX_SIDE = 2048
+# thumbnails change when the artwork is edited, so let clients revalidate via ETag
+CACHE_CONTROL = "public, max-age=60, stale-while-revalidate=600"
+MEDIA_TYPES = {"png": "image/png", "webp": "image/webp"}
+
+
+class ThumbnailError(ValueError):
+    pass
+
+
+def formats() -> Tuple[str, ...]:
+    return ("png", "webp") if Image is not None else ("png",)
+
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+
+def _scaled_rows(width: int, height: int, indices, scale: int):
+    for y in range(height):
+        row = indices[y * width:(y + 1) * width]
+        line = b"".join(bytes((i,)) * scale for i in row) if scale > 1 else bytes(row)
+        for _ in range(scale):
+            yield line
+
+
+def render_png(blob: bytes, scale: int = DEFAULT_SCALE) -> bytes:
+    width, height, palette, indices = pixel_codec.decode_indices(blob)
+    if not width or not height:
+        width, height, palette, indices = 1, 1, [pixel_codec.TRANSPARENT], [0]
+
+    if len(palette) <= 256:
+        # indexed colour: one byte per pixel plus PLTE/tRNS
+        header = struct.pack(">IIBBBBB", width * scale, height * scale, 8, 3, 0, 0, 0)
+        plte = b"".join(bytes(c[:3]) for c in palette)
+        trns = bytes(c[3] for c in palette)
+        raw = b"".join(b"\x00" + line for line in _scaled_rows(width, height, indices, scale))
+        chunks = [_png_chunk(b"IHDR", header), _png_chunk(b"PLTE", plte)]
+        if any(a != 255 for a in trns):
+            chunks.append(_png_chunk(b"tRNS", trns))
+    else:
+        header = struct.pack(">IIBBBBB", width * scale, height * scale, 8, 6, 0, 0, 0)
+        rgba = [bytes(c) for c in palette]
+        raw = b"".join(
+            b"\x00" + b"".join(rgba[i] for i in line)
+            for line in _scaled_rows(width, height, indices, scale)
+        )
+        chunks = [_png_chunk(b"IHDR", header)]
+    chunks.append(_png_chunk(b"IDAT", zlib.compress(raw, 6)))
+    chunks.append(_png_chunk(b"IEND", b""))
+    return b"\x89PNG\r\n\x1a\n" + b"".join(chunks)
+
+
+def render_webp(blob: bytes, scale: int = DEFAULT_SCALE) -> bytes:
+    if Image is None:
+        raise ThumbnailError("WebP thumbnails need Pillow")
+    import io
+
+    width, height, palette, indices = pixel_codec.decode_indices(blob)
+    if not width or not height:
+        width, height, palette, indices = 1, 1, [pixel_codec.TRANSPARENT], [0]
+    img = Image.new("RGBA", (width, height))
+    img.putdata([palette[i] for i in indices])
+    if scale > 1:
+        img = img.resize((width * scale, height * scale), Image.NEAREST)
+    out = io.BytesIO()
+    img.save(out, format="WEBP", lossless=True)
+    return out.getvalue()
+
+
+def render(blob: bytes, scale: int, fmt: str) -> bytes:
+    """Process pool entry point"""
+    if fmt == "webp":
+        return render_webp(blob, scale)
+    return render_png(blob, scale)
+
+
+def cache_key(blob: bytes, scale: int, fmt: str) -> str:
+    h = hashlib.sha256(blob)
+    h.update(f"|{scale}|{fmt}".encode())
+    return h.hexdigest()
+
+
+class ThumbnailCache:
+    """Content-addressed files under root, evicted least recently used first once
+    the total size passes max_bytes. Access order survives restarts via mtime."""
+
+    def __init__(self, root: Path = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: Optional[OrderedDict] = None
+        self._size = 0
+
+    def _path(self, key: str, fmt: str) -> Path:
+        return self.root / key[:2] / f"{key}.{fmt}"
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        files = [p for p in self.root.glob("*/*") if p.is_file() and p.suffix != ".tmp"] if self.root.exists() else []
+        files.sort(key=lambda p: p.stat().st_mtime)
+        self._entries = OrderedDict((p, p.stat().st_size) for p in files)
+        self._size = sum(self._entries.values())
+
+    def get(self, key: str, fmt: str) -> Optional[bytes]:
+        path = self._path(key, fmt)
+        with self._lock:
+            self._load()
+            if path not in self._entries:
+                return None
+            self._entries.move_to_end(path)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            with self._lock:
+                self._size -= self._entries.pop(path, 0)
+            return None
+
+    def put(self, key: str, fmt: str, data: bytes) -> None:
+        path = self._path(key, fmt)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._load()
+            self._size += len(data) - self._entries.pop(path, 0)
+            self._entries[path] = len(data)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                old, size = self._entries.popitem(last=False)
+                self._size -= size
+                try:
+                    old.unlink()
+                except FileNotFoundError:
+                    pass
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            self._load()
+            return self._size
+
+
+cache = ThumbnailCache()
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS)
+        return _pool
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def check_options(scale: int, fmt: str) -> None:
+    if scale not in SCALES:
+        raise ThumbnailError(f"scale must be one of {', '.join(map(str, SCALES))}")
+    if fmt not in formats():
+        raise ThumbnailError(f"format must be one of {', '.join(formats())}")
+
+
+def etag(artwork_id: int, artwork_code: str, version: int, scale: int, fmt: str) -> str:
+    """ETag of an artwork's thumbnail, known without rendering it: every pixel
+    edit bumps version, and the same pixels always render to the same bytes"""
+    key = f"{artwork_id}|{artwork_code}|{version}|{scale}|{fmt}".encode()
+    return '"' + hashlib.blake2b(key, digest_size=12).hexdigest() + '"'
+
+
+async def get_thumbnail(blob: bytes, scale: int = DEFAULT_SCALE, fmt: str = "png") -> bytes:
+    """Return the image bytes, rendering in the process pool on a cache miss."""
+    check_options(scale, fmt)
+    width, height, _ = pixel_codec.read_header(blob)
+    if max(width, height) * scale > MAX_SIDE:
+        raise ThumbnailError(f"thumbnail larger than {MAX_SIDE}px, use a smaller scale")
+
+    key = cache_key(blob, scale, fmt)
+    loop = asyncio.get_running_loop()
+    data = await loop.run_in_executor(None, cache.get, key, fmt)
+    if data is None:
+        data = await loop.run_in_executor(get_pool(), render, blob, scale, fmt)
+        await loop.run_in_executor(None, cache.put, key, fmt, data)
+    return data
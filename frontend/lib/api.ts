@@ -5,7 +5,7 @@ export async function createOrGetUser(address: string) {
   const wallet = address.toLowerCase()
 
   try {
-    const resList = await fetch(`${API_URL}/users/?limit=1000`)
+    const resList = await fetch(`${API_URL}/users/?limit=100`)
     if (resList.ok) {
       const users = await resList.json()
       const found = users.find((u: any) => (u.wallet_address || '').toLowerCase() === wallet || (u.username || '').toLowerCase() === wallet.replace(/^0x/, ''))